@@ -1,4 +1,5 @@
 from picarx import Picarx
+from picarx.grayscale_calibration import GrayscaleCalibrator
 import time
 import threading
 import readchar 
@@ -6,6 +7,7 @@ import os
 
 px = Picarx()
 config_path = px.CONFIG
+cali = GrayscaleCalibrator(px, method='otsu')
 
 manual = f'''\
         ┌────────────────────────────────────┐
@@ -24,15 +26,10 @@ current_grayscale_value = [0, 0, 0]
 line_reference = px.line_reference
 cliff_reference = px.cliff_reference
 current_mode = None
-thresholds = [
-    [4096, 0], # min, max
-    [4096, 0],
-    [4096, 0],
-]
-line_min = [
-    4096,
-    4096,
-    4096,
+clusters = [
+    [0, 0, 0], # line mean, floor mean, separation
+    [0, 0, 0],
+    [0, 0, 0],
 ]
 
 run_flag = False
@@ -69,26 +66,13 @@ time.sleep(0.5)
 # read grayscale value thread
 # ==========================================
 def read_data_loop():
-    global current_grayscale_value, thresholds, run_flag, cali_status
+    global current_grayscale_value, run_flag
 
     while run_flag:
         try:
-            current_grayscale_value = px.get_grayscale_data()
-
-            # calculate the reference
-            if cali_status == 'work':
-                for i in range(3):
-                    if current_grayscale_value[i] < thresholds[i][0]:
-                        thresholds[i][0] = current_grayscale_value[i]
-                    if current_grayscale_value[i] > thresholds[i][1]:
-                        thresholds[i][1] = current_grayscale_value[i]
-                    line_reference[i] = int((thresholds[i][0] + thresholds[i][1])/2)
-            if cali_status == 'done':
-                if (cliff_reference[0] < line_reference[0]) and (cliff_reference[1] < line_reference[1]) and (cliff_reference[2] < line_reference[2]):
-                    cliff_reference[0] = int((cliff_reference[0] + line_reference[0]) / 2)
-                    cliff_reference[1] = int((cliff_reference[1] + line_reference[1]) / 2)
-                    cliff_reference[2] = int((cliff_reference[2] + line_reference[2]) / 2)
-                cali_status = 'none'
+            # the calibrator samples the adc itself while working
+            if cali_status != 'work':
+                current_grayscale_value = px.get_grayscale_data()
 
         except Exception as e:
             run_flag = False
@@ -117,10 +101,14 @@ def update_info(isback=True):
         clear_line_and_print("Line reference auto calibrating ...", color='33')
     elif current_mode == 'line_cali_done':
         clear_line_and_print("Line reference auto calibration done.", color='32')
+    elif current_mode == 'line_cali_failed':
+        clear_line_and_print("Line not seen clearly by every sensor, reference unchanged.", color='31')
     elif current_mode == 'cliff_cali':
         clear_line_and_print("Cliff reference auto calibrating ...", color='33')
     elif current_mode == 'cliff_cali_done':
         clear_line_and_print("Cliff reference auto calibration done.", color='32')
+    elif current_mode == 'cliff_cali_failed':
+        clear_line_and_print("Cliff too close to the line values, reference unchanged.", color='31')
     elif current_mode == 'saved':
         clear_line_and_print("The reference values has been saved.", color='32')
 
@@ -136,7 +124,7 @@ def update_info(isback=True):
         clear_line_and_print("")
 
     clear_line_and_print(f'current value: {current_grayscale_value}')
-    clear_line_and_print(f'thresholds: {thresholds}')
+    clear_line_and_print(f'line, floor, separation: {clusters}')
     clear_line_and_print(f'line reference: {line_reference}')
     clear_line_and_print(f'cliff reference: {cliff_reference}')
 
@@ -145,41 +133,16 @@ def update_info(isback=True):
 # =================================================================
 def start_line_calibrate():
     def line_calibrate_work():
-        global current_mode, cali_status, thresholds
+        global current_mode, cali_status, clusters
         current_mode = 'line_cali'
         cali_status = 'work'
-        # reset thresholds
-        thresholds = [
-            [4096, 0], # min, max
-            [4096, 0],
-            [4096, 0],
-        ]
-        _angle = 35
-        _delay = 0.8
-        # front left
-        px.set_dir_servo_angle(-_angle)
-        px.forward(10)
-        time.sleep(_delay)
-        # back left
-        px.backward(10)
-        time.sleep(_delay)
-        # stop
-        px.set_dir_servo_angle(0)
-        px.stop()
-        time.sleep(0.2)
-        # front right
-        px.set_dir_servo_angle(_angle)
-        px.forward(10)
-        time.sleep(_delay)
-        # back right
-        px.backward(10)
-        time.sleep(_delay)
-        # stop
-        px.set_dir_servo_angle(0)
-        px.stop()
-        time.sleep(0.2)
-        current_mode = 'line_cali_done'
-        cali_status = 'done'
+        # sample at full rate during the sweep, fit line/floor clusters per sensor
+        result = cali.calibrate_line()
+        clusters = [[int(c['low_mean']), int(c['high_mean']), round(c['separation'], 1)]
+                    for c in result['channels']]
+        line_reference[:] = cali.line_reference
+        current_mode = 'line_cali_done' if result['ok'] else 'line_cali_failed'
+        cali_status = 'none'
     line_calibrate_thread = threading.Thread(target=line_calibrate_work)
     line_calibrate_thread.daemon = True
     line_calibrate_thread.start()
@@ -187,33 +150,13 @@ def start_line_calibrate():
 # cliff reference calibration
 def start_cliff_calibrate():
     def cliff_calibrate_work():
-        global current_mode, cliff_reference, thresholds
+        global current_mode, cali_status
         current_mode = 'cliff_cali'
-        count = 0
-        _left_val = 0
-        _mid_val = 0
-        _right_val = 0
-
-        while True:
-            _left_val += current_grayscale_value[0]
-            _mid_val += current_grayscale_value[1]
-            _right_val += current_grayscale_value[2]
-            if count >= 10:
-                break
-            else:
-                count += 1
-            time.sleep(0.2)
-
-        _left_val /= 10
-        _mid_val /= 10
-        _right_val /= 10
-
-        if _left_val < thresholds[0][0] and _mid_val < thresholds[1][0] and _right_val < thresholds[2][0]:
-            _left_val = int((_left_val + thresholds[0][0]) / 2)
-            _mid_val = int((_mid_val + thresholds[1][0]) / 2)
-            _right_val = int((_right_val + thresholds[2][0]) / 2)
-        cliff_reference = [int(_left_val), int(_mid_val), int(_right_val)]
-        current_mode = 'cliff_cali_done'
+        cali_status = 'work'
+        result = cali.calibrate_cliff(duration=2)
+        cliff_reference[:] = cali.cliff_reference
+        current_mode = 'cliff_cali_done' if result['ok'] else 'cliff_cali_failed'
+        cali_status = 'none'
 
     cliff_calibrate_thread = threading.Thread(target=cliff_calibrate_work)
     cliff_calibrate_thread.daemon = True
@@ -249,8 +192,7 @@ def main():
             while True:
                 key = key.lower()
                 if key == 'y':
-                    px.set_line_reference(line_reference)
-                    px.set_cliff_reference(cliff_reference)
+                    cali.save()
                     current_mode = 'saved'
                     print("\033[1A\033[J", end='\r')
                     break
@@ -30,6 +30,8 @@ Press key to call the function(non-case sensitive):
 
 
 px = Picarx()
+# ramp the motors, a reversal passes through 0 instead of jumping
+px.set_motor_ramp(accel=300, jerk=3000)
 
 def take_photo():
     _time = strftime('%Y-%m-%d-%H-%M-%S',localtime(time()))
@@ -1,10 +1,11 @@
 from sunfounder_controller import SunFounderController
 from picarx import Picarx
 from picarx import utils
-from picarx.music import Music
+from picarx.obstacle_guard import CollisionGuard
+from robot_hat.speaker import Speaker, SoundBank
 from vilib import Vilib
 import os
-from time import sleep
+from time import sleep, time
 
 try:
     from tflite_runtime.interpreter import Interpreter
@@ -34,6 +35,8 @@ LINE_TRACK_ANGLE_OFFSET = 20
 AVOID_OBSTACLES_SPEED = 40
 SafeDistance = 40   # > 40 safe
 DangerDistance = 20 # > 20 && < 40 turn around, < 20 backward
+AVOID_BACKWARD_TIME = 0.5 # seconds
+avoid_backward_until = 0
 
 DETECT_COLOR = 'red' # red, green, blue, yellow , orange, purple
 last_values = {}
@@ -42,27 +45,35 @@ last_values = {}
 User = os.popen('echo ${SUDO_USER:-$LOGNAME}').readline().strip()
 UserHome = os.popen('getent passwd %s | cut -d: -f 6' %User).readline().strip()
 
-music = Music()
 if os.geteuid() != 0:
     print('\033[33mPlay sound needs to be run with sudo.\033[m')
+_status, _result = utils.run_command('sudo killall pulseaudio')
+
+# decode the sound effects once, horn() only triggers the cached buffer
+speaker = Speaker(block_size=256)
+sound_bank = SoundBank(speaker, f'{UserHome}/picar-x/sounds')
 
 def horn(): 
-    _status, _result = utils.run_command('sudo killall pulseaudio')
-    music.sound_play_threading(f'{UserHome}/picar-x/sounds/car-double-horn.wav')
+    sound_bank.trigger('car-double-horn')
+
+# filtered ultrasonic distance, limits forward() power near obstacles
+guard = CollisionGuard(stop_distance=DangerDistance - 5, slow_distance=SafeDistance)
 
 def avoid_obstacles():
-    distance = px.get_distance()
-    if distance >= SafeDistance:
+    global avoid_backward_until
+    if time() < avoid_backward_until:
+        return # still backing away
+    distance = guard.distance
+    if distance is None or distance >= SafeDistance:
         px.set_dir_servo_angle(0)
         px.forward(AVOID_OBSTACLES_SPEED)
     elif distance >= DangerDistance:
         px.set_dir_servo_angle(30)
         px.forward(AVOID_OBSTACLES_SPEED)
-        sleep(0.1)
     else:
         px.set_dir_servo_angle(-30)
         px.backward(AVOID_OBSTACLES_SPEED)
-        sleep(0.5) 
+        avoid_backward_until = time() + AVOID_BACKWARD_TIME
 
 def get_status(val_list):
     _state = px.get_line_status(val_list)  # [bool, bool, bool], 0 means line, 1 means background
@@ -118,6 +129,8 @@ def main():
     print('ip : %s'%ip)
     sc.set('video','http://'+ip+':9000/mjpg')
 
+    guard.start(px)
+
     Vilib.camera_start(vflip=False,hflip=False)
     Vilib.display(local=False, web=True)
     speak = None
@@ -128,8 +141,9 @@ def main():
         grayscale_data = px.get_grayscale_data()
         sc.set("D", grayscale_data )
 
-        distance = px.get_distance()
-        sc.set("F", distance)
+        # the guard thread owns the ultrasonic, use its filtered distance
+        distance = guard.distance
+        sc.set("F", -1 if distance is None else round(distance, 2))
 
         # --- control ---
 
@@ -163,6 +177,7 @@ def main():
         # line_track and avoid_obstacles
         line_track_switch = sc.get('I')
         avoid_obstacles_switch = sc.get('E')
+        px.set_collision_guard(guard if avoid_obstacles_switch == True else None)
         if line_track_switch == True:
             speed = LINE_TRACK_SPEED
             line_track()
@@ -221,8 +236,10 @@ if __name__ == "__main__":
         main()
     finally:
         print("stop and exit")
+        guard.stop()
         px.stop()
         Vilib.camera_close()
+        speaker.close()
 
 
 
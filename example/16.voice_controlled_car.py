@@ -1,5 +1,7 @@
 from picarx import Picarx
 from picarx.stt import Vosk
+from picarx.intent import IntentMatcher
+import threading
 import time
 
 px = Picarx()
@@ -7,8 +9,44 @@ stt = Vosk(language="en-us")
 
 
 WAKE_WORDS = ["hey robot"]
+MOVE_TIME = 1 # seconds
 
-print('Say "hey robot" to wake me up! Then say: forward / backward / left / right. Say "sleep" to stop listening.')
+print('Say "hey robot" to wake me up! Then say: forward / backward / left / right / stop. Say "sleep" to stop listening.')
+
+# moves run in the background so "stop" can be heard while the car is moving
+move_timer = None
+
+def stop():
+    global move_timer
+    if move_timer is not None:
+        move_timer.cancel()
+        move_timer = None
+    px.stop(); px.set_dir_servo_angle(0)
+
+def move(angle, speed):
+    global move_timer
+    stop()
+    px.set_dir_servo_angle(angle)
+    if speed > 0:
+        px.forward(speed)
+    else:
+        px.backward(-speed)
+    move_timer = threading.Timer(MOVE_TIME, stop)
+    move_timer.start()
+
+commands = {
+    "forward": lambda: move(0, 30),
+    "backward": lambda: move(0, -30),
+    "left": lambda: move(-25, 30),
+    "right": lambda: move(25, 30),
+    "stop": stop,
+    "sleep": stop,
+}
+intents = IntentMatcher(commands, synonyms={
+    "forward": ["ahead", "straight"],
+    "backward": ["back", "reverse"],
+    "sleep": ["go to sleep"],
+})
 
 try:
     while True:
@@ -18,42 +56,28 @@ try:
 
         # --- command loop: multiple commands after one wake ---
         while True:
-            res = stt.listen(stream=False)
-            text = res.get("text", "") if isinstance(res, dict) else str(res)
-            text = text.lower().strip()
+            text = ""
+            for result in stt.listen(stream=True):
+                if result["done"]:
+                    text = result["final"].lower().strip()
+                elif intents.is_stop(result["partial"]):
+                    # stop as soon as it's heard, don't wait for the end of the phrase
+                    stop()
             if not text:
                 continue
 
             print("Heard:", text)
 
-            if "sleep" in text:
+            names = intents.dispatch(text)
+            if names is None:
+                continue # ignore other words
+            if "sleep" in names:
                 # pause command mode; go back to wait for wake word
-                px.stop(); px.set_dir_servo_angle(0)
                 print("Sleeping. Say 'hey robot' to wake me again.")
                 break
 
-            elif "forward" in text:
-                px.set_dir_servo_angle(0)
-                px.forward(30); time.sleep(1); px.stop()
-
-            elif "backward" in text:
-                px.set_dir_servo_angle(0)
-                px.backward(30); time.sleep(1); px.stop()
-
-            elif "left" in text:
-                px.set_dir_servo_angle(-25)
-                px.forward(30); time.sleep(1)
-                px.stop(); px.set_dir_servo_angle(0)
-
-            elif "right" in text:
-                px.set_dir_servo_angle(25)
-                px.forward(30); time.sleep(1)
-                px.stop(); px.set_dir_servo_angle(0)
-            # (ignore other words)
-
 except KeyboardInterrupt:
     pass
 finally:
-    px.stop(); px.set_dir_servo_angle(0)
+    stop()
     print("Stopped and centered. Bye.")
-
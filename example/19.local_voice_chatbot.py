@@ -2,13 +2,17 @@ import re
 import time
 from picarx.llm import Ollama
 from picarx.stt import Vosk
-from picarx.tts import Piper
+from picarx.tts import Piper, TTSCache
+from picarx.speech_pipeline import SpeechPipeline
 
 stt = Vosk(language="en-us")
 
-tts = Piper()
+tts = TTSCache(Piper())
 tts.set_model("en_US-amy-low")
 
+# speak each sentence as soon as the LLM has finished it
+speech = SpeechPipeline(tts.get, tts.play_file)
+
 INSTRUCTIONS = (
     "You are a helpful assistant. Answer directly in plain English. "
     "Do NOT include any hidden thinking, analysis, or tags like <think>."
@@ -54,27 +58,22 @@ def main():
                 time.sleep(0.1)
                 continue
 
-            # Query LLM with streaming
-            reply_accum = ""
+            # Query LLM with streaming, sentences are spoken while the rest is generated
             response = llm.prompt(text, stream=True)
-            for next_word in response:
-                if next_word:
-                    print(next_word, end="", flush=True)
-                    reply_accum += next_word
-            print("")
+            reply_accum = speech.speak_stream(response, echo=True)
 
-            # Clean and speak only once
             clean = strip_thinking(reply_accum)
-            if clean:
-                tts.say(clean)
-            else:
-                tts.say("Sorry, I didn't catch that.")
+            if not clean:
+                speech.say("Sorry, I didn't catch that.")
+            speech.wait()
+            print(f"[INFO] first audio after {speech.first_audio_latency or 0:.2f} s")
 
             time.sleep(0.05)
 
     except KeyboardInterrupt:
         print("\n[INFO] Stopping...")
     finally:
+        speech.close()
         tts.say("Goodbye!")
         print("Bye.")
 
@@ -2,7 +2,7 @@
 
 from picarx import Picarx
 from vilib import Vilib
-from picarx.tts import Pico2Wave
+from picarx.tts import Pico2Wave, TTSCache
 
 from time import sleep
 import threading
@@ -28,8 +28,10 @@ Press keys to control PiCar-X:
 # -----------------------
 px = Picarx()
 
-tts = Pico2Wave()
+# cache the phrases, "Look for <color>!" is synthesized once and replayed instantly
+tts = TTSCache(Pico2Wave())
 tts.set_lang("en-US")
+tts.prewarm([f"Look for {color}!" for color in COLORS], background=True)
 
 current_color = "red"
 key = None
@@ -1,35 +1,46 @@
 from picarx import Picarx
+from picarx.obstacle_guard import CollisionGuard
 import time
 
 POWER = 50
 SafeDistance = 40   # > 40 safe
 DangerDistance = 20 # > 20 && < 40 turn around, 
                     # < 20 backward
+BACKWARD_TIME = 0.5 # seconds
 
 def main():
     try:
         px = Picarx()
         # px = Picarx(ultrasonic_pins=['D2','D3']) # tring, echo
-       
+
+        # filtered distance and closing speed, forward() slows down by itself
+        # as the time to collision gets short
+        guard = CollisionGuard(stop_distance=DangerDistance - 5, slow_distance=SafeDistance)
+        px.set_collision_guard(guard)
+        guard.start(px)
+
+        backward_until = 0
         while True:
-            distance = round(px.ultrasonic.read(), 2)
-            print("distance: ",distance)
-            if distance >= SafeDistance:
+            distance = guard.distance
+            print("distance: ", None if distance is None else round(distance, 2))
+            if time.time() < backward_until:
+                pass # keep backing away, without blocking the loop
+            elif distance is None or distance >= SafeDistance:
                 px.set_dir_servo_angle(0)
                 px.forward(POWER)
             elif distance >= DangerDistance:
                 px.set_dir_servo_angle(30)
                 px.forward(POWER)
-                time.sleep(0.1)
             else:
                 px.set_dir_servo_angle(-30)
                 px.backward(POWER)
-                time.sleep(0.5)
+                backward_until = time.time() + BACKWARD_TIME
+            time.sleep(0.02)
 
     finally:
+        guard.stop()
         px.forward(0)
 
 
 if __name__ == "__main__":
     main()
-
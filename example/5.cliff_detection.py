@@ -13,6 +13,7 @@ Manual modification:
 '''
 
 from picarx import Picarx
+from picarx.cliff_monitor import CliffMonitor
 from time import sleep
 
 px = Picarx()
@@ -20,29 +21,30 @@ px = Picarx()
 # manual modify reference value
 px.set_cliff_reference([200, 200, 200])
 
-last_state = "safe"
+# the monitor halts the motors by itself within one sample of a cliff,
+# whatever this loop is doing
+monitor = CliffMonitor(px, rate=100)
 
 if __name__ == '__main__':
     try:
+        monitor.start()
         while True:
-            gm_val_list = px.get_grayscale_data()
-            gm_state = px.get_cliff_status(gm_val_list)
-            # print("cliff status is: %s" % gm_state)
-
-            if gm_state is False:
-                state = "safe"
-                px.stop()
-            else:
-                state = "danger"
+            if monitor.tripped:
+                # take the motors back and move away from the edge
+                monitor.release()
                 px.backward(80)
-                if last_state == "safe":
-                    sleep(0.1)
-
-            last_state = state
+                sleep(0.1)
+            elif monitor.cliff:
+                px.backward(80)
+            else:
+                px.stop()
+            sleep(0.02)
 
     except KeyboardInterrupt:
         print("\nKeyboardInterrupt: stop and exit")
 
     finally:
+        monitor.stop()
+        print(monitor.metrics())
         px.stop()
         sleep(0.1)
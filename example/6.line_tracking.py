@@ -18,6 +18,7 @@ Section 3.3 — Control:
 
 from time import sleep, time
 from picarx import Picarx
+from picarx.line_estimation import centroid_error, weighted_error, LineEstimator, LineLUT
 
 # ADC import (hardware or simulation)
 try:
@@ -26,6 +27,9 @@ except ImportError:
     from sim_robot_hat import ADC
 
 
+USE_LUT = True # interpret readings with a precomputed lookup table
+
+
 # ============================================================
 # Section 3.1 — SENSING
 # ============================================================
@@ -91,50 +95,34 @@ class LineInterpreter:
         self.sensor_positions = [-1.0, 0.0, 1.0]
         self.sensitivity = max(sensitivity, 1e-3)
         self.polarity = polarity
+        self.lut = None
+
+    def use_lut(self, reference, bits=6):
+        """
+        Precompute the error of every quantized reading for this reference,
+        each calculate_error() is then a single table lookup.
+        The table is stored under ~/.cache/picarx/line_lut and reused.
+        """
+        estimator = LineEstimator('centroid', reference=reference,
+                                  polarity=self.polarity, sensitivity=self.sensitivity)
+        self.lut = LineLUT.for_estimator(estimator, bits=bits)
 
     def calculate_error(self, gm_vals, line_status):
         """
         Returns a signed error in [-1, 1].
         Negative = line left, Positive = line right
-        """
 
-        # Discrete robust cases
-        if line_status == [1, 0, 1]:
-            return 0.0
-        if line_status == [0, 1, 1]:
-            return -0.8
-        if line_status == [0, 0, 1]:
-            return -0.5
-        if line_status == [1, 0, 0]:
-            return 0.5
-        if line_status == [1, 1, 0]:
-            return 0.8
-
-        # Fallback to continuous weighted interpretation
-        return self._weighted_error(gm_vals)
+        Clear patterns ([1, 0, 1], [0, 1, 1], ...) come from STATUS_TABLE,
+        the rest from the contrast weighted centroid, see picarx.line_estimation
+        """
+        if self.lut is not None:
+            error, _ = self.lut.estimate(gm_vals)
+            return error
+        error, _ = centroid_error(gm_vals, line_status, self.polarity, self.sensitivity)
+        return error
 
     def _weighted_error(self, gm_vals):
-        total = sum(gm_vals)
-        if total == 0:
-            return 0.0
-
-        weights = []
-        for val in gm_vals:
-            if self.polarity == 'dark':
-                contrast = (total - val) / total
-            else:
-                contrast = val / total
-
-            weights.append(contrast ** self.sensitivity)
-
-        wsum = sum(weights)
-        if wsum == 0:
-            return 0.0
-
-        return sum(
-            self.sensor_positions[i] * weights[i]
-            for i in range(3)
-        ) / wsum
+        return float(weighted_error(gm_vals, self.polarity, self.sensitivity))
 
     def is_line_lost(self, line_status):
         """
@@ -206,6 +194,8 @@ if __name__ == "__main__":
         sensitivity=1.2,
         polarity='dark'
     )
+    if USE_LUT:
+        interpreter.use_lut(sensor.reference)
 
     controller = PDController(
         Kp=15.0,
@@ -1,5 +1,6 @@
 from time import sleep, time
 from picarx import Picarx
+from picarx.line_estimation import edge_error
 
 try:
     from robot_hat import ADC
@@ -50,64 +51,13 @@ class LineInterpreter:
         self.polarity = polarity
 
     def compute_error(self, v):
-        L, C, R = v
-
-        # --------------------------------------------------------
-        # 1. Remove global brightness (lighting invariance)
-        # --------------------------------------------------------
-        mu = (L + C + R) / 3.0
-        Lr, Cr, Rr = L - mu, C - mu, R - mu
-
-        # --------------------------------------------------------
-        # 2. Adjacent differences = edge signals
-        # --------------------------------------------------------
-        dLC = Cr - Lr
-        dCR = Rr - Cr
-
-        if self.polarity == 'light':
-            dLC = -dLC
-            dCR = -dCR
-
-        # --------------------------------------------------------
-        # 3. Normalize by local contrast
-        # --------------------------------------------------------
-        spread = max(abs(Lr), abs(Cr), abs(Rr)) + 1e-6
-        dLC /= spread
-        dCR /= spread
-
-        edge_mag  = max(abs(dLC), abs(dCR))
-        edge_asym = abs(abs(dLC) - abs(dCR))
-
-        use_edge = (
-            edge_mag  > EDGE_MAG_THRESH and
-            edge_asym > EDGE_ASYM_THRESH
-        )
-
-        # --------------------------------------------------------
-        # 4A. PRIMARY: Edge-based decision
-        # --------------------------------------------------------
-        if use_edge:
-            if abs(dLC) > abs(dCR):
-                e = +dLC      # line on left → steer right
-            else:
-                e = -dCR      # line on right → steer left
-
-        # --------------------------------------------------------
-        # 4B. FALLBACK: Brightness centroid (curve-safe)
-        # --------------------------------------------------------
-        else:
-            # darker = more weight for dark line
-            wL = -Lr
-            wC = -Cr
-            wR = -Rr
-
-            denom = abs(wL) + abs(wC) + abs(wR) + 1e-6
-            e = (-1*wL + 0*wC + 1*wR) / denom
-
-        # --------------------------------------------------------
-        # 5. Soft clamp (prevents snapping)
-        # --------------------------------------------------------
-        return max(-1.0, min(1.0, 0.7 * e))
+        # 1. remove global brightness (lighting invariance)
+        # 2. adjacent differences = edge signals, normalized by local contrast
+        # 3. edge based decision, brightness centroid as fallback (curve-safe)
+        # 4. soft clamp (prevents snapping)
+        # see picarx.line_estimation.edge_error, it takes N x 3 logs as well
+        e, _ = edge_error(v, self.polarity, EDGE_MAG_THRESH, EDGE_ASYM_THRESH, gain=0.7)
+        return e
 
     def line_lost(self, v):
         mu = sum(v) / 3.0
@@ -0,0 +1,194 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def parse_response(response):
+    '''
+    Split an assistant response into actions and answer
+
+    :param response: dict like {"actions": [...], "answer": "..."} or plain text
+    :return: (actions, answer)
+    :rtype: tuple
+    '''
+    if isinstance(response, dict):
+        actions = list(response.get('actions', ['stop']))
+        answer = response.get('answer', '')
+    elif response:
+        actions = []
+        answer = str(response)
+    else:
+        actions = []
+        answer = ''
+    return actions, answer
+
+
+# ActionRunner
+# =================================================================
+class ActionRunner():
+    '''
+    Run action batches in one thread
+
+    The thread blocks on a queue instead of polling a status flag, and each
+    batch sets an event when it's done.
+    '''
+    ACTION_INTERVAL = 0.5 # seconds between two actions of a batch
+
+    def __init__(self, car, actions_dict, think_action=None, on_status=None, action_interval=ACTION_INTERVAL):
+        self.car = car
+        self.actions_dict = actions_dict
+        self.think_action = think_action
+        self.on_status = on_status
+        self.action_interval = action_interval
+        self.status = 'standby'
+        self._queue = queue.Queue()
+        self._done = threading.Event()
+        self._done.set()
+        self.thread = threading.Thread(name='action_handler', target=self._loop, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self._queue.put(None)
+        self.thread.join()
+
+    def set_status(self, status):
+        self.status = status
+        if self.on_status is not None:
+            self.on_status(status)
+
+    def think(self):
+        self.set_status('think')
+        if self.think_action is not None:
+            self._queue.put(('think', None))
+
+    def standby(self):
+        self.set_status('standby')
+
+    def run(self, actions):
+        ''' queue a batch of actions, returns at once '''
+        self._done.clear()
+        self.set_status('actions')
+        self._queue.put(('actions', list(actions)))
+
+    def wait(self, timeout=None):
+        ''' block until the queued batches are done '''
+        return self._done.wait(timeout)
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            kind, actions = item
+            if kind == 'think':
+                if self.status == 'think':
+                    self.think_action(self.car)
+                continue
+            for i, _action in enumerate(actions):
+                if i > 0:
+                    time.sleep(self.action_interval)
+                try:
+                    self.actions_dict[_action](self.car)
+                except Exception as e:
+                    print(f'action error: {e}')
+            if self._queue.empty():
+                self.set_status('actions_done')
+                self._done.set()
+
+
+# ConversationEngine
+# =================================================================
+class ConversationEngine():
+    '''
+    One conversation turn with overlapped stages
+
+    Actions start as soon as they are known and run while the answer is
+    synthesized and spoken. A streaming dialogue can call start_actions()
+    and start_speech() early, before the whole response has arrived.
+
+    :param runner: ActionRunner
+    :param synthesize: callable(answer) -> audio file, None if failed
+    :param speak: callable(audio file), blocks until played
+    :param sounds_dict: sound effect actions, {name: callable()}
+    '''
+
+    def __init__(self, runner, synthesize, speak, sounds_dict=None):
+        self.runner = runner
+        self.synthesize = synthesize
+        self.speak = speak
+        self.sounds_dict = sounds_dict or {}
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='conversation')
+        self.timings = {}
+        self._lock = threading.Lock()
+        self._actions_started = False
+        self._tts_future = None
+        self._turn_start = 0
+
+    def start_actions(self, actions):
+        ''' start actions of this turn, only the first call counts '''
+        with self._lock:
+            if self._actions_started:
+                return
+            self._actions_started = True
+        self.timings['actions_start'] = time.time() - self._turn_start
+        moves = []
+        for _action in actions:
+            if _action in self.sounds_dict:
+                try:
+                    self.sounds_dict[_action]()
+                except Exception as e:
+                    print(f'action error: {e}')
+            else:
+                moves.append(_action)
+        self.runner.run(moves)
+
+    def start_speech(self, answer):
+        ''' start synthesizing the answer in the background, only the first call counts '''
+        with self._lock:
+            if self._tts_future is not None or not answer:
+                return
+            self._tts_future = self.executor.submit(self._synthesize, answer)
+
+    def _synthesize(self, answer):
+        st = time.time()
+        audio = self.synthesize(answer)
+        self.timings['tts'] = time.time() - st
+        return audio
+
+    def turn(self, dialogue, *args, **kwargs):
+        '''
+        Run one turn: dialogue, then actions and speech in parallel
+
+        :param dialogue: callable(*args, **kwargs) -> response
+        :return: (actions, answer)
+        :rtype: tuple
+        '''
+        self._turn_start = time.time()
+        self.timings = {}
+        with self._lock:
+            self._actions_started = False
+            self._tts_future = None
+
+        self.runner.think()
+        response = dialogue(*args, **kwargs)
+        self.timings['chat'] = time.time() - self._turn_start
+
+        actions, answer = parse_response(response)
+        self.start_speech(answer)
+        self.start_actions(actions)
+
+        with self._lock:
+            tts_future = self._tts_future
+        if tts_future is not None:
+            audio = tts_future.result()
+            if audio:
+                self.speak(audio)
+        self.runner.wait()
+        self.timings['total'] = time.time() - self._turn_start
+        return actions, answer
+
+    def close(self):
+        self.executor.shutdown(wait=False)
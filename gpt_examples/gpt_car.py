@@ -2,17 +2,22 @@ from openai_helper import OpenAiHelper
 from keys import OPENAI_API_KEY, OPENAI_ASSISTANT_ID
 from preset_actions import *
 from utils import *
+from conversation import ActionRunner, ConversationEngine
+from vad import VoiceActivityDetector
 
 import readline # optimize keyboard input, only need to import
 
 import speech_recognition as sr
 
 from picarx import Picarx
-from robot_hat import Music, Pin
+from picarx.tts_cache import TTSCache
+from picarx.intent import IntentMatcher
+from picarx.preset_actions import forward, backward, turn_left, turn_right
+from robot_hat import Music
+from robot_hat.led import LED
 
 import time
 import threading
-import random
 
 import os
 import sys
@@ -54,6 +59,21 @@ VOICE_INSTRUCTIONS = ""
 
 SOUND_EFFECT_ACTIONS = ["honking", "start engine"]
 
+LOCAL_INTENTS = True # do known commands without chat-gpt
+
+IMG_SIZE = (640, 480) # max (width, height) of the images sent to the assistant
+IMG_JPEG_QUALITY = 80
+
+# tts cache, repeated answers are played from ./tts/cache instead of synthesized again
+tts_cache = TTSCache(
+    synthesize=lambda text, file: openai_helper.text_to_speech(text, file, TTS_VOICE, response_format='wav', instructions=VOICE_INSTRUCTIONS),
+    engine_name='openai',
+    model='gpt-4o-mini-tts',
+    voice=f'{TTS_VOICE}|{VOICE_INSTRUCTIONS}',
+    volume_db=VOLUME_DB,
+    cache_dir='./tts/cache',
+)
+
 # car init 
 # =================================================================
 try:
@@ -64,7 +84,7 @@ except Exception as e:
 
 music = Music()
 
-led = Pin('LED')
+led = LED()
 
 DEFAULT_HEAD_PAN = 0
 DEFAULT_HEAD_TILT = 20
@@ -73,7 +93,6 @@ DEFAULT_HEAD_TILT = 20
 # =================================================================
 if with_img:
     from vilib import Vilib
-    import cv2
 
     Vilib.camera_start(vflip=False,hflip=False)
     Vilib.show_fps()
@@ -84,153 +103,83 @@ if with_img:
             break
         time.sleep(0.01)
 
+    # frames sent to the assistant are downscaled to this size
+    openai_helper.vision_uploader(size=IMG_SIZE, jpeg_quality=IMG_JPEG_QUALITY)
+
     time.sleep(.5)
     print('\n')
 
 # speech_recognition init
 # =================================================================
-'''
-self.energy_threshold = 300  # minimum audio energy to consider for recording
-self.dynamic_energy_threshold = True
-self.dynamic_energy_adjustment_damping = 0.15
-self.dynamic_energy_ratio = 1.5
-self.pause_threshold = 0.8  # seconds of non-speaking audio before a phrase is considered complete
-self.operation_timeout = None  # seconds after an internal operation (e.g., an API request) starts before it times out, or ``None`` for no timeout
-
-self.phrase_threshold = 0.3  # minimum seconds of speaking audio before we consider the speaking audio a phrase - values below this are ignored (for filtering out clicks and pops)
-self.non_speaking_duration = 0.5  # seconds of non-speaking audio to keep on both sides of the recording
-
-'''
-recognizer = sr.Recognizer()
-recognizer.dynamic_energy_adjustment_damping = 0.16
-recognizer.dynamic_energy_ratio = 1.6
+# the vad keeps its noise floor up to date between phrases, so there is no
+# adjust_for_ambient_noise before each one, and ends the phrase after
+# end_silence seconds of silence with the leading and trailing silence cut off
+vad = VoiceActivityDetector(end_silence=0.5)
 
 # speak_hanlder
 # =================================================================
-speech_loaded = False
-speech_lock = threading.Lock()
-tts_file = None
+def speak_hanlder(tts_file):
+    # gray_print('speak start')
+    speak_block(music, tts_file)
+    # gray_print('speak done')
 
-def speak_hanlder():
-    global speech_loaded, tts_file
-    while True:
-        with speech_lock:
-            _isloaded = speech_loaded
-        if _isloaded:
-            # gray_print('speak start')
-            speak_block(music, tts_file)
-            # gray_print('speak done')
-            with speech_lock:
-                speech_loaded = False
-        time.sleep(0.05)
-
-speak_thread = threading.Thread(target=speak_hanlder)
-speak_thread.daemon = True
 
-
-# actions thread
+# led
 # =================================================================
-action_status = 'standby' # 'standby', 'think', 'actions', 'actions_done'
-led_status = 'standby' # 'standby', 'think' or 'actions', 'actions_done'
-last_action_status = 'standby'
-last_led_status = 'standby'
-
+# patterns are played by the shared timer wheel, switching is instant and
+# never blocks the action thread
 LED_DOUBLE_BLINK_INTERVAL = 0.8 # seconds
 LED_BLINK_INTERVAL = 0.1 # seconds
 
-actions_to_be_done = []
-action_lock = threading.Lock()
+def set_led_status(status):
+    if status == 'standby':
+        led.double_blink(delay=0.1, pause=LED_DOUBLE_BLINK_INTERVAL)
+    elif status == 'think':
+        led.blink(delay=LED_BLINK_INTERVAL)
+    elif status == 'actions':
+        led.on()
 
-def action_handler():
-    global action_status, actions_to_be_done, led_status, last_action_status, last_led_status
 
-    # standby_actions = ['waiting', 'feet_left_right']
-    # standby_weights = [1, 0.3]
-
-    action_interval = 5 # seconds
-    last_action_time = time.time()
-    last_led_time = time.time()
-
-    while True:
-        with action_lock:
-            _state = action_status
-
-        # led
-        # ------------------------------
-        led_status = _state
-
-        if led_status != last_led_status:
-            last_led_time = 0
-            last_led_status = led_status
-
-        if led_status == 'standby':
-            if time.time() - last_led_time > LED_DOUBLE_BLINK_INTERVAL:
-                led.off()
-                led.on()
-                sleep(.1)
-                led.off()
-                sleep(.1)
-                led.on()
-                sleep(.1)
-                led.off()
-                last_led_time = time.time()
-        elif led_status == 'think':
-            if time.time() - last_led_time > LED_BLINK_INTERVAL:
-                led.off()
-                sleep(LED_BLINK_INTERVAL)
-                led.on()
-                sleep(LED_BLINK_INTERVAL)
-                last_led_time = time.time()
-        elif led_status == 'actions':
-                led.on() 
-
-        # actions
-        # ------------------------------
-        if _state == 'standby':
-            last_action_status = 'standby'
-            if time.time() - last_action_time > action_interval:
-                # TODO: standby actions
-                last_action_time = time.time()
-                action_interval = random.randint(2, 6)
-        elif _state == 'think':
-            if last_action_status != 'think':
-                last_action_status = 'think'
-                # think(my_car)
-                keep_think(my_car)
-        elif _state == 'actions':
-            last_action_status = 'actions'
-            with action_lock:
-                _actions = actions_to_be_done
-            for _action in _actions:
-                try:
-                    actions_dict[_action](my_car)
-                except Exception as e:
-                    print(f'action error: {e}')
-                time.sleep(0.5)
-
-            with action_lock:
-                action_status = 'actions_done'
-            last_action_time = time.time()
-
-        time.sleep(0.01)
-
-action_thread = threading.Thread(target=action_handler)
-action_thread.daemon = True
+# conversation engine
+# =================================================================
+# actions run in their own thread and start as soon as the response is parsed,
+# while the answer is synthesized and spoken
+# the drive actions are only for local commands, they are not offered to chat-gpt
+local_actions_dict = {
+    **actions_dict,
+    "forward": forward,
+    "backward": backward,
+    "turn left": turn_left,
+    "turn right": turn_right,
+}
+action_runner = ActionRunner(my_car, local_actions_dict, think_action=keep_think, on_status=set_led_status)
+
+engine = ConversationEngine(
+    action_runner,
+    synthesize=tts_cache.get, # synthesized and volume adjusted only on a miss
+    speak=speak_hanlder,
+    sounds_dict={name: (lambda name=name: sounds_dict[name](music)) for name in SOUND_EFFECT_ACTIONS},
+)
+
+# short commands matching an action name ("nod", "wave hands", "forward",
+# "turn left", "stop") are done at once, everything else goes to chat-gpt
+intents = IntentMatcher(local_actions_dict, synonyms={
+    "wave hands": ["wave", "say hello"],
+    "shake head": ["shake your head"],
+    "celebrate": ["dance"],
+    "forward": ["go ahead", "go straight"],
+    "backward": ["back up", "reverse"],
+})
 
 
 # main
 # =================================================================
 def main():
-    global current_feeling, last_feeling
-    global speech_loaded
-    global action_status, actions_to_be_done
-    global tts_file
-
     my_car.reset()
     my_car.set_cam_tilt_angle(DEFAULT_HEAD_TILT)
 
-    speak_thread.start()
-    action_thread.start()
+    set_led_status('standby')
+    action_runner.start()
 
     while True:
         if input_mode == 'voice':
@@ -241,22 +190,20 @@ def main():
             # ----------------------------------------------------------------
             gray_print("listening ...")
 
-            with action_lock:
-                action_status = 'standby'
+            action_runner.standby()
 
             _stderr_back = redirect_error_2_null() # ignore error print to ignore ALSA errors
             # If the chunk_size is set too small (default_size=1024), it may cause the program to freeze
             with sr.Microphone(chunk_size=8192) as source:
                 cancel_redirect_error(_stderr_back) # restore error print
-                recognizer.adjust_for_ambient_noise(source)
-                audio = recognizer.listen(source)
+                audio = vad.listen(source)
 
             # stt
             # ----------------------------------------------------------------
             gray_print('stt ...')
             st = time.time()
             _result = openai_helper.stt(audio, language=LANGUAGE)
-            gray_print(f"stt takes: {time.time() - st:.3f} s")
+            gray_print(f"stt takes: {time.time() - st:.3f} s, audio: {vad.last_phrase_time:.2f} s")
 
             if _result == False or _result == "":
                 print() # new line
@@ -265,8 +212,7 @@ def main():
         elif input_mode == 'keyboard':
             my_car.set_cam_tilt_angle(DEFAULT_HEAD_TILT)
 
-            with action_lock:
-                action_status = 'standby'
+            action_runner.standby()
 
             _result = input(f'\033[1;30m{"intput: "}\033[0m').encode(sys.stdin.encoding).decode('utf-8')
 
@@ -277,100 +223,38 @@ def main():
         else:
             raise ValueError("Invalid input mode")
 
-        # chat-gpt
-        # ---------------------------------------------------------------- 
-        gray_print(f'thinking ...')
-        response = {}
-        st = time.time()
-
-        with action_lock:
-            action_status = 'think'
-
-        if with_img:
-            img_path = './img_imput.jpg'
-            cv2.imwrite(img_path, Vilib.img)
-            response = openai_helper.dialogue_with_img(_result, img_path)
-        else:
-            response = openai_helper.dialogue(_result)
-
-        gray_print(f'chat takes: {time.time() - st:.3f} s')
+        # known commands, no chat-gpt
+        # ----------------------------------------------------------------
+        names = intents.match(_result) if LOCAL_INTENTS else None
+        if names is not None:
+            gray_print(f'local actions: {names}')
+            if names == ['stop']:
+                stop_actions(my_car)
+            else:
+                action_runner.run(names)
+                action_runner.wait()
+            print() # new line
+            continue
 
-        # actions & TTS
+        # chat-gpt, actions & TTS
         # ----------------------------------------------------------------
-        _sound_actions = [] 
+        gray_print(f'thinking ...')
+        # the reply is streamed, actions and tts start as soon as their fields arrive
         try:
-            if isinstance(response, dict):
-                if 'actions' in response:
-                    actions = list(response['actions'])
-                else:
-                    actions = ['stop']
-
-                if 'answer' in response:
-                    answer = response['answer']
-                else:
-                    answer = ''
-
-                if len(answer) > 0:
-                    _actions = list.copy(actions)
-                    for _action in _actions:
-                        if _action in SOUND_EFFECT_ACTIONS:
-                            _sound_actions.append(_action)
-                            actions.remove(_action)
-
+            if with_img:
+                # downscaled and encoded in memory, not uploaded again if the scene hasn't changed
+                actions, answer = engine.turn(openai_helper.dialogue_with_img, _result, Vilib.img.copy(),
+                    on_actions=engine.start_actions, on_answer=engine.start_speech)
             else:
-                response = str(response)
-                if len(response) > 0:
-                    actions = []
-                    answer = response
-
-        except:
-            actions = []
-            answer = ''
-    
-        try:
-            # ---- tts ----
-            _tts_status = False
-            if answer != '':
-                st = time.time()
-                _time = time.strftime("%y-%m-%d_%H-%M-%S", time.localtime())
-                _tts_f = f"./tts/{_time}_raw.wav"
-                _tts_status = openai_helper.text_to_speech(answer, _tts_f, TTS_VOICE, response_format='wav', instructions=VOICE_INSTRUCTIONS) # alloy, echo, fable, onyx, nova, and shimmer
-                if _tts_status:
-                    tts_file = f"./tts/{_time}_{VOLUME_DB}dB.wav"
-                    _tts_status = sox_volume(_tts_f, tts_file, VOLUME_DB)
-                gray_print(f'tts takes: {time.time() - st:.3f} s')
-
-            # ---- actions ----
-            with action_lock:
-                actions_to_be_done = actions
-                gray_print(f'actions: {actions_to_be_done}')
-                action_status = 'actions'
-
-            # --- sound effects and voice ---
-            for _sound in _sound_actions:
-                try:
-                    sounds_dict[_sound](music)
-                except Exception as e:
-                    print(f'action error: {e}')
-
-            if _tts_status:
-                with speech_lock:
-                    speech_loaded = True
-
-            # ---- wait speak done ----
-            if _tts_status:
-                while True:
-                    with speech_lock:
-                        if not speech_loaded:
-                            break
-                    time.sleep(.01)
-
-            # ---- wait actions done ----
-            while True:
-                with action_lock:
-                    if action_status != 'actions':
-                        break
-                time.sleep(.01)
+                actions, answer = engine.turn(openai_helper.dialogue, _result,
+                    on_actions=engine.start_actions, on_answer=engine.start_speech)
+
+            timings = engine.timings
+            gray_print(f"chat takes: {timings['chat']:.3f} s")
+            gray_print(f'actions: {actions}')
+            if 'tts' in timings:
+                gray_print(f"tts takes: {timings['tts']:.3f} s")
+            gray_print(f"turn takes: {timings['total']:.3f} s")
 
             ##
             print() # new line
@@ -378,7 +262,6 @@ def main():
         except Exception as e:
             print(f'actions or TTS error: {e}')
 
-
 if __name__ == "__main__":
     try:
         main()
@@ -387,6 +270,7 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"\033[31mERROR: {e}\033[m")
     finally:
+        engine.close()
         if with_img:
             Vilib.camera_close()
         my_car.reset()
@@ -1,4 +1,8 @@
 from openai import OpenAI
+from collections import deque
+import ast
+import json
+import re
 import time
 import shutil
 import os
@@ -42,37 +46,201 @@ def chat_print(label, message):
             else:
                 print(f'{"":>26} {text}')
 
+# ResponseParser
+# =================================================================
+_ACTIONS_KEY = re.compile(r'"actions"\s*:\s*\[')
+_ANSWER_KEY = re.compile(r'"answer"\s*:\s*"')
+
+def _find_close(text, start, open_char='[', close_char=']'):
+    ''' index of the bracket closing the one before start, -1 if not arrived yet '''
+    depth = 1
+    in_str = False
+    escape = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_str:
+            if escape:
+                escape = False
+            elif c == '\\':
+                escape = True
+            elif c == '"':
+                in_str = False
+        elif c == '"':
+            in_str = True
+        elif c == open_char:
+            depth += 1
+        elif c == close_char:
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+def _string_prefix(text, start):
+    '''
+    decode the json string starting at start (after the opening quote) as far as it has arrived
+
+    :return: (decoded text, True if the closing quote arrived)
+    '''
+    i = start
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c == '"':
+            return json.loads('"' + text[start:i] + '"'), True
+        if c == '\\':
+            # wait for the whole escape sequence
+            if i + 1 >= n:
+                break
+            if text[i+1] == 'u':
+                if i + 6 > n:
+                    break
+                i += 6
+            else:
+                i += 2
+            continue
+        i += 1
+    return json.loads('"' + text[start:i] + '"'), False
+
+def parse_reply(text):
+    ''' parse a whole reply into a dict, or return the text if it's not one '''
+    text = text.strip()
+    # tolerate ```json fences
+    if text.startswith('```'):
+        text = text.strip('`').strip()
+        if text.startswith('json'):
+            text = text[4:]
+    try:
+        value = json.loads(text)
+    except ValueError:
+        try:
+            # replies with python style quotes, safe replacement of eval()
+            value = ast.literal_eval(text)
+        except (ValueError, SyntaxError):
+            return text
+    if isinstance(value, dict):
+        return value
+    return text
+
+class ResponseParser():
+    '''
+    Parse a streamed {"actions": [...], "answer": "..."} reply incrementally
+
+    on_actions(actions) is called as soon as the actions list is complete,
+    on_answer(answer) as soon as the answer string is closed, both before the
+    rest of the reply arrives. The answer received so far is in .answer.
+    '''
+
+    def __init__(self, on_actions=None, on_answer=None):
+        self.on_actions = on_actions
+        self.on_answer = on_answer
+        self.text = ''
+        self.actions = None
+        self.answer = ''
+        self.answer_done = False
+
+    def feed(self, delta):
+        '''
+        :param delta: next piece of the reply
+        :return: new answer text decoded from this delta
+        :rtype: str
+        '''
+        self.text += delta
+        if self.actions is None:
+            m = _ACTIONS_KEY.search(self.text)
+            if m is not None:
+                end = _find_close(self.text, m.end())
+                if end >= 0:
+                    try:
+                        self.actions = list(json.loads(self.text[m.end()-1:end+1]))
+                    except ValueError:
+                        self.actions = []
+                    if self.on_actions is not None:
+                        self.on_actions(self.actions)
+
+        new = ''
+        if not self.answer_done:
+            m = _ANSWER_KEY.search(self.text)
+            if m is not None:
+                answer, self.answer_done = _string_prefix(self.text, m.end())
+                new = answer[len(self.answer):]
+                self.answer = answer
+                if self.answer_done and self.on_answer is not None:
+                    self.on_answer(self.answer)
+        return new
+
+    def result(self):
+        ''' the whole reply, dict if it's json, else str '''
+        return parse_reply(self.text)
+
+
 # OpenAiHelper
 # =================================================================
 class OpenAiHelper():
     STT_OUT = "stt_output.wav"
+    STT_FLAC_OUT = "stt_output.flac"
+    STT_RATE = 16000
     TTS_OUTPUT_FILE = 'tts_output.mp3'
     TIMEOUT = 30 # seconds
+    MAX_CONTEXT_MESSAGES = 20 # messages the model sees per run
+    MAX_THREAD_TURNS = 30 # turns before the thread is restarted with a summary
+    SUMMARY_TURNS = 6 # turns kept in the summary
+    SUMMARY_CHARS = 200 # max chars per message in the summary
 
-    def __init__(self, api_key, assistant_id, assistant_name, timeout=TIMEOUT) -> None:
-        
+    def __init__(self, api_key, assistant_id, assistant_name, timeout=TIMEOUT, base_url=None,
+                 max_context_messages=MAX_CONTEXT_MESSAGES, max_thread_turns=MAX_THREAD_TURNS) -> None:
+        '''
+        :param base_url: api url, None for the default, e.g. a local mock server for testing
+        :param max_context_messages: messages the model sees per run, older ones are truncated by the api
+        :param max_thread_turns: turns before starting a new thread seeded with a summary
+        '''
         self.api_key = api_key
         self.assistant_id = assistant_id
         self.assistant_name = assistant_name
+        self.max_context_messages = max_context_messages
+        self.max_thread_turns = max_thread_turns
+        self.history = deque(maxlen=self.SUMMARY_TURNS*2) # (role, text), client side
+        self.thread_turns = 0
+        self.vision = None
 
-        self.client = OpenAI(api_key=api_key, timeout=timeout)
+        self.client = OpenAI(api_key=api_key, timeout=timeout, base_url=base_url)
         self.thread = self.client.beta.threads.create()
         self.run = self.client.beta.threads.runs.create_and_poll(
             thread_id=self.thread.id,
             assistant_id=assistant_id,
         )
 
+    def encode_audio(self, audio, compress=True):
+        '''
+        Encode audio for upload, flac at 16 kHz, or wav if there is no flac encoder
+
+        :param audio: speech_recognition.AudioData
+        :param compress: use flac
+        :rtype: BytesIO
+        '''
+        from io import BytesIO
+
+        # whisper works at 16 kHz, higher rates only cost upload bytes
+        rate = self.STT_RATE if audio.sample_rate > self.STT_RATE else None
+        if compress:
+            try:
+                data = BytesIO(audio.get_flac_data(convert_rate=rate, convert_width=2))
+                data.name = self.STT_FLAC_OUT
+                return data
+            except Exception as e:
+                print(f"flac err: {e}, send wav instead")
+        data = BytesIO(audio.get_wav_data(convert_rate=rate, convert_width=2))
+        data.name = self.STT_OUT
+        return data
+
     def stt(self, audio, language='en'):
         try:
             import wave
-            from io import BytesIO
 
-            wav_data = BytesIO(audio.get_wav_data())
-            wav_data.name = self.STT_OUT
+            audio_data = self.encode_audio(audio)
 
             transcript = self.client.audio.transcriptions.create(
                 model="whisper-1", 
-                file=wav_data,
+                file=audio_data,
                 language=language,
                 prompt="this is the conversation between me and a robot"
             )
@@ -117,88 +285,128 @@ class OpenAiHelper():
             print(f"Could not request results from Whisper API; {e}")
             return False
 
-    def dialogue(self, msg):
-        chat_print("user", msg)
-        message = self.client.beta.threads.messages.create(
+    # dialogue
+    # -------------------------------------------------------------
+    def summary(self):
+        ''' short summary of the recent turns, built on the client '''
+        lines = []
+        for role, text in self.history:
+            if len(text) > self.SUMMARY_CHARS:
+                text = text[:self.SUMMARY_CHARS] + '...'
+            lines.append(f'{role}: {text}')
+        return '\n'.join(lines)
+
+    def _roll_thread(self):
+        ''' start a new thread seeded with a summary once the old one is long '''
+        if self.thread_turns < self.max_thread_turns:
+            return
+        summary = self.summary()
+        messages = []
+        if summary:
+            messages.append({
+                "role": "user",
+                "content": f"Summary of our conversation so far, for context only:\n{summary}",
+            })
+        self.thread = self.client.beta.threads.create(messages=messages)
+        self.thread_turns = 0
+
+    def dialogue_stream(self, content):
+        '''
+        Send a user message and yield the reply as text deltas
+
+        :param content: message content, str or list of content blocks
+        '''
+        self._roll_thread()
+        self.client.beta.threads.messages.create(
             thread_id=self.thread.id,
             role="user",
-            content=msg
+            content=content
             )
-        run = self.client.beta.threads.runs.create_and_poll(
+        self.thread_turns += 1
+        with self.client.beta.threads.runs.stream(
             thread_id=self.thread.id,
             assistant_id=self.assistant_id,
-        )
-        if run.status == 'completed': 
-            messages = self.client.beta.threads.messages.list(
-                thread_id=self.thread.id
-            )
+            truncation_strategy={"type": "last_messages", "last_messages": self.max_context_messages},
+        ) as stream:
+            for event in stream:
+                if event.event == 'thread.message.delta':
+                    for block in event.data.delta.content or []:
+                        if block.type == 'text' and block.text and block.text.value:
+                            yield block.text.value
+                elif event.event in ('thread.run.failed', 'thread.run.cancelled', 'thread.run.expired', 'thread.run.incomplete'):
+                    print(event.data.status)
 
-            for message in messages.data:
-                if message.role == 'assistant':
-                    for block in message.content:
-                        if block.type == 'text':
-                            value = block.text.value
-                            chat_print(self.assistant_name, value)
-                            try:
-                                value = eval(value) # convert to dict
-                                return value
-                            except Exception as e:
-                                return str(value)
-                break # only last reply
-        else:
-            print(run.status)
+    def _dialogue(self, msg, content, on_actions=None, on_answer=None, on_delta=None):
+        chat_print("user", msg)
+        self.history.append(('user', msg))
+        parser = ResponseParser(on_actions=on_actions, on_answer=on_answer)
+        try:
+            for delta in self.dialogue_stream(content):
+                new = parser.feed(delta)
+                if on_delta is not None and new:
+                    on_delta(new)
+        except Exception as e:
+            print(f"dialogue err: {e}")
+            if not parser.text:
+                return None
+        chat_print(self.assistant_name, parser.text)
+        value = parser.result()
+        self.history.append(('assistant', value.get('answer', '') if isinstance(value, dict) else value))
+        return value
 
+    def dialogue(self, msg, on_actions=None, on_answer=None, on_delta=None):
+        '''
+        Chat with the assistant, the reply is streamed and parsed as it arrives
 
-    def dialogue_with_img(self, msg, img_path):
-        chat_print(f"user", msg)
+        :param msg: user message
+        :param on_actions: callable(actions), called once the actions list has arrived
+        :param on_answer: callable(answer), called once the answer string has arrived
+        :param on_delta: callable(text), called with each new piece of the answer
+        :return: dict if the reply is json, else str, None if failed
+        '''
+        return self._dialogue(msg, msg, on_actions, on_answer, on_delta)
 
-        img_file = self.client.files.create(
-                    file=open(img_path, "rb"),
-                    purpose="vision"
-                )
+    def vision_uploader(self, **kwargs):
+        '''
+        The in memory image upload stage used by dialogue_with_img
 
-        message =  self.client.beta.threads.messages.create(
-            thread_id= self.thread.id,
-            role="user",
-            content= [
-                {
-                    "type": "text",
-                    "text": msg
-                },
-                # {
-                # "type": "image_url",
-                # "image_url": {"url": "https://example.com/image.png"}
-                # },
-                {
-                    "type": "image_file",
-                    "image_file": {"file_id": img_file.id}
-                }
-            ],
-            )
-        run = self.client.beta.threads.runs.create_and_poll(
-            thread_id=self.thread.id,
-            assistant_id=self.assistant_id,
-        )
-        if run.status == 'completed': 
-            messages = self.client.beta.threads.messages.list(
-                thread_id=self.thread.id
-            )
+        :param kwargs: VisionUploader options (size, jpeg_quality, hash_threshold), reconfigures it if given
+        '''
+        if self.vision is None or kwargs:
+            from vision_upload import VisionUploader
+            self.vision = VisionUploader(self.client, **kwargs)
+        return self.vision
 
-            for message in messages.data:
-                if message.role == 'assistant':
-                    for block in message.content:
-                        if block.type == 'text':
-                            value = block.text.value
-                            chat_print(self.assistant_name, value)
-                            try:
-                                value = eval(value) # convert to dict
-                                return value
-                            except Exception as e:
-                                return str(value)
-                break # only last reply
-        else:
-            print(run.status)
+    def dialogue_with_img(self, msg, img, on_actions=None, on_answer=None, on_delta=None):
+        '''
+        Chat with the assistant about an image
 
+        :param img: image file path, or a BGR frame (numpy array) which is downscaled
+                    and encoded in memory, and only uploaded again if the scene changed
+        '''
+        if isinstance(img, str):
+            with open(img, "rb") as f:
+                file_id = self.client.files.create(
+                            file=f,
+                            purpose="vision"
+                        ).id
+        else:
+            file_id = self.vision_uploader().upload(img)
+        content = [
+            {
+                "type": "text",
+                "text": msg
+            },
+            # {
+            # "type": "image_url",
+            # "image_url": {"url": "https://example.com/image.png"}
+            # },
+            {
+                "type": "image_file",
+                "image_file": {"file_id": file_id}
+            }
+        ]
+        return self._dialogue(msg, content, on_actions, on_answer, on_delta)
 
     def text_to_speech(self, text, output_file, voice='alloy', response_format="mp3", speed=1, instructions=''):
         '''
@@ -1,228 +1,23 @@
 
 from time import sleep
 
-def wave_hands(car):
-    car.reset()
-    car.set_cam_tilt_angle(20)
-    for _ in range(2):
-        car.set_dir_servo_angle(-25)
-        sleep(.1)
-        # car.set_dir_servo_angle(0)
-        # sleep(.1)
-        car.set_dir_servo_angle(25)
-        sleep(.1)
-    car.set_dir_servo_angle(0)
-
-def resist(car):
-    car.reset()
-    car.set_cam_tilt_angle(10)
-    for _ in range(3):
-        car.set_dir_servo_angle(-15)
-        car.set_cam_pan_angle(15)
-        sleep(.1)
-        car.set_dir_servo_angle(15)
-        car.set_cam_pan_angle(-15)
-        sleep(.1)
-    car.stop()
-    car.set_dir_servo_angle(0)
-    car.set_cam_pan_angle(0)
-
-def act_cute(car):
-    car.reset()
-    car.set_cam_tilt_angle(-20)
-    for i in range(15):
-        car.forward(5)
-        sleep(0.02)
-        car.backward(5)
-        sleep(0.02)
-    car.set_cam_tilt_angle(0)
-    car.stop()
-
-def rub_hands(car):
-    car.reset()
-    for i in range(5):
-        car.set_dir_servo_angle(-6)
-        sleep(.5)
-        car.set_dir_servo_angle(6)
-        sleep(.5)
-    car.reset()
-
-def think(car):
-    car.reset()
-
-    for i in range(11):
-        car.set_cam_pan_angle(i*3)
-        car.set_cam_tilt_angle(-i*2)
-        car.set_dir_servo_angle(i*2)
-        sleep(.05)
-    sleep(1)
-    car.set_cam_pan_angle(15)
-    car.set_cam_tilt_angle(-10)
-    car.set_dir_servo_angle(10)
-    sleep(.1)
-    car.reset()
-
-def keep_think(car):
-    car.reset()
-    for i in range(11):
-        car.set_cam_pan_angle(i*3)
-        car.set_cam_tilt_angle(-i*2)
-        car.set_dir_servo_angle(i*2)
-        sleep(.05)
-
-def shake_head(car):
-    car.stop()
-    car.set_cam_pan_angle(0)
-    car.set_cam_pan_angle(60)
-    sleep(.2)
-    car.set_cam_pan_angle(-50)
-    sleep(.1)
-    car.set_cam_pan_angle(40)
-    sleep(.1)
-    car.set_cam_pan_angle(-30)
-    sleep(.1)
-    car.set_cam_pan_angle(20)
-    sleep(.1)
-    car.set_cam_pan_angle(-10)
-    sleep(.1)
-    car.set_cam_pan_angle(10)
-    sleep(.1)
-    car.set_cam_pan_angle(-5)
-    sleep(.1)
-    car.set_cam_pan_angle(0)
-
-def nod(car):
-    car.reset()
-    car.set_cam_tilt_angle(0)
-    car.set_cam_tilt_angle(5)
-    sleep(.1)
-    car.set_cam_tilt_angle(-30)
-    sleep(.1)
-    car.set_cam_tilt_angle(5)
-    sleep(.1)
-    car.set_cam_tilt_angle(-30)
-    sleep(.1)
-    car.set_cam_tilt_angle(0)
-
-
-def depressed(car):
-    # car.reset()
-    # car.set_cam_tilt_angle(0)
-    # car.set_cam_tilt_angle(20)
-    # sleep(.22)
-    # car.set_cam_tilt_angle(-30)
-    # sleep(.1)
-    # car.set_cam_tilt_angle(15)
-    # sleep(.1)
-    # car.set_cam_tilt_angle(-20)
-    # sleep(.1)
-    # car.set_cam_tilt_angle(10)
-    # sleep(.1)
-    # car.set_cam_tilt_angle(-10)
-    # sleep(.1)
-    # car.set_cam_tilt_angle(5)
-    # sleep(.1)
-    # car.set_cam_tilt_angle(-5)
-    # sleep(.1)
-    # car.set_cam_tilt_angle(2)
-    # sleep(.1)
-    # car.set_cam_tilt_angle(0)
-
-    car.reset()
-    car.set_cam_tilt_angle(0)
-    car.set_cam_tilt_angle(20)
-    sleep(.22)
-    car.set_cam_tilt_angle(-22)
-    sleep(.1)
-    car.set_cam_tilt_angle(10)
-    sleep(.1)
-    car.set_cam_tilt_angle(-22)
-    sleep(.1)
-    car.set_cam_tilt_angle(0)
-    sleep(.1)
-    car.set_cam_tilt_angle(-22)
-    sleep(.1)
-    car.set_cam_tilt_angle(-10)
-    sleep(.1)
-    car.set_cam_tilt_angle(-22)
-    sleep(.1)
-    car.set_cam_tilt_angle(-15)
-    sleep(.1)
-    car.set_cam_tilt_angle(-22)
-    sleep(.1)
-    car.set_cam_tilt_angle(-19)
-    sleep(.1)
-    car.set_cam_tilt_angle(-22)
-    sleep(.1)
-
-    sleep(1.5)
-    car.reset()
-
-def twist_body(car):
-    car.reset()
-    for i in range(3):
-        car.set_motor_speed(1, 20)
-        car.set_motor_speed(2, 20)
-        car.set_cam_pan_angle(-20)
-        car.set_dir_servo_angle(-10)
-        sleep(.1)
-        car.set_motor_speed(1, 0)
-        car.set_motor_speed(2, 0)
-        car.set_cam_pan_angle(0)
-        car.set_dir_servo_angle(0)
-        sleep(.1)
-        car.set_motor_speed(1, -20)
-        car.set_motor_speed(2, -20)
-        car.set_cam_pan_angle(20)
-        car.set_dir_servo_angle(10)
-        sleep(.1)
-        car.set_motor_speed(1, 0)
-        car.set_motor_speed(2, 0)
-        car.set_cam_pan_angle(0)
-        car.set_dir_servo_angle(0)
-
-        sleep(.1)
-
-
-def celebrate(car):
-    car.reset()
-    car.set_cam_tilt_angle(20)
-
-    car.set_dir_servo_angle(30)
-    car.set_cam_pan_angle(60)
-    sleep(.3)
-    car.set_dir_servo_angle(10)
-    car.set_cam_pan_angle(30)
-    sleep(.1)
-    car.set_dir_servo_angle(30)
-    car.set_cam_pan_angle(60)
-    sleep(.3)
-    car.set_dir_servo_angle(0)
-    car.set_cam_pan_angle(0)
-    sleep(.2)
-
-    car.set_dir_servo_angle(-30)
-    car.set_cam_pan_angle(-60)
-    sleep(.3)
-    car.set_dir_servo_angle(-10)
-    car.set_cam_pan_angle(-30)
-    sleep(.1)
-    car.set_dir_servo_angle(-30)
-    car.set_cam_pan_angle(-60)
-    sleep(.3)
-    car.set_dir_servo_angle(0)
-    car.set_cam_pan_angle(0)
-    sleep(.2)
+# the actions are compiled timelines shared with picarx.preset_actions,
+# stop_actions(car) interrupts any of them at once
+from picarx.preset_actions import (
+    wave_hands, resist, act_cute, rub_hands, think, keep_think, shake_head,
+    nod, depressed, twist_body, celebrate, play_action, stop_actions,
+    play_sound_effect,
+)
 
 def honking(music):
     import utils
     # utils.speak_block(music, "../sounds/car-double-horn.wav", 100)
-    music.sound_play_threading("../sounds/car-double-horn.wav", 100)
+    play_sound_effect(music, "car-double-horn", 100)
 
 def start_engine(music):
     import utils
     # utils.speak_block(music, "../sounds/car-start-engine.wav", 100)
-    music.sound_play_threading("../sounds/car-start-engine.wav", 50)
+    play_sound_effect(music, "car-start-engine", 50)
 
 
 actions_dict = {
@@ -0,0 +1,174 @@
+import collections
+import time
+
+import numpy as np
+
+
+class VoiceActivityDetector():
+    '''
+    Streaming voice activity detector and end-pointer, 16 bit mono pcm
+
+    A frame is speech when its 200-4000 Hz band energy is margin_db over the
+    noise floor and its spectrum isn't flat like hiss or fan noise. The noise
+    floor follows the non speech frames all the time, so there is no
+    calibration before each phrase. A phrase starts after start_time of
+    speech, ends after end_silence of silence, and is returned trimmed to
+    pre_roll before and post_roll after the speech.
+
+    Usage:
+        vad = VoiceActivityDetector()
+        with sr.Microphone(chunk_size=8192) as source:
+            audio = vad.listen(source) # speech_recognition.AudioData
+    '''
+    FRAME_TIME = 0.02 # seconds
+    BAND = (200, 4000) # Hz
+
+    def __init__(self, margin_db=10, flatness_max=0.45, start_time=0.06, end_silence=0.5,
+                 pre_roll=0.3, post_roll=0.15, max_phrase=15, noise_floor_db=None):
+        '''
+        :param margin_db: dB over the noise floor to be speech
+        :param flatness_max: spectral flatness (0-1) above which a frame is noise
+        :param start_time: seconds of speech to start a phrase
+        :param end_silence: seconds of silence to end a phrase
+        :param pre_roll: seconds kept before the speech starts
+        :param post_roll: seconds kept after the speech ends
+        :param max_phrase: max seconds of a phrase
+        :param noise_floor_db: initial noise floor, None to take it from the first frames
+        '''
+        self.margin_db = margin_db
+        self.flatness_max = flatness_max
+        self.start_time = start_time
+        self.end_silence = end_silence
+        self.pre_roll = pre_roll
+        self.post_roll = post_roll
+        self.max_phrase = max_phrase
+        self.noise_floor_db = noise_floor_db
+        self.sample_rate = None
+        self.last_phrase_time = 0 # seconds of the last phrase
+        self.last_trimmed_time = 0 # seconds cut off the last phrase
+        self._setup(16000)
+
+    def _setup(self, sample_rate):
+        if sample_rate == self.sample_rate:
+            return
+        self.sample_rate = sample_rate
+        self.frame_size = int(sample_rate * self.FRAME_TIME)
+        self._window = np.hanning(self.frame_size).astype(np.float32)
+        freqs = np.fft.rfftfreq(self.frame_size, 1 / sample_rate)
+        self._band = (freqs >= self.BAND[0]) & (freqs <= self.BAND[1])
+        self.reset()
+
+    def reset(self):
+        ''' start a new phrase, the noise floor is kept '''
+        self._pre = collections.deque(maxlen=max(1, round(self.pre_roll / self.FRAME_TIME)))
+        self._frames = []
+        self._rest = b''
+        self._speech_run = 0
+        self._silence_run = 0
+        self._last_speech = 0 # index in _frames after the last speech frame
+        self.in_speech = False
+
+    def update_floor(self, energy_db):
+        # follow drops quickly, rises slowly so speech doesn't raise the floor
+        if self.noise_floor_db is None:
+            self.noise_floor_db = energy_db
+        elif energy_db < self.noise_floor_db:
+            self.noise_floor_db += 0.2 * (energy_db - self.noise_floor_db)
+        else:
+            self.noise_floor_db += 0.02 * (energy_db - self.noise_floor_db)
+
+    def is_speech(self, samples):
+        '''
+        Classify one frame, and adapt the noise floor on non speech frames
+
+        :param samples: int16 numpy array, frame_size long
+        :rtype: bool
+        '''
+        x = samples.astype(np.float32) * self._window
+        power = np.abs(np.fft.rfft(x)) ** 2 + 1e-10
+        band = power[self._band]
+        energy_db = 10 * np.log10(band.mean())
+        flatness = np.exp(np.log(band).mean()) / band.mean()
+
+        floor = self.noise_floor_db
+        speech = (floor is not None and energy_db > floor + self.margin_db
+                  and flatness < self.flatness_max)
+        if not speech:
+            self.update_floor(energy_db)
+        return speech
+
+    def feed(self, data):
+        '''
+        Feed pcm bytes
+
+        :param data: 16 bit mono pcm bytes, any length
+        :return: True once the phrase has ended
+        :rtype: bool
+        '''
+        data = self._rest + data
+        frame_bytes = self.frame_size * 2
+        n = len(data) // frame_bytes
+        self._rest = data[n*frame_bytes:]
+        start_frames = max(1, round(self.start_time / self.FRAME_TIME))
+        end_frames = max(1, round(self.end_silence / self.FRAME_TIME))
+        max_frames = round(self.max_phrase / self.FRAME_TIME)
+        for i in range(n):
+            frame = data[i*frame_bytes:(i+1)*frame_bytes]
+            speech = self.is_speech(np.frombuffer(frame, dtype=np.int16))
+            if not self.in_speech:
+                self._pre.append(frame)
+                self._speech_run = self._speech_run + 1 if speech else 0
+                if self._speech_run >= start_frames:
+                    self.in_speech = True
+                    self._frames = list(self._pre)
+                    self._last_speech = len(self._frames)
+                    self._silence_run = 0
+                continue
+            self._frames.append(frame)
+            if speech:
+                self._silence_run = 0
+                self._last_speech = len(self._frames)
+            else:
+                self._silence_run += 1
+            if self._silence_run >= end_frames or len(self._frames) >= max_frames:
+                return True
+        return False
+
+    def phrase(self):
+        '''
+        :return: pcm bytes of the phrase with the trailing silence trimmed
+        :rtype: bytes
+        '''
+        end = self._last_speech + round(self.post_roll / self.FRAME_TIME)
+        frames = self._frames[:end]
+        self.last_phrase_time = len(frames) * self.FRAME_TIME
+        self.last_trimmed_time = (len(self._frames) - len(frames)) * self.FRAME_TIME
+        return b''.join(frames)
+
+    def listen(self, source, timeout=None):
+        '''
+        Listen to a speech_recognition source until a phrase has ended
+
+        :param source: opened speech_recognition.Microphone, 16 bit mono
+        :param timeout: seconds to wait for speech to start, None for no timeout
+        :return: the trimmed phrase, None on timeout
+        :rtype: speech_recognition.AudioData
+        '''
+        import speech_recognition as sr
+
+        if source.SAMPLE_WIDTH != 2:
+            raise ValueError("only 16 bit audio is supported")
+        self._setup(source.SAMPLE_RATE)
+        self.reset()
+        st = time.time()
+        while True:
+            data = source.stream.read(source.CHUNK)
+            if len(data) == 0:
+                break
+            if self.feed(data):
+                break
+            if timeout is not None and not self.in_speech and time.time() - st > timeout:
+                return None
+        if not self.in_speech:
+            return None
+        return sr.AudioData(self.phrase(), source.SAMPLE_RATE, source.SAMPLE_WIDTH)
@@ -0,0 +1,108 @@
+from io import BytesIO
+import time
+
+import cv2
+
+
+def dhash(img, hash_size=8):
+    '''
+    Difference hash of an image, close images have close hashes
+
+    :param img: BGR or gray image (numpy array)
+    :param hash_size: hash is hash_size*hash_size bits
+    :return: hash
+    :rtype: int
+    '''
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(img, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+def hamming(a, b):
+    ''' number of different bits '''
+    return bin(a ^ b).count('1')
+
+
+class VisionUploader():
+    '''
+    Downscale, jpeg encode and upload camera frames in memory
+
+    A frame that looks like the last uploaded one (perceptual hash distance
+    <= hash_threshold) is not uploaded again, the last file id is reused.
+    '''
+    SIZE = (640, 480)
+    JPEG_QUALITY = 80
+    HASH_THRESHOLD = 4 # bits of 64
+
+    def __init__(self, client, size=SIZE, jpeg_quality=JPEG_QUALITY, hash_threshold=HASH_THRESHOLD):
+        '''
+        :param client: OpenAI client
+        :param size: max (width, height), frames are downscaled to fit, keeping aspect ratio
+        :param jpeg_quality: 0-100
+        :param hash_threshold: max hash distance to reuse the last upload, -1 to always upload
+        '''
+        self.client = client
+        self.size = size
+        self.jpeg_quality = jpeg_quality
+        self.hash_threshold = hash_threshold
+        self.file_id = None
+        self.last_hash = None
+        self.uploads = 0
+        self.reuses = 0
+        self.upload_bytes = 0
+        self.upload_time = 0
+
+    def encode(self, img):
+        '''
+        Downscale and jpeg encode a frame
+
+        :param img: BGR image (numpy array)
+        :return: jpeg file object
+        :rtype: BytesIO
+        '''
+        h, w = img.shape[:2]
+        scale = min(self.size[0] / w, self.size[1] / h)
+        if scale < 1:
+            img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            raise ValueError("jpeg encode failed")
+        data = BytesIO(buf.tobytes())
+        data.name = 'img_input.jpg' # the api guesses the type from the name
+        return data
+
+    def upload(self, img):
+        '''
+        Upload a frame, or reuse the last upload if the scene hasn't changed
+
+        :param img: BGR image (numpy array)
+        :return: file id
+        :rtype: str
+        '''
+        _hash = dhash(img)
+        if (self.file_id is not None and self.last_hash is not None
+                and hamming(_hash, self.last_hash) <= self.hash_threshold):
+            self.reuses += 1
+            return self.file_id
+
+        st = time.time()
+        data = self.encode(img)
+        img_file = self.client.files.create(
+                    file=data,
+                    purpose="vision"
+                )
+        self.upload_time = time.time() - st
+        self.upload_bytes = data.getbuffer().nbytes
+        self.uploads += 1
+        self.file_id = img_file.id
+        self.last_hash = _hash
+        return self.file_id
+
+    def reset(self):
+        ''' forget the last upload, the next frame is always uploaded '''
+        self.file_id = None
+        self.last_hash = None
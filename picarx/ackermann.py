@@ -0,0 +1,100 @@
+'''
+Ackermann steering model of the Picar-X
+
+With the front wheels steered by angle d, the car turns around a point on
+the rear axle line at R = wheelbase / tan(d) from the axle center. The rear
+wheels are at R - track/2 and R + track/2, so their speed ratio is fixed by
+the geometry:
+
+    k = track * tan(d) / (2 * wheelbase)
+    inner / outer = (1 - k) / (1 + k)
+
+The table holds both wheel ratios (the outer wheel at 1, so the commanded
+speed is never exceeded) and the curvature for every steering angle at a
+fine step, computed once. It has no hardware dependencies, the odometry and
+off robot simulations use the same model as forward() and backward().
+
+Positive steering angles turn towards motor 1, the wheel forward() slows.
+'''
+import math
+
+WHEELBASE = 0.095   # m, front axle to rear axle
+TRACK = 0.115       # m, between the rear wheels
+ANGLE_MIN = -30
+ANGLE_MAX = 30
+RESOLUTION = 0.1    # degrees per table entry
+
+
+class AckermannTable(object):
+    '''
+    Precomputed wheel speed ratios and curvature over the steering range
+
+    Usage:
+        table = AckermannTable()
+        r1, r2 = table.ratios(px.dir_current_angle)
+        px.set_motor_speed(1, speed * r1)
+        px.set_motor_speed(2, -speed * r2)
+    '''
+
+    def __init__(self, wheelbase=WHEELBASE, track=TRACK, angle_min=ANGLE_MIN, angle_max=ANGLE_MAX,
+                 resolution=RESOLUTION):
+        '''
+        param wheelbase: m, front axle to rear axle
+        param track: m, between the rear wheels
+        param angle_min: degrees, smallest steering angle
+        param angle_max: degrees, largest steering angle
+        param resolution: degrees per table entry
+        '''
+        if wheelbase <= 0 or track <= 0:
+            raise ValueError("wheelbase and track must be > 0")
+        self.wheelbase = wheelbase
+        self.track = track
+        self.angle_min = angle_min
+        self.angle_max = angle_max
+        self.resolution = resolution
+        self._scale = 1.0 / resolution
+        self._last = int(round((angle_max - angle_min) * self._scale))
+
+        self.table = []         # (motor 1 ratio, motor 2 ratio)
+        self.curvatures = []    # 1/m of the rear axle center, > 0 towards motor 1
+        for i in range(self._last + 1):
+            angle = angle_min + i * resolution
+            tan = math.tan(math.radians(angle))
+            k = track * tan / (2 * wheelbase)
+            inner = (1 - abs(k)) / (1 + abs(k))
+            self.table.append((inner, 1.0) if angle > 0 else (1.0, inner))
+            self.curvatures.append(tan / wheelbase)
+
+    def index(self, angle):
+        ''' table index of a steering angle, clamped to the range '''
+        i = int(round((angle - self.angle_min) * self._scale))
+        return 0 if i < 0 else self._last if i > self._last else i
+
+    def ratios(self, angle):
+        '''
+        param angle: steering angle, degrees
+        return: (motor 1 ratio, motor 2 ratio), the outer wheel is 1
+        '''
+        return self.table[self.index(angle)]
+
+    def curvature(self, angle):
+        '''
+        param angle: steering angle, degrees
+        return: 1/turn radius of the rear axle center, 1/m, 0 when straight
+        '''
+        return self.curvatures[self.index(angle)]
+
+    def center_ratio(self, angle):
+        ''' speed of the rear axle center over the outer wheel speed '''
+        r1, r2 = self.table[self.index(angle)]
+        return (r1 + r2) / 2
+
+
+_default = None
+
+def default_table():
+    ''' table of the stock Picar-X dimensions, shared '''
+    global _default
+    if _default is None:
+        _default = AckermannTable()
+    return _default
@@ -0,0 +1,148 @@
+'''
+Cliff safety monitor
+
+A background thread samples the grayscale module at a fixed rate and checks
+every sample against the cliff reference. When a cliff shows up the motor
+PWMs are set to 0 from the monitor thread and the motors are latched off:
+commands already on their way (action queues, timelines, the app loop) are
+dropped until the app releases the latch, e.g. to back away.
+
+Picarx.get_grayscale_data() is serialized, so the app can keep reading the
+module next to the monitor. monitor.values (the last sample, at most
+1/rate old) saves the bus time when that's fresh enough.
+
+    monitor = CliffMonitor(px, on_cliff=lambda values: print("cliff!", values))
+    monitor.start()
+    ...
+    if monitor.tripped:
+        monitor.release()
+        px.backward(50)
+    print(monitor.metrics())
+'''
+import threading
+import time
+from collections import deque
+
+
+class CliffMonitor(object):
+    '''
+    Sample the grayscale module and halt the motors at a cliff
+
+    Trips on the safe -> cliff edge only, so after release() the car can
+    move away from a cliff it still sees without being stopped again.
+    '''
+
+    def __init__(self, px, rate=100, on_cliff=None, auto_release=False, clear_samples=5):
+        '''
+        param px: Picarx
+        param rate: samples per second, a cliff is handled within 1/rate seconds
+        param on_cliff: callback(values) called after the motors are halted
+        param auto_release: release the latch by itself once the cliff is gone
+        param clear_samples: safe samples in a row needed to call the cliff gone
+        '''
+        self.px = px
+        self.period = 1.0 / rate
+        self.on_cliff = on_cliff
+        self.auto_release = auto_release
+        self.clear_samples = clear_samples
+        self.values = None          # last sample
+        self.sample_time = 0        # monotonic time of the last sample
+        self.cliff = False          # cliff seen on the last sample
+        self.tripped = False        # motors latched off
+        self.trips = 0
+        self.samples = 0
+        self.overruns = 0           # samples later than one period
+        # (read time, check+halt time, sample interval) of the last trips, seconds
+        self.latency_log = deque(maxlen=100)
+        self._safe_count = 0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(name="cliff_monitor", target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        ''' stop monitoring, the latch is kept as it is '''
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def release(self):
+        ''' give the motors back to the app '''
+        self.tripped = False
+        self.px.release_motors()
+
+    def is_cliff(self, values):
+        reference = self.px.cliff_reference
+        return values[0] <= reference[0] or values[1] <= reference[1] or values[2] <= reference[2]
+
+    def _trip(self, values, read_start, read_end, interval):
+        self.px.halt_motors()
+        halted = time.monotonic()
+        self.tripped = True
+        self.trips += 1
+        self.latency_log.append((read_end - read_start, halted - read_end, interval))
+        if self.on_cliff is not None:
+            try:
+                self.on_cliff(values)
+            except Exception as e:
+                print(f"cliff monitor callback error: {e}")
+
+    def _loop(self):
+        next_time = time.monotonic()
+        last_read = next_time
+        while self._running:
+            read_start = time.monotonic()
+            try:
+                values = self.px.get_grayscale_data()
+            except Exception as e:
+                print(f"cliff monitor read error: {e}")
+                values = None
+            read_end = time.monotonic()
+            if values is not None:
+                interval = read_end - last_read
+                last_read = read_end
+                self.values = values
+                self.sample_time = read_end
+                self.samples += 1
+                cliff = self.is_cliff(values)
+                if cliff and not self.cliff and not self.tripped:
+                    self._trip(values, read_start, read_end, interval)
+                if cliff:
+                    self._safe_count = 0
+                else:
+                    self._safe_count += 1
+                    if self.auto_release and self.tripped and self._safe_count >= self.clear_samples:
+                        self.release()
+                self.cliff = cliff
+
+            next_time += self.period
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.overruns += 1
+                next_time = time.monotonic()
+
+    def metrics(self):
+        '''
+        Reaction latency of the last trips
+
+        return: {'trips', 'samples', 'overruns', 'avg_read', 'avg_halt', 'max_reaction', 'avg_interval'},
+            seconds, reaction is read + halt, the worst case adds one sample interval
+        '''
+        log = list(self.latency_log)
+        result = {'trips': self.trips, 'samples': self.samples, 'overruns': self.overruns,
+                  'avg_read': 0, 'avg_halt': 0, 'max_reaction': 0, 'avg_interval': 0}
+        if log:
+            n = len(log)
+            result['avg_read'] = sum(r for r, _, _ in log) / n
+            result['avg_halt'] = sum(h for _, h, _ in log) / n
+            result['max_reaction'] = max(r + h for r, h, _ in log)
+            result['avg_interval'] = sum(i for _, _, i in log) / n
+        return result
@@ -0,0 +1,262 @@
+'''
+Automatic grayscale calibration
+
+The car runs a short scripted sweep over the line while a thread samples the
+three grayscale channels as fast as the ADC allows. Each channel's samples are
+split into a line and a floor cluster (Otsu or 2-means), the threshold is put
+between them and the separation of the clusters tells whether the line was
+really seen. Results are saved with one config write.
+
+    cali = GrayscaleCalibrator(px)
+    result = cali.calibrate_line()
+    if result['ok']:
+        cali.save()
+'''
+import threading
+import time
+
+import numpy as np
+
+ADC_MAX = 4095
+
+
+def otsu_threshold(samples, bins=256):
+    '''
+    Threshold maximizing the between class variance of a 1d sample
+
+    param samples: 1d array
+    return: threshold
+    '''
+    samples = np.asarray(samples, dtype=np.float64)
+    hist, edges = np.histogram(samples, bins=bins, range=(0, ADC_MAX + 1))
+    centers = (edges[:-1] + edges[1:]) / 2
+    weight_low = np.cumsum(hist)
+    weight_high = weight_low[-1] - weight_low
+    sum_low = np.cumsum(hist * centers)
+    mean_low = np.divide(sum_low, weight_low, out=np.zeros_like(sum_low), where=weight_low > 0)
+    mean_high = np.divide(sum_low[-1] - sum_low, weight_high, out=np.zeros_like(sum_low), where=weight_high > 0)
+    between = weight_low * weight_high * (mean_low - mean_high) ** 2
+    # every cut in the empty gap between two clusters scores the same, take the middle
+    best = np.flatnonzero(between >= between.max() * (1 - 1e-9))
+    return (edges[best[0] + 1] + edges[best[-1] + 1]) / 2
+
+def kmeans_threshold(samples, iterations=20):
+    '''
+    Threshold halfway between the two centers of a 1d 2-means clustering
+
+    param samples: 1d array
+    return: threshold
+    '''
+    samples = np.asarray(samples, dtype=np.float64)
+    low, high = samples.min(), samples.max()
+    for _ in range(iterations):
+        threshold = (low + high) / 2
+        is_high = samples > threshold
+        if is_high.all() or not is_high.any():
+            break
+        new_low, new_high = samples[~is_high].mean(), samples[is_high].mean()
+        if new_low == low and new_high == high:
+            break
+        low, high = new_low, new_high
+    return (low + high) / 2
+
+THRESHOLD_METHODS = {
+    'otsu': otsu_threshold,
+    'kmeans': kmeans_threshold,
+}
+
+def fit_channel(samples, method='otsu', min_separation=3.0, margin=2.0):
+    '''
+    Split one channel into line (low) and floor (high) clusters
+
+    param samples: 1d array of readings
+    param method: 'otsu' or 'kmeans'
+    param min_separation: min distance of the cluster means in pooled standard deviations
+    param margin: the threshold must be this many standard deviations away from both means
+    return: dict of threshold, low/high mean and std, separation, ok
+    '''
+    samples = np.asarray(samples, dtype=np.float64)
+    threshold = THRESHOLD_METHODS[method](samples)
+    low = samples[samples <= threshold]
+    high = samples[samples > threshold]
+    if len(low) < 2 or len(high) < 2:
+        return {'threshold': float(threshold), 'low_mean': float(samples.mean()), 'high_mean': float(samples.mean()),
+                'low_std': float(samples.std()), 'high_std': float(samples.std()), 'separation': 0.0, 'ok': False}
+    low_mean, high_mean = low.mean(), high.mean()
+    low_std, high_std = low.std(), high.std()
+    pooled = np.sqrt((low_std ** 2 + high_std ** 2) / 2) + 1e-6
+    separation = (high_mean - low_mean) / pooled
+    ok = (separation >= min_separation
+          and threshold - low_mean >= margin * low_std
+          and high_mean - threshold >= margin * high_std)
+    return {
+        'threshold': float(threshold),
+        'low_mean': float(low_mean),
+        'high_mean': float(high_mean),
+        'low_std': float(low_std),
+        'high_std': float(high_std),
+        'separation': float(separation),
+        'ok': bool(ok),
+    }
+
+
+class GrayscaleSampler(object):
+    ''' Sample the grayscale module from a thread into a growing array '''
+
+    def __init__(self, read, rate=200):
+        '''
+        param read: callable() -> [L, C, R]
+        param rate: max samples per second
+        '''
+        self.read = read
+        self.rate = rate
+        self._chunks = []
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._chunks = []
+        self._running = True
+        self._thread = threading.Thread(name="grayscale_sampler", target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''
+        return: N x 3 array of the samples
+        '''
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if not self._chunks:
+            return np.empty((0, 3))
+        return np.asarray(self._chunks, dtype=np.float64)
+
+    def _loop(self):
+        period = 1.0 / self.rate
+        next_time = time.monotonic()
+        while self._running:
+            try:
+                self._chunks.append(self.read())
+            except Exception as e:
+                print(f"grayscale sampler error: {e}")
+            next_time += period
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.monotonic()
+
+
+class GrayscaleCalibrator(object):
+    '''
+    Calibrate line and cliff references of a Picarx
+
+    The line sweep steers left and right while driving forward and back over
+    the line, so every sensor sees both the line and the floor.
+    '''
+    SWEEP_ANGLE = 35
+    SWEEP_SPEED = 10
+    SWEEP_TIME = 0.8 # seconds per move
+
+    def __init__(self, px, method='otsu', rate=200, min_separation=3.0, margin=2.0):
+        '''
+        param px: Picarx
+        param method: 'otsu' or 'kmeans'
+        param rate: samples per second
+        param min_separation: see fit_channel()
+        param margin: see fit_channel()
+        '''
+        if method not in THRESHOLD_METHODS:
+            raise ValueError(f"method must be one of {tuple(THRESHOLD_METHODS)}, not '{method}'")
+        self.px = px
+        self.method = method
+        self.min_separation = min_separation
+        self.margin = margin
+        self.sampler = GrayscaleSampler(px.get_grayscale_data, rate)
+        self.line_reference = list(px.line_reference)
+        self.cliff_reference = list(px.cliff_reference)
+        self.line_result = None
+        self.cliff_result = None
+        self.samples = None
+
+    def sweep(self):
+        ''' the scripted moves of the line calibration '''
+        px = self.px
+        for angle in (-self.SWEEP_ANGLE, self.SWEEP_ANGLE):
+            px.set_dir_servo_angle(angle)
+            px.forward(self.SWEEP_SPEED)
+            time.sleep(self.SWEEP_TIME)
+            px.backward(self.SWEEP_SPEED)
+            time.sleep(self.SWEEP_TIME)
+            px.set_dir_servo_angle(0)
+            px.stop()
+            time.sleep(0.2)
+
+    def calibrate_line(self, sweep=None):
+        '''
+        Sample during the sweep and fit a threshold per channel
+
+        param sweep: callable() doing the moves, default self.sweep
+        return: {'ok', 'reference', 'channels': [fit_channel() results], 'samples', 'rate'}
+        '''
+        self.sampler.start()
+        st = time.monotonic()
+        try:
+            (sweep or self.sweep)()
+        finally:
+            self.px.stop()
+            samples = self.sampler.stop()
+        duration = time.monotonic() - st
+        self.samples = samples
+        if len(samples) == 0:
+            raise RuntimeError("no grayscale samples")
+        channels = [fit_channel(samples[:, i], self.method, self.min_separation, self.margin)
+                    for i in range(3)]
+        ok = all(c['ok'] for c in channels)
+        if ok:
+            self.line_reference = [int(round(c['threshold'])) for c in channels]
+        self.line_result = {
+            'ok': ok,
+            'reference': list(self.line_reference),
+            'channels': channels,
+            'samples': len(samples),
+            'rate': len(samples) / duration,
+        }
+        return self.line_result
+
+    def calibrate_cliff(self, duration=0.5, k=3.0):
+        '''
+        Sample with the car held over a cliff (or lifted), the reference is put
+        between the cliff readings and the line cluster
+
+        param duration: seconds of sampling
+        param k: standard deviations of margin over the cliff readings
+        return: {'ok', 'reference', 'mean', 'std'}
+        '''
+        self.sampler.start()
+        time.sleep(duration)
+        samples = self.sampler.stop()
+        if len(samples) == 0:
+            raise RuntimeError("no grayscale samples")
+        mean = samples.mean(axis=0)
+        std = samples.std(axis=0)
+        reference = []
+        ok = True
+        for i in range(3):
+            cliff_top = mean[i] + k * std[i]
+            if self.line_result is not None:
+                line_bottom = self.line_result['channels'][i]['low_mean'] - k * self.line_result['channels'][i]['low_std']
+                if cliff_top >= line_bottom:
+                    ok = False
+                reference.append(int((cliff_top + line_bottom) / 2) if cliff_top < line_bottom else int(cliff_top))
+            else:
+                reference.append(int(cliff_top))
+        if ok:
+            self.cliff_reference = reference
+        self.cliff_result = {'ok': ok, 'reference': reference, 'mean': mean.tolist(), 'std': std.tolist()}
+        return self.cliff_result
+
+    def save(self):
+        ''' write both references to the config at once '''
+        self.px.set_grayscale_references(self.line_reference, self.cliff_reference)
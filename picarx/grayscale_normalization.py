@@ -0,0 +1,279 @@
+'''
+Adaptive grayscale normalization
+
+Lighting scales all the readings up and down through the day, fixed
+references go stale and need a recalibration. AdaptiveGrayscale follows the
+lighting instead: per channel it keeps running estimates of the floor level
+and of the line level, both as a ratio to the floor, and derives the
+threshold from them. Each sample costs a few multiply-adds, whatever the
+history length.
+
+The line/floor ratio of a surface doesn't change with the light, so the
+line level follows the floor even while no sensor is on the line.
+
+    norm = AdaptiveGrayscale(px.line_reference, floor=[1800]*3, line=[600]*3)
+    status = norm.update(px.get_grayscale_data())   # 0 = line, 1 = floor
+    print(norm.state())
+'''
+import math
+
+POLARITIES = ('dark', 'light')
+
+
+class AdaptiveGrayscale(object):
+    '''
+    Running floor/line estimates and thresholds of the three grayscale channels
+
+    update() classifies a sample with the current thresholds, then updates
+    the matching estimator with an exponential moving average:
+        floor level, floor variance  on floor samples
+        line ratio, line variance    on line samples
+    and the threshold moves between the two levels, closer to the noisier one.
+
+    A sudden light change (or a bad starting reference) can move a whole
+    level to the other side of the threshold, then every sample lands on one
+    side and the estimators lock. A channel that gets recover_samples
+    samples on one side in a row splits them in two clusters. If they are
+    apart by min_contrast, they are taken as the new floor and line levels.
+    On the line side, a single cluster off the line level by min_contrast
+    towards the floor is taken as the new floor, keeping the line ratio, and
+    the other channels that are stuck on the line side too scale their floor
+    by the same factor, as the light changed for all three. A sensor that
+    simply sits on the line or the floor gives a single cluster at its level
+    and is left alone.
+    '''
+
+    def __init__(self, reference=(1000, 1000, 1000), floor=None, line=None, polarity='dark',
+                 alpha=0.02, line_alpha=0.05, min_contrast=0.15, exclude=None,
+                 recover_samples=50):
+        '''
+        param reference: [L, C, R] starting thresholds, e.g. px.line_reference
+        param floor: [L, C, R] starting floor levels, default reference * 1.5 (dark line)
+        param line: [L, C, R] starting line levels, default reference * 0.5 (dark line)
+        param polarity: 'dark' line darker than the floor, 'light' lighter
+        param alpha: smoothing of the floor estimators, 0-1, larger follows faster
+        param line_alpha: smoothing of the line estimators
+        param min_contrast: min relative difference of line and floor kept, so
+            the threshold never collapses onto the floor
+        param exclude: [L, C, R] readings below these are not used (cliff), e.g. px.cliff_reference
+        param recover_samples: samples of a channel on one side of the threshold
+            in a row before they are checked for a light change
+        '''
+        if polarity not in POLARITIES:
+            raise ValueError(f"polarity must be one of {POLARITIES}, not '{polarity}'")
+        self.polarity = polarity
+        self.alpha = alpha
+        self.line_alpha = line_alpha
+        self.min_contrast = min_contrast
+        self.exclude = list(exclude) if exclude is not None else None
+        self.recover_samples = recover_samples
+
+        dark = polarity == 'dark'
+        reference = [float(r) for r in reference]
+        if floor is None:
+            floor = [r * 1.5 if dark else r * 0.5 for r in reference]
+        if line is None:
+            line = [r * 0.5 if dark else r * 1.5 for r in reference]
+        self.floor = [max(float(f), 1.0) for f in floor]
+        self.ratio = [self._clamp_ratio(float(l) / f) for l, f in zip(line, self.floor)]
+        # variances start at a tenth of the level, squared
+        self.floor_var = [(f * 0.1) ** 2 for f in self.floor]
+        self.line_var = [(f * r * 0.1) ** 2 for f, r in zip(self.floor, self.ratio)]
+        self.reference = [0.0, 0.0, 0.0]
+        self.samples = 0
+        self.line_samples = [0, 0, 0]
+        self.floor_samples = [0, 0, 0]
+        self.recoveries = [0, 0, 0]
+        # samples of one side since the last sample of the other side
+        self._floor_window = [[], [], []]
+        self._line_window = [[], [], []]
+        # (line ratio, line variance) before the line window
+        self._window_start = [None, None, None]
+        for i in range(3):
+            self._update_reference(i)
+
+    def _clamp_ratio(self, ratio):
+        if self.polarity == 'dark':
+            return min(max(ratio, 0.0), 1.0 - self.min_contrast)
+        return max(ratio, 1.0 + self.min_contrast)
+
+    def _update_reference(self, i):
+        floor = self.floor[i]
+        line = floor * self.ratio[i]
+        floor_std = math.sqrt(self.floor_var[i])
+        line_std = math.sqrt(self.line_var[i])
+        # equal distance from both levels in standard deviations
+        total = floor_std + line_std
+        if total > 0:
+            self.reference[i] = line + (floor - line) * line_std / total
+        else:
+            self.reference[i] = (floor + line) / 2
+
+    def update(self, values):
+        '''
+        Classify a sample and update the estimators
+
+        param values: [L, C, R] readings
+        return: [L, C, R] status, 0 = line, 1 = floor, same as read_status()
+        '''
+        self.samples += 1
+        dark = self.polarity == 'dark'
+        status = [1, 1, 1]
+        for i in range(3):
+            value = float(values[i])
+            is_floor = value > self.reference[i] if dark else value < self.reference[i]
+            status[i] = 1 if is_floor else 0
+            if self.exclude is not None and value < self.exclude[i]:
+                continue
+            if is_floor:
+                self._line_window[i] = []
+                self._floor_window[i].append(value)
+                a = self.alpha
+                delta = value - self.floor[i]
+                self.floor[i] = max(self.floor[i] + a * delta, 1.0)
+                self.floor_var[i] = (1 - a) * (self.floor_var[i] + a * delta * delta)
+                self.floor_samples[i] += 1
+                if len(self._floor_window[i]) >= self.recover_samples:
+                    self._recover_floor(i)
+            else:
+                self._floor_window[i] = []
+                if not self._line_window[i]:
+                    self._window_start[i] = (self.ratio[i], self.line_var[i])
+                self._line_window[i].append(value)
+                a = self.line_alpha
+                line = self.floor[i] * self.ratio[i]
+                delta = value - line
+                self.ratio[i] = self._clamp_ratio(self.ratio[i] + a * delta / self.floor[i])
+                self.line_var[i] = (1 - a) * (self.line_var[i] + a * delta * delta)
+                self.line_samples[i] += 1
+                if len(self._line_window[i]) >= self.recover_samples:
+                    self._recover_line(i)
+            self._update_reference(i)
+        return status
+
+    def _split(self, samples):
+        '''
+        1d 2-means of the samples of one side of the threshold
+
+        return: (floor, floor samples, line, line samples), None if there
+            are not two levels apart by min_contrast
+        '''
+        low, high = min(samples), max(samples)
+        for _ in range(20):
+            threshold = (low + high) / 2
+            lows = [v for v in samples if v <= threshold]
+            highs = [v for v in samples if v > threshold]
+            if not lows or not highs:
+                return None
+            new_low, new_high = sum(lows) / len(lows), sum(highs) / len(highs)
+            if new_low == low and new_high == high:
+                break
+            low, high = new_low, new_high
+        if low <= 0 or high <= low * (1 + self.min_contrast):
+            return None
+        if self.polarity == 'dark':
+            return high, highs, low, lows
+        return low, lows, high, highs
+
+    def _set_levels(self, i, floor, floor_samples, line, line_var):
+        self.floor[i] = max(floor, 1.0)
+        self.ratio[i] = self._clamp_ratio(line / self.floor[i])
+        self.floor_var[i] = sum((v - floor) ** 2 for v in floor_samples) / len(floor_samples)
+        self.line_var[i] = line_var
+        self.recoveries[i] += 1
+
+    def _recover_floor(self, i):
+        ''' floor samples without line samples, the line may be read as floor after a light change '''
+        samples = self._floor_window[i]
+        self._floor_window[i] = []
+        levels = self._split(samples)
+        if levels is None:
+            return
+        floor, floor_samples, line, line_samples = levels
+        line_var = sum((v - line) ** 2 for v in line_samples) / len(line_samples)
+        self._set_levels(i, floor, floor_samples, line, line_var)
+
+    def _recover_line(self, i):
+        ''' line samples without floor samples, the floor may be read as line after a light change '''
+        samples = self._line_window[i]
+        self._line_window[i] = []
+        levels = self._split(samples)
+        if levels is not None:
+            floor, floor_samples, line, line_samples = levels
+            line_var = sum((v - line) ** 2 for v in line_samples) / len(line_samples)
+        else:
+            # a single level, the floor if it is off the line level towards it
+            floor = sum(samples) / len(samples)
+            floor_samples = samples
+            # the line estimator has been pulled towards them, go back to before
+            ratio, line_var = self._window_start[i]
+            line = self.floor[i] * ratio
+            if self.polarity == 'dark':
+                off = floor > line * (1 + self.min_contrast)
+            else:
+                off = floor * (1 + self.min_contrast) < line
+            if not off:
+                return
+            gain = floor / self.floor[i]
+            line = line * gain
+            line_var = line_var * gain * gain
+        gain = floor / self.floor[i]
+        self._set_levels(i, floor, floor_samples, line, line_var)
+        # the other channels, if stuck for a while too, saw the same change
+        for j in range(3):
+            if j != i and len(self._line_window[j]) >= self.recover_samples // 2:
+                ratio, line_var = self._window_start[j]
+                self._line_window[j] = []
+                self.floor[j] = max(self.floor[j] * gain, 1.0)
+                self.ratio[j] = ratio
+                self.floor_var[j] *= gain * gain
+                self.line_var[j] = line_var * gain * gain
+                self.recoveries[j] += 1
+                self._update_reference(j)
+
+    def status(self, values):
+        ''' status of readings with the current thresholds, without updating '''
+        if self.polarity == 'dark':
+            return [1 if float(v) > r else 0 for v, r in zip(values, self.reference)]
+        return [1 if float(v) < r else 0 for v, r in zip(values, self.reference)]
+
+    def normalize(self, values):
+        '''
+        Readings mapped to the current levels, 0 = line level, 1 = floor level, clamped to 0-1
+
+        param values: [L, C, R] readings
+        return: [L, C, R] floats
+        '''
+        result = []
+        for i in range(3):
+            floor = self.floor[i]
+            line = floor * self.ratio[i]
+            x = (float(values[i]) - line) / (floor - line)
+            result.append(min(max(x, 0.0), 1.0))
+        return result
+
+    def state(self):
+        '''
+        Estimator state for telemetry
+
+        return: dict of lists per channel: reference, floor, line, floor_std,
+            line_std, contrast (line/floor separation in standard deviations),
+            line_samples, floor_samples, recoveries, and samples (total)
+        '''
+        line = [f * r for f, r in zip(self.floor, self.ratio)]
+        floor_std = [math.sqrt(v) for v in self.floor_var]
+        line_std = [math.sqrt(v) for v in self.line_var]
+        contrast = [abs(f - l) / (fs + ls + 1e-6) * 2
+                    for f, l, fs, ls in zip(self.floor, line, floor_std, line_std)]
+        return {
+            'reference': [round(r, 1) for r in self.reference],
+            'floor': [round(f, 1) for f in self.floor],
+            'line': [round(l, 1) for l in line],
+            'floor_std': [round(s, 1) for s in floor_std],
+            'line_std': [round(s, 1) for s in line_std],
+            'contrast': [round(c, 2) for c in contrast],
+            'line_samples': list(self.line_samples),
+            'floor_samples': list(self.floor_samples),
+            'recoveries': list(self.recoveries),
+            'samples': self.samples,
+        }
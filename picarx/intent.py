@@ -0,0 +1,165 @@
+import difflib
+import re
+
+STOP_WORDS = ('stop', 'halt', 'freeze', 'brake')
+FILLER_WORDS = (
+    'a', 'an', 'the', 'please', 'now', 'robot', 'car', 'picarx', 'hey', 'ok', 'okay',
+    'go', 'and', 'then', 'to', 'bit', 'little', 'some', 'me', 'for', 'just', 'again',
+    'your', 'it', 'turn', 'move',
+)
+# polite requests, dropped at the start of an utterance only: "can you nod" is
+# a command, "do you think" or "would you like to dance" are not
+POLITE_OPENERS = ('can you', 'could you', 'would you', 'will you')
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+
+def normalize(text):
+    ''' lower case words without punctuation '''
+    return _WORD.findall(text.lower())
+
+
+class IntentMatcher(object):
+    '''
+    Match short spoken commands to actions locally, without the LLM
+
+    Action names (and synonyms) are indexed by word count once. An utterance
+    matches when every word is either part of an action phrase, exactly or
+    fuzzily (STT typos like "celebrat"), or a filler word; otherwise it's an
+    open request and match() returns None so the caller can ask the LLM.
+    Short words must match exactly, "no" is not "nod". Questions are not
+    commands: only a polite opener ("can you ...") followed by an action is.
+
+    Usage:
+        intents = IntentMatcher(actions_dict, synonyms={'wave hands': ['wave', 'say hello']})
+        names = intents.match("please nod and wave")  # ['nod', 'wave hands']
+        if names is None:
+            ... # ask the llm
+    '''
+
+    def __init__(self, actions, synonyms=None, stop_words=STOP_WORDS, filler_words=FILLER_WORDS,
+                 polite_openers=POLITE_OPENERS, cutoff=0.8, word_cutoff=0.9, exact_length=4,
+                 max_unknown=0):
+        '''
+        :param actions: {name: handler}, names are matched, handlers are called by dispatch()
+        :param synonyms: {name: [other phrases]}
+        :param stop_words: words meaning stop, checked first, dispatched as 'stop'
+        :param filler_words: words ignored when matching
+        :param polite_openers: phrases ignored at the start of an utterance
+        :param cutoff: fuzzy match ratio (0-1) to accept a phrase of several words
+        :param word_cutoff: fuzzy match ratio (0-1) to accept a one word phrase
+        :param exact_length: words this long or shorter only match exactly
+        :param max_unknown: unknown words allowed before giving up to the LLM
+        '''
+        self.actions = actions
+        self.stop_words = frozenset(stop_words)
+        self.filler_words = frozenset(filler_words)
+        self.polite_openers = [normalize(phrase) for phrase in polite_openers]
+        self.cutoff = cutoff
+        self.word_cutoff = word_cutoff
+        self.exact_length = exact_length
+        self.max_unknown = max_unknown
+
+        # index: word count -> {phrase: name}
+        self.index = {}
+        phrases = [(name, name) for name in actions]
+        for name, others in (synonyms or {}).items():
+            phrases += [(phrase, name) for phrase in others]
+        for phrase, name in phrases:
+            words = normalize(phrase)
+            if words:
+                self.index.setdefault(len(words), {})[' '.join(words)] = name
+        self.max_words = max(self.index) if self.index else 0
+        # longest phrases first so "wave hands" wins over "wave"
+        self._sizes = sorted(self.index, reverse=True)
+        self._choices = {n: list(p) for n, p in self.index.items()}
+
+    def is_stop(self, text):
+        '''
+        Fast check for a stop word anywhere, cheap enough for every partial STT
+        result; loose on purpose, use match() for complete utterances
+
+        :param text: utterance, or partial utterance
+        :rtype: bool
+        '''
+        return any(word in self.stop_words for word in normalize(text))
+
+    def _lookup(self, words, i):
+        ''' longest phrase at words[i], (name, word count) or (None, 0) '''
+        for n in self._sizes:
+            if i + n > len(words):
+                continue
+            ngram = ' '.join(words[i:i+n])
+            name = self.index[n].get(ngram)
+            if name is not None:
+                return name, n
+            cutoff = self.word_cutoff if n == 1 else self.cutoff
+            for phrase in difflib.get_close_matches(ngram, self._choices[n], n=3, cutoff=cutoff):
+                if self._short_words_equal(words[i:i+n], phrase.split()):
+                    return self.index[n][phrase], n
+        return None, 0
+
+    def _short_words_equal(self, words, phrase_words):
+        ''' fuzzy matches may only differ in long words '''
+        return all(a == b for a, b in zip(words, phrase_words)
+                   if len(a) <= self.exact_length or len(b) <= self.exact_length)
+
+    def _strip_opener(self, words):
+        ''' drop a polite opener after the leading filler words '''
+        i = 0
+        while i < len(words) and words[i] in self.filler_words:
+            i += 1
+        for opener in self.polite_openers:
+            if words[i:i+len(opener)] == opener:
+                return words[:i] + words[i+len(opener):]
+        return words
+
+    def match(self, text):
+        '''
+        Match an utterance to actions
+
+        :param text: utterance
+        :return: action names in spoken order, ['stop'] for a stop command,
+                 None if it's not a known command
+        :rtype: list/None
+        '''
+        words = self._strip_opener(normalize(text))
+        if not words:
+            return None
+        # a stop command is stop words and fillers only, not "what is a bus stop"
+        if (any(word in self.stop_words for word in words)
+                and all(word in self.stop_words or word in self.filler_words for word in words)):
+            return ['stop']
+        names = []
+        unknown = 0
+        i = 0
+        while i < len(words):
+            name, n = self._lookup(words, i)
+            if name is not None:
+                names.append(name)
+                i += n
+                continue
+            if words[i] not in self.filler_words:
+                unknown += 1
+                if unknown > self.max_unknown:
+                    return None
+            i += 1
+        return names or None
+
+    def dispatch(self, text, *args):
+        '''
+        Match an utterance and call the handlers
+
+        :param text: utterance
+        :param args: passed to the handlers, e.g. the car
+        :return: action names called, None if it's not a known command
+        :rtype: list/None
+        '''
+        names = self.match(text)
+        if names is None:
+            return None
+        for name in names:
+            handler = self.actions.get(name)
+            if handler is not None:
+                handler(*args)
+        return names
@@ -0,0 +1,324 @@
+'''
+Line position estimation from the three grayscale sensors
+
+Every function takes one sample ([L, C, R]) or a batch (N x 3 array) and
+returns the same shape minus the last axis, so the live loop and offline
+evaluation of logged data run the same code:
+
+    est = LineEstimator('centroid', reference=[1400, 1400, 1400])
+    error, lost = est.estimate(gm.read())        # one sample -> floats
+    errors, lost = est.estimate(np.load('log.npy'))  # N x 3 -> arrays
+
+error is in [-1, 1], negative means the line is to the left.
+'''
+import hashlib
+import os
+
+import numpy as np
+
+POLARITIES = ('dark', 'light')
+POSITIONS = np.array([-1.0, 0.0, 1.0])
+
+# error of each thresholded pattern, index is L*4 + C*2 + R with 1 = background,
+# nan means ambiguous, use the continuous estimate
+STATUS_TABLE = np.array([
+    np.nan, # [0, 0, 0]
+    -0.5,   # [0, 0, 1]
+    np.nan, # [0, 1, 0]
+    -0.8,   # [0, 1, 1]
+    0.5,    # [1, 0, 0]
+    0.0,    # [1, 0, 1]
+    0.8,    # [1, 1, 0]
+    np.nan, # [1, 1, 1] lost
+])
+LOST_CODE = 7
+
+
+def _check_polarity(polarity):
+    if polarity not in POLARITIES:
+        raise ValueError(f"polarity must be one of {POLARITIES}, not '{polarity}'")
+
+def _as_float(values):
+    return np.asarray(values, dtype=np.float64)
+
+def _out(x):
+    ''' numpy scalar to python scalar for single samples '''
+    return x.item() if np.ndim(x) == 0 else x
+
+def line_status(values, reference, polarity='dark'):
+    '''
+    Threshold readings against the references
+
+    param values: [L, C, R] or N x 3
+    param reference: [L, C, R] thresholds
+    param polarity: 'dark' line darker than the floor, 'light' lighter
+    return: int array, 0 = line, 1 = background
+    '''
+    _check_polarity(polarity)
+    values = _as_float(values)
+    reference = _as_float(reference)
+    if polarity == 'dark':
+        return (values > reference).astype(np.int8)
+    return (values < reference).astype(np.int8)
+
+def status_code(status):
+    ''' pattern index L*4 + C*2 + R of line_status() output '''
+    status = np.asarray(status)
+    return status[..., 0] * 4 + status[..., 1] * 2 + status[..., 2]
+
+def weighted_error(values, polarity='dark', sensitivity=1.0):
+    '''
+    Contrast weighted centroid of the sensor positions
+
+    param sensitivity: contrast exponent, higher is more aggressive
+    '''
+    _check_polarity(polarity)
+    values = _as_float(values)
+    total = values.sum(axis=-1, keepdims=True)
+    safe_total = np.where(total == 0, 1, total)
+    if polarity == 'dark':
+        contrast = (total - values) / safe_total
+    else:
+        contrast = values / safe_total
+    weights = np.clip(contrast, 0, None) ** max(sensitivity, 1e-3)
+    wsum = weights.sum(axis=-1)
+    error = np.divide(weights @ POSITIONS, wsum, out=np.zeros_like(wsum), where=wsum != 0)
+    return np.where(total[..., 0] == 0, 0.0, error)
+
+def centroid_error(values, status, polarity='dark', sensitivity=1.0, table=STATUS_TABLE):
+    '''
+    Table error for clear patterns, weighted centroid for the ambiguous ones
+
+    param status: line_status() of the values
+    param table: error per status_code(), nan to use the centroid
+    return: (error, lost)
+    '''
+    code = status_code(status)
+    error = table[code]
+    fallback = np.isnan(error)
+    if np.any(fallback):
+        error = np.where(fallback, weighted_error(values, polarity, sensitivity), error)
+    return _out(error), _out(code == LOST_CODE)
+
+def edge_error(values, polarity='dark', mag_thresh=0.05, asym_thresh=0.03, gain=0.7, lost_spread=25):
+    '''
+    Error from the edges between neighbouring sensors, lighting invariant
+
+    Brightness is removed by subtracting the mean, adjacent differences are
+    normalized by the spread. A clear one sided edge gives the error, else
+    the centroid of the darkness (or lightness) is used.
+
+    param gain: scale of the error before clamping to [-1, 1]
+    param lost_spread: line is lost when all readings are within this of the mean
+    return: (error, lost)
+    '''
+    _check_polarity(polarity)
+    values = _as_float(values)
+    rel = values - values.mean(axis=-1, keepdims=True)
+    d_lc = rel[..., 1] - rel[..., 0]
+    d_cr = rel[..., 2] - rel[..., 1]
+    if polarity == 'light':
+        d_lc, d_cr = -d_lc, -d_cr
+    spread = np.abs(rel).max(axis=-1)
+    d_lc = d_lc / (spread + 1e-6)
+    d_cr = d_cr / (spread + 1e-6)
+
+    a_lc, a_cr = np.abs(d_lc), np.abs(d_cr)
+    use_edge = (np.maximum(a_lc, a_cr) > mag_thresh) & (np.abs(a_lc - a_cr) > asym_thresh)
+    edge = np.where(a_lc > a_cr, d_lc, -d_cr)
+
+    weights = -rel
+    centroid = (weights @ POSITIONS) / (np.abs(weights).sum(axis=-1) + 1e-6)
+
+    error = np.clip(gain * np.where(use_edge, edge, centroid), -1.0, 1.0)
+    return _out(error), _out(spread < lost_spread)
+
+
+class LineEstimator(object):
+    '''
+    Line estimator with fixed settings
+
+    methods:
+        'centroid': status table for clear patterns, weighted centroid otherwise
+        'edge': adjacent sensor edges, falls back to the centroid
+        'table': status table only, ambiguous patterns give 0
+    '''
+    METHODS = ('centroid', 'edge', 'table')
+
+    def __init__(self, method='centroid', reference=(1400, 1400, 1400), polarity='dark',
+                 sensitivity=1.0, table=STATUS_TABLE, **edge_options):
+        '''
+        param reference: [L, C, R] thresholds, for 'centroid' and 'table'
+        param polarity: 'dark' or 'light' line
+        param sensitivity: contrast exponent of the centroid
+        param table: error per status code, see STATUS_TABLE
+        param edge_options: mag_thresh, asym_thresh, gain, lost_spread of edge_error()
+        '''
+        if method not in self.METHODS:
+            raise ValueError(f"method must be one of {self.METHODS}, not '{method}'")
+        _check_polarity(polarity)
+        self.method = method
+        self.reference = list(reference)
+        self.polarity = polarity
+        self.sensitivity = sensitivity
+        self.table = np.asarray(table, dtype=np.float64)
+        self.edge_options = edge_options
+
+    def status(self, values):
+        return line_status(values, self.reference, self.polarity)
+
+    def estimate(self, values):
+        '''
+        param values: [L, C, R] or N x 3 readings
+        return: (error, lost), floats/bools for one sample, arrays for a batch
+        '''
+        if self.method == 'edge':
+            return edge_error(values, self.polarity, **self.edge_options)
+        status = self.status(values)
+        if self.method == 'table':
+            code = status_code(status)
+            return _out(np.nan_to_num(self.table[code])), _out(code == LOST_CODE)
+        return centroid_error(values, status, self.polarity, self.sensitivity, self.table)
+
+
+# Lookup table
+# =================================================================
+ADC_BITS = 12
+DEFAULT_LUT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'picarx', 'line_lut')
+LUT_DTYPE = np.dtype([('error', '<f2'), ('lost', 'u1'), ('confidence', 'u1')])
+
+
+class LineLUT(object):
+    '''
+    Precomputed estimator output for every quantized (L, C, R)
+
+    Readings are quantized to `bits` per channel and the estimator is run once
+    on every cell, so an estimate is a single index operation whatever the
+    estimator costs. Tables are stored as .npy files named after the
+    estimator settings and opened memory mapped, a new line_reference gets a
+    new table, an old one is reused.
+
+    Usage:
+        est = LineEstimator('centroid', reference=px.line_reference)
+        lut = LineLUT.for_estimator(est)
+        error, lost, confidence = lut.lookup(px.get_grayscale_data())
+    '''
+
+    def __init__(self, table, bits):
+        '''
+        param table: LUT_DTYPE array, (2**bits,)*3
+        param bits: bits per channel
+        '''
+        self.table = table
+        self.bits = bits
+        self.shift = ADC_BITS - bits
+
+    @staticmethod
+    def confidence(values, error, lost, contrast_range=1000):
+        '''
+        0-1, how far apart the readings are compared to contrast_range (adc
+        counts), 0 when the line is lost
+        '''
+        values = _as_float(values)
+        spread = values.max(axis=-1) - values.min(axis=-1)
+        return np.where(lost, 0.0, np.clip(spread / contrast_range, 0, 1))
+
+    @classmethod
+    def build(cls, estimator, bits=6, path=None, contrast_range=1000):
+        '''
+        Run the estimator on the center of every cell
+
+        param estimator: LineEstimator or anything with estimate(values) -> (error, lost)
+        param bits: bits per channel, 6 bits is 64**3 cells, 1 MB
+        param path: .npy file to store the table in, None to keep it in memory
+        return: LineLUT
+        '''
+        n = 1 << bits
+        step = 1 << (ADC_BITS - bits)
+        centers = np.arange(n) * step + step / 2
+        grid = np.stack(np.meshgrid(centers, centers, centers, indexing='ij'), axis=-1).reshape(-1, 3)
+        error, lost = estimator.estimate(grid)
+        confidence = cls.confidence(grid, error, lost, contrast_range)
+
+        if path is None:
+            table = np.empty((n, n, n), dtype=LUT_DTYPE)
+        else:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            table = np.lib.format.open_memmap(tmp, mode='w+', dtype=LUT_DTYPE, shape=(n, n, n))
+        flat = table.reshape(-1)
+        flat['error'] = error
+        flat['lost'] = lost
+        flat['confidence'] = np.round(confidence * 255)
+        if path is not None:
+            table.flush()
+            del table, flat
+            os.replace(tmp, path)
+            table = np.load(path, mmap_mode='r')
+        return cls(table, bits)
+
+    @classmethod
+    def load(cls, path):
+        ''' open a stored table memory mapped '''
+        table = np.load(path, mmap_mode='r')
+        if table.dtype != LUT_DTYPE or table.ndim != 3:
+            raise ValueError(f"{path} is not a line LUT")
+        bits = int(table.shape[0]).bit_length() - 1
+        return cls(table, bits)
+
+    @staticmethod
+    def key(estimator, bits):
+        ''' file name of the table of these estimator settings '''
+        parts = [estimator.method, estimator.reference, estimator.polarity, estimator.sensitivity,
+                 estimator.table.tolist(), sorted(estimator.edge_options.items()), bits]
+        return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:16]
+
+    @classmethod
+    def for_estimator(cls, estimator, bits=6, lut_dir=DEFAULT_LUT_DIR):
+        '''
+        Load the table of a LineEstimator, build and store it on the first use
+
+        param estimator: LineEstimator
+        param bits: bits per channel
+        param lut_dir: directory of the stored tables
+        return: LineLUT
+        '''
+        path = os.path.join(lut_dir, f"{estimator.method}-{cls.key(estimator, bits)}.npy")
+        if os.path.isfile(path):
+            try:
+                return cls.load(path)
+            except ValueError:
+                pass
+        return cls.build(estimator, bits, path)
+
+    def index(self, values):
+        ''' quantized cell of readings '''
+        q = np.clip(np.asarray(values, dtype=np.int64), 0, (1 << ADC_BITS) - 1) >> self.shift
+        return q[..., 0], q[..., 1], q[..., 2]
+
+    def _single(self, values):
+        ''' (error, lost, confidence) python values of one [L, C, R] list, None for arrays '''
+        if isinstance(values, (list, tuple)) and not isinstance(values[0], (list, tuple)):
+            # plain int indexing skips the array conversions
+            top = (1 << ADC_BITS) - 1
+            s = self.shift
+            l, c, r = (min(max(int(v), 0), top) >> s for v in values)
+            error, lost, confidence = self.table[l, c, r].item()
+            return float(error), bool(lost), confidence / 255.0
+        return None
+
+    def lookup(self, values):
+        '''
+        param values: [L, C, R] or N x 3 readings
+        return: (error, lost, confidence), confidence 0-1
+        '''
+        single = self._single(values)
+        if single is not None:
+            return single
+        cell = self.table[self.index(values)]
+        return (_out(cell['error'].astype(np.float64)), _out(cell['lost'].astype(bool)),
+                _out(cell['confidence'] / 255.0))
+
+    def estimate(self, values):
+        ''' same as LineEstimator.estimate() '''
+        return self.lookup(values)[:2]
@@ -0,0 +1,155 @@
+'''
+Motor speed ramping
+
+Picarx.set_motor_speed() changes the duty cycle at once, a jump from stop
+to full speed (or from forward to backward) draws a current spike that can
+brown out the board. MotorRamp moves the PWM duty of each motor towards its
+target on a fixed tick, with limited acceleration and jerk. It works on the
+duty after Picarx maps the speed to it (any nonzero speed is at least 50%),
+so the first tick after a stop is a small step too, not a jump to 50%.
+
+Commands only replace the target, so a burst of commands between two ticks
+is not written one by one. A ramp itself costs writes though: one every
+min_step of duty on the way, so about 20 to go from stop to 90% with the
+default 5%, where a direct command writes once.
+
+    ramp = px.set_motor_ramp(accel=300, jerk=3000)
+    px.forward(80)      # 90% duty in about 0.4 s
+'''
+import math
+import threading
+import time
+
+
+class MotorRamp(object):
+    '''
+    Acceleration and jerk limited speeds of the two motors
+
+    Speeds are signed PWM duties in percent, -100 to 100. Every tick the
+    rate of change moves by at most jerk * tick towards the rate that
+    reaches the target, capped by accel and by what can still be braked at
+    jerk before the target, so the speed settles without overshoot.
+    '''
+
+    def __init__(self, write, accel=300, jerk=3000, tick=0.01, motors=2, min_step=5):
+        '''
+        param write: callable(motor, duty) writing a motor, motor 1 or 2
+        param accel: max change of duty per second, %/s
+        param jerk: max change of accel per second, None for no jerk limit
+        param tick: seconds between two updates
+        param motors: number of motors
+        param min_step: duty change worth a write on the way, %, the target is always written
+        '''
+        self.write = write
+        self.accel = accel
+        self.jerk = jerk
+        self.tick = tick
+        self.min_step = min_step
+        self.targets = [0.0] * motors
+        self.speeds = [0.0] * motors
+        self.rates = [0.0] * motors
+        self._written = [0] * motors
+        self.commands = 0
+        self.writes = 0
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._running = True
+            self._thread = threading.Thread(name="motor_ramp", target=self._loop, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def set_target(self, motor, speed):
+        '''
+        param motor: 1 or 2
+        param speed: signed duty, -100 to 100
+        '''
+        with self._cond:
+            self.targets[motor - 1] = float(speed)
+            self.commands += 1
+            self._cond.notify()
+
+    def reset(self, speeds=None):
+        '''
+        Jump to speeds without ramping, after the motors were stopped directly
+
+        param speeds: speed of each motor, default all 0
+        '''
+        with self._cond:
+            n = len(self.speeds)
+            self.speeds = [float(s) for s in speeds] if speeds is not None else [0.0] * n
+            self.targets = list(self.speeds)
+            self.rates = [0.0] * n
+            self._written = list(self.speeds)
+
+    def _step(self, i, dt):
+        error = self.targets[i] - self.speeds[i]
+        rate = self.rates[i]
+        if self.jerk is None:
+            new_rate = math.copysign(min(self.accel, abs(error) / dt), error)
+        else:
+            # fastest rate that can still brake to 0 at the target
+            brake = math.sqrt(2 * self.jerk * abs(error))
+            wanted = math.copysign(min(self.accel, brake, abs(error) / dt), error)
+            step = self.jerk * dt
+            new_rate = min(max(wanted, rate - step), rate + step)
+        speed = self.speeds[i] + new_rate * dt
+        # never pass the target, the brake limit makes the rate small by then
+        if (error >= 0 and speed >= self.targets[i]) or (error <= 0 and speed <= self.targets[i]):
+            speed = self.targets[i]
+            new_rate = 0.0
+        self.speeds[i] = speed
+        self.rates[i] = new_rate
+
+    def _idle(self):
+        return self.speeds == self.targets and not any(self.rates)
+
+    def _loop(self):
+        last = time.monotonic()
+        while True:
+            with self._cond:
+                while self._running and self._idle():
+                    self._cond.wait()
+                    last = time.monotonic()
+                if not self._running:
+                    return
+                now = time.monotonic()
+                dt = min(max(now - last, 1e-3), self.tick * 5)
+                last = now
+                for i in range(len(self.speeds)):
+                    self._step(i, dt)
+                    value = round(self.speeds[i])
+                    written = self._written[i]
+                    if value == written:
+                        continue
+                    # duty has 1% steps, write every min_step of them on the way, and the target
+                    if written is not None and abs(value - written) < self.min_step \
+                            and self.speeds[i] != self.targets[i]:
+                        continue
+                    # written under the lock, so no stale write can follow a reset()
+                    self._written[i] = value
+                    self.write(i + 1, value)
+                    self.writes += 1
+            time.sleep(self.tick)
+
+    def state(self):
+        ''' ramp state for telemetry '''
+        return {
+            'targets': list(self.targets),
+            'speeds': [round(s, 1) for s in self.speeds],
+            'rates': [round(r, 1) for r in self.rates],
+            'commands': self.commands,
+            'writes': self.writes,
+        }
@@ -0,0 +1,203 @@
+'''
+Time-to-collision obstacle guard
+
+The ultrasonic sensor gives one noisy distance per ping, with -1/-2 on
+timeouts. CollisionGuard filters the pings into a distance and a closing
+speed (alpha-beta filter, O(1) per ping), derives the time to collision and
+limits the power of Picarx.forward() from it: full power while far or not
+closing in, less as the obstacle gets nearer, none at the stop distance.
+
+    guard = CollisionGuard()
+    px.set_collision_guard(guard)
+    guard.start(px)         # pings from a thread, re-limits a running forward()
+    px.forward(50)          # slows down and stops in front of obstacles
+    print(guard.state())
+'''
+import threading
+import time
+from collections import deque
+
+
+class CollisionGuard(object):
+    '''
+    Distance and closing speed filter with a forward power limit
+
+    A ping far off the prediction is taken as noise, unless the next one
+    agrees with it (a new obstacle showing up).
+    '''
+
+    def __init__(self, stop_distance=15, slow_distance=40, stop_ttc=0.3, slow_ttc=1.5,
+                 max_range=300, alpha=0.5, beta=0.1, gate=30, max_misses=5, history=20):
+        '''
+        param stop_distance: cm, no forward power at or below
+        param slow_distance: cm, full forward power at or above
+        param stop_ttc: seconds to reach stop_distance with no forward power
+        param slow_ttc: seconds to reach stop_distance with full forward power
+        param max_range: cm, longer pings are treated as no obstacle
+        param alpha: distance gain of the filter, 0-1
+        param beta: speed gain of the filter, 0-1
+        param gate: cm, pings further than this from the prediction are checked by the next one
+        param max_misses: failed pings in a row before the estimate is dropped
+        param history: (time, distance) pings kept for telemetry
+        '''
+        self.stop_distance = stop_distance
+        self.slow_distance = slow_distance
+        self.stop_ttc = stop_ttc
+        self.slow_ttc = slow_ttc
+        self.max_range = max_range
+        self.alpha = alpha
+        self.beta = beta
+        self.gate = gate
+        self.max_misses = max_misses
+        self.history = deque(maxlen=history)
+        self.distance = None    # filtered cm, None when unknown
+        self.speed = 0.0        # cm/s, negative when closing in
+        self.update_time = 0
+        self.misses = 0
+        self.outliers = 0
+        self._pending = None    # ping off the gate, waiting for a second one
+        self._running = False
+        self._thread = None
+
+    def reset(self):
+        self.distance = None
+        self.speed = 0.0
+        self.misses = 0
+        self._pending = None
+        self.history.clear()
+
+    def update(self, distance, t=None):
+        '''
+        Add one ping
+
+        param distance: cm from the ultrasonic, negative on a timeout
+        param t: monotonic time of the ping, default now
+        return: filtered distance, None when unknown
+        '''
+        if t is None:
+            t = time.monotonic()
+        if distance < 0:
+            self.misses += 1
+            if self.misses >= self.max_misses:
+                self.distance = None
+                self.speed = 0.0
+            return self.distance
+        self.misses = 0
+        distance = min(distance, self.max_range)
+        self.history.append((t, distance))
+
+        if self.distance is None:
+            self.distance = distance
+            self.speed = 0.0
+            self.update_time = t
+            return self.distance
+
+        dt = t - self.update_time
+        if dt <= 0:
+            return self.distance
+        predicted = self.distance + self.speed * dt
+        residual = distance - predicted
+        if abs(residual) > self.gate:
+            pending = self._pending
+            self._pending = distance
+            if pending is None or abs(distance - pending) > self.gate:
+                self.outliers += 1
+                return self.distance
+            # two pings agree, restart from them
+            self._pending = None
+            self.distance = distance
+            self.speed = 0.0
+            self.update_time = t
+            return self.distance
+        self._pending = None
+        self.distance = predicted + self.alpha * residual
+        self.speed = self.speed + self.beta * residual / dt
+        self.update_time = t
+        return self.distance
+
+    def predict(self, t=None):
+        ''' filtered distance at time t, None when unknown '''
+        if self.distance is None:
+            return None
+        if t is None:
+            t = time.monotonic()
+        return max(self.distance + self.speed * max(t - self.update_time, 0), 0.0)
+
+    def ttc(self, t=None):
+        '''
+        Time to reach stop_distance at the current closing speed
+
+        return: seconds, 0 when already there, None when not closing in
+        '''
+        distance = self.predict(t)
+        if distance is None:
+            return None
+        gap = distance - self.stop_distance
+        if gap <= 0:
+            return 0.0
+        if self.speed >= 0:
+            return None
+        return gap / -self.speed
+
+    def power_scale(self, t=None):
+        ''' 0-1 factor of the forward power allowed now '''
+        distance = self.predict(t)
+        if distance is None:
+            return 1.0
+        if distance <= self.stop_distance:
+            return 0.0
+        scale = min((distance - self.stop_distance) / (self.slow_distance - self.stop_distance), 1.0)
+        ttc = self.ttc(t)
+        if ttc is not None:
+            scale = min(scale, max(min((ttc - self.stop_ttc) / (self.slow_ttc - self.stop_ttc), 1.0), 0.0))
+        return scale
+
+    def limit(self, power):
+        ''' forward power allowed for the requested power '''
+        return power * self.power_scale()
+
+    def start(self, px, rate=20):
+        '''
+        Ping from a thread and re-limit the running forward() after each ping
+
+        param px: Picarx, with this guard set by set_collision_guard()
+        param rate: pings per second
+        '''
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(name="collision_guard", target=self._loop, args=(px, rate), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self, px, rate):
+        period = 1.0 / rate
+        while self._running:
+            st = time.monotonic()
+            try:
+                # a single try, a timeout is a miss for the filter, not a retry
+                self.update(px.ultrasonic.read(times=1))
+                px.update_forward_limit()
+            except Exception as e:
+                print(f"collision guard error: {e}")
+            delay = period - (time.monotonic() - st)
+            if delay > 0:
+                time.sleep(delay)
+
+    def state(self):
+        ''' estimate for telemetry '''
+        ttc = self.ttc()
+        return {
+            'distance': None if self.distance is None else round(self.distance, 1),
+            'speed': round(self.speed, 1),
+            'ttc': None if ttc is None else round(ttc, 2),
+            'power_scale': round(self.power_scale(), 2),
+            'misses': self.misses,
+            'outliers': self.outliers,
+            'history': list(self.history),
+        }
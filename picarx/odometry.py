@@ -0,0 +1,302 @@
+'''
+Dead reckoning odometry
+
+The Picar-X has no wheel encoders, so the pose is integrated from what the
+motors are told to do: the commanded speed of each rear wheel goes through a
+calibrated motor model to m/s, the steering angle through the Ackermann
+model to a curvature (or a gyro gives the yaw rate), and a fixed rate
+thread integrates x, y, heading with an EKF style covariance that grows with
+the distance travelled.
+
+The pose is in meters and radians, x ahead of the start pose, heading
+positive towards motor 1 (the direction positive steering turns).
+
+    odom = Odometry(px)
+    odom.start()
+    drive(px, odom, 0.3, speed=35)        # 30 cm, then stop
+    turn(px, odom, 90, speed=35)          # heading +90 degrees
+    print(odom.pose, odom.covariance)
+
+The ADXL345 on the robot hat is an accelerometer, it can't see a rotation
+about the vertical axis. Pass yaw_rate=callable() -> rad/s of a gyro
+module to use a measured yaw rate instead of the steering model.
+'''
+import math
+import threading
+import time
+
+import numpy as np
+
+# also importable next to picarx_improved.py when that runs as a script
+try:
+    from .ackermann import default_table
+except ImportError:
+    from ackermann import default_table
+
+
+class MotorModel(object):
+    '''
+    Commanded motor speed (-100 to 100) to wheel speed in m/s
+
+    Piecewise linear through calibration points of (command, m/s), symmetric
+    for negative commands, so the dead band and the saturation of the
+    motors are kept. Calibrate by driving straight for a while at a few
+    commands and measuring the distance, see from_runs().
+    '''
+
+    def __init__(self, points=((0, 0.0), (10, 0.0), (100, 0.30))):
+        '''
+        param points: ((command, m/s), ...), increasing commands from 0
+        '''
+        points = sorted(points)
+        self.commands = np.array([p[0] for p in points], dtype=np.float64)
+        self.speeds = np.array([p[1] for p in points], dtype=np.float64)
+
+    @classmethod
+    def from_runs(cls, runs, dead_band=10):
+        '''
+        param runs: ((command, distance m, seconds), ...) measured straight runs
+        param dead_band: command below which the wheels don't turn
+        '''
+        points = [(0, 0.0), (dead_band, 0.0)]
+        points += [(command, distance / seconds) for command, distance, seconds in runs]
+        return cls(points)
+
+    def speed(self, command):
+        '''
+        param command: commanded speed, scalar or array
+        return: m/s, same shape
+        '''
+        command = np.asarray(command, dtype=np.float64)
+        result = np.sign(command) * np.interp(np.abs(command), self.commands, self.speeds)
+        return result.item() if result.ndim == 0 else result
+
+
+def integrate(pose, wheel_speeds, curvatures, dt, yaw_rates=None):
+    '''
+    Integrate a batch of steps at once, for replaying logs and simulation
+
+    param pose: (x, y, heading) start pose
+    param wheel_speeds: N x 2 m/s of the two rear wheels, forward > 0
+    param curvatures: N, 1/m of the rear axle center
+    param dt: seconds per step, scalar or N
+    param yaw_rates: N rad/s measured, instead of the curvature
+    return: N x 3 poses after each step
+    '''
+    wheel_speeds = np.asarray(wheel_speeds, dtype=np.float64)
+    dt = np.broadcast_to(np.asarray(dt, dtype=np.float64), wheel_speeds.shape[:1])
+    v = wheel_speeds.mean(axis=1)
+    if yaw_rates is None:
+        omega = v * np.asarray(curvatures, dtype=np.float64)
+    else:
+        omega = np.asarray(yaw_rates, dtype=np.float64)
+    heading = pose[2] + np.cumsum(omega * dt)
+    # midpoint heading of each step
+    mid = heading - omega * dt / 2
+    x = pose[0] + np.cumsum(v * np.cos(mid) * dt)
+    y = pose[1] + np.cumsum(v * np.sin(mid) * dt)
+    return np.stack([x, y, heading], axis=1)
+
+
+class Odometry(object):
+    '''
+    Pose and covariance of a Picarx from its motor commands
+
+    Reads px.motor_speeds (the speeds last written to the motors, after
+    any ramp) and px.dir_current_angle every tick.
+    '''
+
+    def __init__(self, px, motor_model=None, ackermann=None, yaw_rate=None,
+                 speed_noise=0.1, yaw_noise=0.3, gyro_noise=0.02):
+        '''
+        param px: Picarx
+        param motor_model: MotorModel, default an uncalibrated one
+        param ackermann: AckermannTable, default the stock dimensions
+        param yaw_rate: callable() -> rad/s of a gyro, None to use the steering
+        param speed_noise: speed error, fraction of the speed
+        param yaw_noise: yaw error of the steering model, rad per m travelled
+        param gyro_noise: yaw rate error of the gyro, rad/s
+        '''
+        self.px = px
+        self.motor_model = motor_model or MotorModel()
+        self.ackermann = ackermann or default_table()
+        self.yaw_rate = yaw_rate
+        self.speed_noise = speed_noise
+        self.yaw_noise = yaw_noise
+        self.gyro_noise = gyro_noise
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        self.reset()
+
+    def reset(self, pose=(0.0, 0.0, 0.0)):
+        ''' set the pose, and forget its uncertainty '''
+        with self._lock:
+            self.pose = np.array(pose, dtype=np.float64)
+            self.covariance = np.zeros((3, 3))
+            self.distance = 0.0   # path length, m
+            self.speed = 0.0      # m/s of the rear axle center
+            self.last_time = time.monotonic()
+
+    def wheel_speeds(self):
+        ''' m/s of motor 1 and motor 2, forward > 0 '''
+        s1, s2 = self.px.motor_speeds
+        # motor 2 is mounted mirrored, forward() gives it negative speeds
+        return self.motor_model.speed(s1), self.motor_model.speed(-s2)
+
+    def update(self, dt=None):
+        '''
+        Integrate one step
+
+        param dt: seconds since the last update, default measured
+        return: pose, [x, y, heading]
+        '''
+        now = time.monotonic()
+        v1, v2 = self.wheel_speeds()
+        v = (v1 + v2) / 2
+        if self.yaw_rate is not None:
+            omega = self.yaw_rate()
+            yaw_var = self.gyro_noise ** 2
+        else:
+            omega = v * self.ackermann.curvature(self.px.dir_current_angle)
+            yaw_var = (self.yaw_noise * v) ** 2
+        with self._lock:
+            if dt is None:
+                dt = now - self.last_time
+            self.last_time = now
+            x, y, heading = self.pose
+            mid = heading + omega * dt / 2
+            c, s = math.cos(mid), math.sin(mid)
+            self.pose = np.array([x + v * c * dt, y + v * s * dt, heading + omega * dt])
+            # P = F P F' + G Q G'
+            F = np.array([[1.0, 0.0, -v * s * dt],
+                          [0.0, 1.0, v * c * dt],
+                          [0.0, 0.0, 1.0]])
+            G = np.array([[c * dt, 0.0],
+                          [s * dt, 0.0],
+                          [0.0, dt]])
+            Q = np.diag([(self.speed_noise * v) ** 2, yaw_var])
+            self.covariance = F @ self.covariance @ F.T + G @ Q @ G.T
+            self.distance += abs(v) * dt
+            self.speed = v
+            return self.pose.copy()
+
+    def start(self, rate=50):
+        '''
+        Integrate from a thread
+
+        param rate: updates per second
+        '''
+        if self._thread is not None:
+            return
+        self.last_time = time.monotonic()
+        self._running = True
+        self._thread = threading.Thread(name="odometry", target=self._loop, args=(rate,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self, rate):
+        period = 1.0 / rate
+        next_time = time.monotonic()
+        while self._running:
+            try:
+                self.update()
+            except Exception as e:
+                print(f"odometry error: {e}")
+            next_time += period
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.monotonic()
+
+    @property
+    def heading(self):
+        return self.pose[2]
+
+    def state(self):
+        ''' pose and 1 sigma uncertainties for telemetry, m and degrees '''
+        with self._lock:
+            pose = self.pose.tolist()
+            sigma = np.sqrt(np.maximum(np.diag(self.covariance), 0)).tolist()
+            return {
+                'x': round(pose[0], 3),
+                'y': round(pose[1], 3),
+                'heading': round(math.degrees(pose[2]), 1),
+                'sigma_x': round(sigma[0], 3),
+                'sigma_y': round(sigma[1], 3),
+                'sigma_heading': round(math.degrees(sigma[2]), 1),
+                'distance': round(self.distance, 3),
+                'speed': round(self.speed, 3),
+            }
+
+
+# Closed loop maneuvers
+# =================================================================
+def _wait(px, odometry, done, timeout, period):
+    '''
+    poll until done() or timeout, then stop
+
+    return: True if done
+    '''
+    st = time.monotonic()
+    try:
+        while not done():
+            if timeout is not None and time.monotonic() - st > timeout:
+                return False
+            if odometry._thread is None:
+                odometry.update()
+            time.sleep(period)
+        return True
+    finally:
+        px.stop()
+
+def drive(px, odometry, distance, speed=35, angle=0, timeout=10, period=0.01):
+    '''
+    Drive a distance along the path
+
+    param distance: m, negative to back up
+    param speed: motor speed 0-100
+    param angle: steering angle during the move
+    param timeout: seconds, None for no limit
+    return: True if the distance was reached
+    '''
+    px.set_dir_servo_angle(angle)
+    start = odometry.distance
+    if distance >= 0:
+        px.forward(speed)
+    else:
+        px.backward(speed)
+    return _wait(px, odometry, lambda: odometry.distance - start >= abs(distance), timeout, period)
+
+def turn(px, odometry, degrees, speed=35, backward=False, angle=None, timeout=10, period=0.01):
+    '''
+    Turn the heading by an angle, driving on the tightest arc
+
+    param degrees: heading change, > 0 towards motor 1
+    param speed: motor speed 0-100
+    param backward: reverse while turning
+    param angle: steering angle, default the max towards the turn
+    param timeout: seconds, None for no limit
+    return: True if the heading was reached
+    '''
+    # reversing turns the other way for the same steering
+    direction = (1 if degrees >= 0 else -1) * (-1 if backward else 1)
+    if angle is None:
+        angle = direction * px.DIR_MAX
+    px.set_dir_servo_angle(angle)
+    target = odometry.heading + math.radians(degrees)
+    if backward:
+        px.backward(speed)
+    else:
+        px.forward(speed)
+    if degrees >= 0:
+        done = lambda: odometry.heading >= target
+    else:
+        done = lambda: odometry.heading <= target
+    return _wait(px, odometry, done, timeout, period)
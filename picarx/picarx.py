@@ -1,7 +1,9 @@
 from robot_hat import Pin, ADC, PWM, Servo, fileDB
 from robot_hat import Grayscale_Module, Ultrasonic, utils
+from .ackermann import default_table
 import time
 import os
+import threading
 
 
 def constrain(x, min_val, max_val):
@@ -72,6 +74,20 @@ class Picarx(object):
         self.cali_dir_value = [int(i.strip()) for i in self.cali_dir_value.strip().strip("[]").split(",")]
         self.cali_speed_value = [0, 0]
         self.dir_current_angle = 0
+        # wheel speed ratios of the steering angles
+        self.ackermann = default_table()
+        # motor writes are serialized, halt_motors() latches them off
+        self._motor_lock = threading.Lock()
+        self.motors_halted = False
+        # speeds last written to the motors, for odometry
+        self.motor_speeds = [0, 0]
+        # forward() power limiter, see set_collision_guard()
+        self._drive_lock = threading.RLock()
+        self.collision_guard = None
+        self.forward_speed = 0 # last speed asked to forward(), 0 when not going forward
+        self._forward_applied = 0
+        # optional acceleration limiter, see set_motor_ramp()
+        self.motor_ramp = None
         # init pwm
         for pin in self.motor_speed_pins:
             pin.period(self.PERIOD)
@@ -80,6 +96,9 @@ class Picarx(object):
         # --------- grayscale module init ---------
         adc0, adc1, adc2 = [ADC(pin) for pin in grayscale_pins]
         self.grayscale = Grayscale_Module(adc0, adc1, adc2, reference=None)
+        # an ADC read is a register write then a read, keep the three channels of
+        # a thread together, e.g. a CliffMonitor and the app's line following
+        self._grayscale_lock = threading.Lock()
         # get reference
         self.line_reference = self.config_flie.get("line_reference", default_value=str(self.DEFAULT_LINE_REF))
         self.line_reference = [float(i) for i in self.line_reference.strip().strip('[]').split(',')]
@@ -87,6 +106,8 @@ class Picarx(object):
         self.cliff_reference = [float(i) for i in self.cliff_reference.strip().strip('[]').split(',')]
         # transfer reference
         self.grayscale.reference(self.line_reference)
+        # optional online threshold tracking, see set_adaptive_grayscale()
+        self.grayscale_normalizer = None
 
         # --------- ultrasonic init ---------
         trig, echo= ultrasonic_pins
@@ -100,23 +121,85 @@ class Picarx(object):
         param speed: speed
         type speed: int      
         '''
+        if self.motors_halted:
+            return
         speed = constrain(speed, -100, 100)
+        if self.motor_ramp is not None:
+            self.motor_ramp.set_target(motor, self._duty(speed))
+        else:
+            self._write_motor_duty(motor, self._duty(speed), speed)
+
+    @staticmethod
+    def _duty(speed):
+        ''' motor speed -100 to 100 to the signed PWM duty, nonzero speeds start at 50% '''
+        if speed == 0:
+            return 0
+        duty = int(abs(speed) /2 ) + 50
+        return duty if speed > 0 else -duty
+
+    def _write_motor_duty(self, motor, duty, command=None):
+        '''
+        param motor: 1 or 2
+        param duty: signed PWM duty, -100 to 100, see _duty()
+        param command: speed recorded in motor_speeds, default the speed of the duty
+        '''
+        if command is None:
+            # below 50% is the ramp passing through the dead band
+            command = 0 if abs(duty) < 50 else (duty - 50 if duty > 0 else duty + 50) * 2
         motor -= 1
-        if speed >= 0:
+        if duty >= 0:
             direction = 1 * self.cali_dir_value[motor]
-        elif speed < 0:
+        elif duty < 0:
             direction = -1 * self.cali_dir_value[motor]
-        speed = abs(speed)
+        speed = abs(duty)
         # print(f"direction: {direction}, speed: {speed}")
-        if speed != 0:
-            speed = int(speed /2 ) + 50
         speed = speed - self.cali_speed_value[motor]
-        if direction < 0:
-            self.motor_direction_pins[motor].high()
-            self.motor_speed_pins[motor].pulse_width_percent(speed)
-        else:
-            self.motor_direction_pins[motor].low()
-            self.motor_speed_pins[motor].pulse_width_percent(speed)
+        with self._motor_lock:
+            if self.motors_halted:
+                return
+            self.motor_speeds[motor] = command
+            if direction < 0:
+                self.motor_direction_pins[motor].high()
+                self.motor_speed_pins[motor].pulse_width_percent(speed)
+            else:
+                self.motor_direction_pins[motor].low()
+                self.motor_speed_pins[motor].pulse_width_percent(speed)
+
+    def halt_motors(self):
+        '''
+        Emergency stop: PWMs to 0 at once and drop motor commands until
+        release_motors(), safe to call from any thread
+        '''
+        with self._motor_lock:
+            self.motors_halted = True
+            self.motor_speed_pins[0].pulse_width_percent(0)
+            self.motor_speed_pins[1].pulse_width_percent(0)
+            self.motor_speeds = [0, 0]
+        if self.motor_ramp is not None:
+            self.motor_ramp.reset()
+
+    def release_motors(self):
+        with self._motor_lock:
+            self.motors_halted = False
+
+    def set_motor_ramp(self, enable=True, **kwargs):
+        '''
+        Ramp the motor PWM duty with limited acceleration and jerk instead of
+        jumping to it, stop() and halt_motors() still stop at once
+
+        param enable: False to write speeds directly again
+        param kwargs: accel, jerk, tick, min_step of MotorRamp
+        return: MotorRamp or None
+        '''
+        if self.motor_ramp is not None:
+            self.motor_ramp.stop()
+            self.motor_ramp = None
+        if not enable:
+            return None
+        from .motor_ramp import MotorRamp
+        self.motor_ramp = MotorRamp(self._write_motor_duty, **kwargs)
+        self.motor_ramp.start()
+        return self.motor_ramp
 
     def motor_speed_calibration(self, value):
         self.cali_speed_value = value
@@ -175,46 +258,63 @@ class Picarx(object):
         self.set_motor_speed(2, speed)
 
     def backward(self, speed):
-        current_angle = self.dir_current_angle
-        if current_angle != 0:
-            abs_current_angle = abs(current_angle)
-            if abs_current_angle > self.DIR_MAX:
-                abs_current_angle = self.DIR_MAX
-            power_scale = (100 - abs_current_angle) / 100.0 
-            if (current_angle / abs_current_angle) > 0:
-                self.set_motor_speed(1, -1*speed)
-                self.set_motor_speed(2, speed * power_scale)
-            else:
-                self.set_motor_speed(1, -1*speed * power_scale)
-                self.set_motor_speed(2, speed )
-        else:
-            self.set_motor_speed(1, -1*speed)
-            self.set_motor_speed(2, speed)  
+        with self._drive_lock:
+            self.forward_speed = 0
+            self._backward(speed)
+
+    def _backward(self, speed):
+        ratio1, ratio2 = self.ackermann.ratios(self.dir_current_angle)
+        self.set_motor_speed(1, -1*speed * ratio1)
+        self.set_motor_speed(2, speed * ratio2)
 
     def forward(self, speed):
-        current_angle = self.dir_current_angle
-        if current_angle != 0:
-            abs_current_angle = abs(current_angle)
-            if abs_current_angle > self.DIR_MAX:
-                abs_current_angle = self.DIR_MAX
-            power_scale = (100 - abs_current_angle) / 100.0
-            if (current_angle / abs_current_angle) > 0:
-                self.set_motor_speed(1, 1*speed * power_scale)
-                self.set_motor_speed(2, -speed) 
-            else:
-                self.set_motor_speed(1, speed)
-                self.set_motor_speed(2, -1*speed * power_scale)
-        else:
-            self.set_motor_speed(1, speed)
-            self.set_motor_speed(2, -1*speed)                  
+        with self._drive_lock:
+            self.forward_speed = speed
+            if self.collision_guard is not None and speed > 0:
+                speed = round(self.collision_guard.limit(speed), 1)
+            self._forward_applied = speed
+            self._forward(speed)
+
+    def update_forward_limit(self):
+        '''
+        Apply the running forward() again with the power the collision guard
+        allows now, called by the guard after each ping
+        '''
+        with self._drive_lock:
+            if self.forward_speed <= 0 or self.collision_guard is None:
+                return
+            speed = round(self.collision_guard.limit(self.forward_speed), 1)
+            if speed != self._forward_applied:
+                self._forward_applied = speed
+                self._forward(speed)
+
+    def set_collision_guard(self, guard):
+        '''
+        Limit forward() power by a CollisionGuard, None to remove it
+
+        param guard: picarx.obstacle_guard.CollisionGuard
+        '''
+        with self._drive_lock:
+            self.collision_guard = guard
+
+    def _forward(self, speed):
+        ratio1, ratio2 = self.ackermann.ratios(self.dir_current_angle)
+        self.set_motor_speed(1, speed * ratio1)
+        self.set_motor_speed(2, -1*speed * ratio2)
 
     def stop(self):
         '''
         Execute twice to make sure it stops
         '''
+        with self._drive_lock:
+            self.forward_speed = 0
+        if self.motor_ramp is not None:
+            self.motor_ramp.reset()
         for _ in range(2):
-            self.motor_speed_pins[0].pulse_width_percent(0)
-            self.motor_speed_pins[1].pulse_width_percent(0)
+            with self._motor_lock:
+                self.motor_speed_pins[0].pulse_width_percent(0)
+                self.motor_speed_pins[1].pulse_width_percent(0)
+                self.motor_speeds = [0, 0]
             time.sleep(0.002)
 
     def get_distance(self):
@@ -229,11 +329,33 @@ class Picarx(object):
             raise ValueError("grayscale reference must be a 1*3 list")
 
     def get_grayscale_data(self):
-        return list.copy(self.grayscale.read())
+        with self._grayscale_lock:
+            return list.copy(self.grayscale.read())
 
     def get_line_status(self,gm_val_list):
+        if self.grayscale_normalizer is not None:
+            status = self.grayscale_normalizer.update(gm_val_list)
+            self.grayscale.reference(self.grayscale_normalizer.reference)
+            return status
         return self.grayscale.read_status(gm_val_list)
 
+    def set_adaptive_grayscale(self, enable=True, **kwargs):
+        '''
+        Track the lighting and adapt the line reference on every get_line_status()
+
+        param enable: False to go back to the fixed line_reference
+        param kwargs: options of AdaptiveGrayscale, starts from line_reference
+        return: AdaptiveGrayscale or None, its state() is the telemetry
+        '''
+        if not enable:
+            self.grayscale_normalizer = None
+            self.grayscale.reference(self.line_reference)
+            return None
+        from .grayscale_normalization import AdaptiveGrayscale
+        kwargs.setdefault('exclude', self.cliff_reference)
+        self.grayscale_normalizer = AdaptiveGrayscale(self.line_reference, **kwargs)
+        return self.grayscale_normalizer
+
     def set_line_reference(self, value):
         self.set_grayscale_reference(value)
 
@@ -250,6 +372,26 @@ class Picarx(object):
         else:
             raise ValueError("grayscale reference must be a 1*3 list")
 
+    def set_grayscale_references(self, line_reference, cliff_reference):
+        '''
+        Set line and cliff references, saved with one config write
+
+        param line_reference: [L, C, R]
+        param cliff_reference: [L, C, R]
+        '''
+        for value in (line_reference, cliff_reference):
+            if not (isinstance(value, list) and len(value) == 3):
+                raise ValueError("grayscale reference must be a 1*3 list")
+        self.line_reference = line_reference
+        self.cliff_reference = cliff_reference
+        self.grayscale.reference(self.line_reference)
+        values = {"line_reference": self.line_reference, "cliff_reference": self.cliff_reference}
+        if hasattr(self.config_flie, "set_many"):
+            self.config_flie.set_many(values)
+        else:
+            for name, value in values.items():
+                self.config_flie.set(name, value)
+
     def reset(self):
         self.stop()
         self.set_dir_servo_angle(0)
@@ -3,7 +3,6 @@ import sys
 import time
 import logging
 import atexit
-import math
 
 from logdecorator import log_on_start, log_on_end, log_on_error
 
@@ -22,6 +21,15 @@ except ImportError:
     from sim_robot_hat import Pin, ADC, PWM, Servo, fileDB
     from sim_robot_hat import Grayscale_Module, Ultrasonic, utils
 
+# the steering model has no hardware dependencies, import it as a package
+# module or next to this file when run as a script
+try:
+    from .ackermann import default_table
+    from .odometry import Odometry, drive, turn
+except ImportError:
+    from ackermann import default_table
+    from odometry import Odometry, drive, turn
+
 #Initialize logging
 logging_format = "%(asctime)s: %(message)s"
 logging.basicConfig(format=logging_format, level=logging.INFO,
@@ -108,6 +116,12 @@ class Picarx(object):
         self.cali_dir_value = [int(i.strip()) for i in self.cali_dir_value.strip().strip("[]").split(",")]
         self.cali_speed_value = [0, 0]
         self.dir_current_angle = 0
+        # wheel speed ratios of the steering angles
+        self.ackermann = default_table()
+        # speeds last written to the motors, for odometry
+        self.motor_speeds = [0, 0]
+        # dead reckoning pose, closes the loop of the maneuvers
+        self.odometry = Odometry(self)
         # init pwm
         for pin in self.motor_speed_pins:
             pin.period(self.PERIOD)
@@ -147,6 +161,7 @@ class Picarx(object):
         speed = constrain(speed, -100, 100)
         #motor 0 - left motor, motor 1 - right motor
         motor -= 1
+        self.motor_speeds[motor] = speed
         motor_name = "LEFT" if motor == 0 else "RIGHT"
         if speed >= 0:
             direction = 1 * self.cali_dir_value[motor]
@@ -297,38 +312,31 @@ class Picarx(object):
     @log_on_error(logging.DEBUG, "Error during 3-point turn")
     @log_on_end(logging.DEBUG, "3-point turn completed")
 
-    def three_point_turn(self, speed=35, turn_time=3.5, settle_time=0.5):
+    def three_point_turn(self, speed=35, first_turn=75, back_turn=60, settle_time=0.5, timeout=10):
         """
-        Perform a 3-point (K) turn.
+        Perform a 3-point (K) turn, closed loop on the odometry heading.
+
+        first_turn and back_turn are the heading changes (degrees) of the
+        first two legs, the last leg turns the rest of the 180.
         """
+        self.odometry.start()
         self.set_dir_servo_angle(0)
         time.sleep(1)
-        
+
         logging.debug("3PT | Step 1: Forward with left steering")
-        self.set_dir_servo_angle(30)
-        self.forward(speed)
-        time.sleep(turn_time)
-        self.stop()
+        turn(self, self.odometry, first_turn, speed, timeout=timeout)
         time.sleep(settle_time)
 
         logging.debug("3PT | Step 2: Backward with right steering")
-        self.set_dir_servo_angle(-30)
-        self.backward(speed)
-        time.sleep(turn_time)
-        self.stop()
+        turn(self, self.odometry, back_turn, speed, backward=True, timeout=timeout)
         time.sleep(settle_time)
 
         logging.debug("3PT | Step 3: Straighten out")
-        self.set_dir_servo_angle(5)
-        self.forward(speed)
-        time.sleep(turn_time * 0.75)
-        self.stop()
-        
-        logging.debug("4PT | Step 4: Go Straight")
-        self.set_dir_servo_angle(0)
-        self.forward(speed)
-        time.sleep(turn_time * 0.75)
-        self.stop()
+        turn(self, self.odometry, 180 - first_turn - back_turn, speed, timeout=timeout)
+
+        logging.debug("3PT | Step 4: Go Straight")
+        drive(self, self.odometry, 0.1, speed, timeout=timeout)
+        logging.debug(f"3PT | Done | {self.odometry.state()}")
 
     @log_on_start(logging.DEBUG, "Parallel parking started")
     @log_on_error(logging.DEBUG, "Error during parallel parking")
@@ -337,33 +345,28 @@ class Picarx(object):
     def parallel_park(
         self,
         speed=35,
-        forward_time=2.0,
-        reverse_time=2.0,
-        settle_time=0.5
+        forward_distance=0.25,
+        reverse_turn=35,
+        steer_angle=20,
+        settle_time=0.5,
+        timeout=10
     ):
         """
-        Perform a simple parallel parking maneuver.
+        Perform a simple parallel parking maneuver, closed loop on the
+        odometry distance (m) and heading (degrees).
         """
+        self.odometry.start()
 
         logging.debug("PARALLEL PARK | Step 1: Pull forward")
-        self.set_dir_servo_angle(0)
-        self.forward(speed)
-        time.sleep(forward_time)
-        self.stop()
+        drive(self, self.odometry, forward_distance, speed, timeout=timeout)
         time.sleep(settle_time)
 
         logging.debug("PARALLEL PARK | Step 2: Reverse right")
-        self.set_dir_servo_angle(-20)
-        self.backward(speed)
-        time.sleep(reverse_time)
-        self.stop()
+        turn(self, self.odometry, reverse_turn, speed, backward=True, angle=-steer_angle, timeout=timeout)
         time.sleep(settle_time)
 
         logging.debug("PARALLEL PARK | Step 3: Reverse left")
-        self.set_dir_servo_angle(20)
-        self.backward(speed)
-        time.sleep(reverse_time)
-        self.stop()
+        turn(self, self.odometry, -reverse_turn, speed, backward=True, angle=steer_angle, timeout=timeout)
         time.sleep(settle_time)
 
         logging.debug("PARALLEL PARK | Step 4: Final adjust")
@@ -371,38 +374,19 @@ class Picarx(object):
         self.backward(speed * 0.5)
         time.sleep(0.5)
         self.stop()
+        logging.debug(f"PARALLEL PARK | Done | {self.odometry.state()}")
 
                 
         
     
 
-    #Write function to use cos scaling instead of linear
-    def ackerman_scaling(self,steering_angle_deg):
-        steering_angle_deg = constrain(steering_angle_deg, self.DIR_MIN, self.DIR_MAX)
-        steering_angle_rad = math.radians(abs(steering_angle_deg))
-        ackerman_scale = math.cos(steering_angle_rad)
-
-        return ackerman_scale
-
     def backward(self, speed):
         logging.debug(f"BACKWARD | speed={speed} | steering={self.dir_current_angle} deg")
-        current_angle = self.dir_current_angle
-        if current_angle != 0:
-            abs_current_angle = abs(current_angle)
-            if abs_current_angle > self.DIR_MAX:
-                abs_current_angle = self.DIR_MAX
-            #power_scale = (100 - abs_current_angle) / 100.0 
-            power_scale = self.ackerman_scaling(abs_current_angle)
-            logging.debug(f"FORWARD TURN | scale={power_scale:.3f} | "f"{'LEFT' if current_angle > 0 else 'RIGHT'} wheel slowed")
-            if (current_angle / abs_current_angle) > 0:
-                self.set_motor_speed(1, -1*speed)
-                self.set_motor_speed(2, speed * power_scale)
-            else:
-                self.set_motor_speed(1, -1*speed * power_scale)
-                self.set_motor_speed(2, speed )
-        else:
-            self.set_motor_speed(1, -1*speed)
-            self.set_motor_speed(2, speed)  
+        # both wheel ratios in one lookup of the precomputed ackermann table
+        ratio1, ratio2 = self.ackermann.ratios(self.dir_current_angle)
+        logging.debug(f"BACKWARD TURN | ratios={ratio1:.3f}, {ratio2:.3f}")
+        self.set_motor_speed(1, -1*speed * ratio1)
+        self.set_motor_speed(2, speed * ratio2)
 
     @log_on_start(logging.DEBUG, "Forward fxn started")
     @log_on_error(logging.DEBUG, "Error encountered in forward fxn")
@@ -410,24 +394,10 @@ class Picarx(object):
 
     def forward(self, speed):
         logging.debug(f"FORWARD | speed={speed} | steering={self.dir_current_angle} deg")
-        current_angle = self.dir_current_angle
-        if current_angle != 0:
-            abs_current_angle = abs(current_angle)
-            if abs_current_angle > self.DIR_MAX:
-                abs_current_angle = self.DIR_MAX
-            #power_scale = (100 - abs_current_angle) / 100.0
-            power_scale = self.ackerman_scaling(abs_current_angle)
-            logging.debug(f"FORWARD TURN | scale={power_scale:.3f} | "f"{'LEFT' if current_angle > 0 else 'RIGHT'} wheel slowed")
-            if (current_angle / abs_current_angle) > 0:
-                self.set_motor_speed(1, 1*speed * power_scale)
-                self.set_motor_speed(2, -speed) 
-            else:
-                self.set_motor_speed(1, speed)
-                self.set_motor_speed(2, -1*speed * power_scale)
-        else:
-            self.set_motor_speed(1, speed)
-            self.set_motor_speed(2, -1*speed)    
-              
+        ratio1, ratio2 = self.ackermann.ratios(self.dir_current_angle)
+        logging.debug(f"FORWARD TURN | ratios={ratio1:.3f}, {ratio2:.3f}")
+        self.set_motor_speed(1, speed * ratio1)
+        self.set_motor_speed(2, -1*speed * ratio2)
 
     @log_on_start(logging.DEBUG, "Stopping fxn started")
     @log_on_error(logging.DEBUG, "Error encountered in stopping fxn")
@@ -438,6 +408,7 @@ class Picarx(object):
         Execute twice to make sure it stops
         '''
         logging.debug("STOP | All motors set to PWM=0")
+        self.motor_speeds = [0, 0]
         for _ in range(2):
             self.motor_speed_pins[0].pulse_width_percent(0)
             self.motor_speed_pins[1].pulse_width_percent(0)
@@ -523,6 +494,7 @@ class Picarx(object):
 
     def close(self):
         self.reset()
+        self.odometry.stop()
         self.ultrasonic.close()
 
     
@@ -1,219 +1,170 @@
 
-from time import sleep
 import time
 from .picarx import Picarx
+from .timeline import RESET, compile_steps, player_for
 from robot_hat.music import Music
 import threading
-import queue
-import random
+from collections import deque
+from concurrent.futures import CancelledError, Future
 from enum import StrEnum
 
+# timelines
+# =================================================================
+# each action is a list of (values, hold) steps: set the channels, then hold
+# for that many seconds. They are compiled once and played by the car's
+# shared TimelinePlayer, which can be cancelled at any step by stop_actions().
+
+def _swing(a, b, hold, times):
+    return [(a, hold), (b, hold)] * times
+
+_think_up = [({'pan': i*3, 'tilt': -i*2, 'dir': i*2}, .05) for i in range(11)]
+
+TIMELINES = {name: compile_steps(*items, name=name) for name, items in {
+    "forward": [({'speed': 5}, 1), ({'speed': 0}, 0)],
+    "backward": [({'speed': -5}, 1), ({'speed': 0}, 0)],
+    "turn left": [({'dir': -30, 'speed': 5}, 1), ({'speed': 0, 'dir': 0}, 0)],
+    "turn right": [({'dir': 30, 'speed': 5}, 1), ({'speed': 0, 'dir': 0}, 0)],
+    "wave hands": [
+        (RESET, 0), ({'tilt': 20}, 0),
+        *_swing({'dir': -25}, {'dir': 25}, .1, 2),
+        ({'dir': 0}, 0),
+    ],
+    "resist": [
+        (RESET, 0), ({'tilt': 10}, 0),
+        *_swing({'dir': -15, 'pan': 15}, {'dir': 15, 'pan': -15}, .1, 3),
+        ({'speed': 0, 'dir': 0, 'pan': 0}, 0),
+    ],
+    "act cute": [
+        (RESET, 0), ({'tilt': -20}, 0),
+        *_swing({'speed': 5}, {'speed': -5}, .02, 15),
+        ({'tilt': 0, 'speed': 0}, 0),
+    ],
+    "rub hands": [
+        (RESET, 0),
+        *_swing({'dir': -6}, {'dir': 6}, .5, 5),
+        (RESET, 0),
+    ],
+    "think": [
+        (RESET, 0), *_think_up[:-1], (_think_up[-1][0], .05 + 1),
+        ({'pan': 15, 'tilt': -10, 'dir': 10}, .1),
+        (RESET, 0),
+    ],
+    "keep think": [(RESET, 0), *_think_up],
+    "shake head": [
+        ({'speed': 0, 'pan': 60}, .2),
+        ({'pan': -50}, .1), ({'pan': 40}, .1), ({'pan': -30}, .1), ({'pan': 20}, .1),
+        ({'pan': -10}, .1), ({'pan': 10}, .1), ({'pan': -5}, .1),
+        ({'pan': 0}, 0),
+    ],
+    "nod": [
+        (RESET, 0),
+        *_swing({'tilt': 5}, {'tilt': -30}, .1, 2),
+        ({'tilt': 0}, 0),
+    ],
+    "depressed": [
+        (RESET, 0), ({'tilt': 20}, .22),
+        ({'tilt': -22}, .1), ({'tilt': 10}, .1), ({'tilt': -22}, .1), ({'tilt': 0}, .1),
+        ({'tilt': -22}, .1), ({'tilt': -10}, .1), ({'tilt': -22}, .1), ({'tilt': -15}, .1),
+        ({'tilt': -22}, .1), ({'tilt': -19}, .1), ({'tilt': -22}, .1 + 1.5),
+        (RESET, 0),
+    ],
+    "twist body": [
+        (RESET, 0),
+        *[
+            ({'motor1': 20, 'motor2': 20, 'pan': -20, 'dir': -10}, .1),
+            ({'motor1': 0, 'motor2': 0, 'pan': 0, 'dir': 0}, .1),
+            ({'motor1': -20, 'motor2': -20, 'pan': 20, 'dir': 10}, .1),
+            ({'motor1': 0, 'motor2': 0, 'pan': 0, 'dir': 0}, .1),
+        ] * 3,
+    ],
+    "celebrate": [
+        (RESET, 0), ({'tilt': 20}, 0),
+        ({'dir': 30, 'pan': 60}, .3), ({'dir': 10, 'pan': 30}, .1),
+        ({'dir': 30, 'pan': 60}, .3), ({'dir': 0, 'pan': 0}, .2),
+        ({'dir': -30, 'pan': -60}, .3), ({'dir': -10, 'pan': -30}, .1),
+        ({'dir': -30, 'pan': -60}, .3), ({'dir': 0, 'pan': 0}, .2),
+    ],
+}.items()}
+
+ACTION_SPEED = 1.0 # time scale of all actions, 2 plays them twice as fast
+
+def play_action(car, name, speed=None, wait=True):
+    '''
+    Play a preset action timeline on the car's shared player
+
+    param name: action name, key of TIMELINES
+    param speed: time scale, None for ACTION_SPEED
+    param wait: block until done or cancelled
+    return: Playback
+    '''
+    return player_for(car).play(TIMELINES[name], speed or ACTION_SPEED, wait=wait)
+
+def stop_actions(car):
+    ''' interrupt the action being played and stop the motors, from any thread '''
+    player_for(car).cancel(stop=True)
+
 def forward(car):
-    car.forward(5)
-    sleep(1)
-    car.stop()
+    return play_action(car, "forward")
 
 def backward(car):
-    car.backward(5)
-    sleep(1)
-    car.stop()
+    return play_action(car, "backward")
+
+def turn_left(car):
+    return play_action(car, "turn left")
+
+def turn_right(car):
+    return play_action(car, "turn right")
 
 def wave_hands(car):
-    car.reset()
-    car.set_cam_tilt_angle(20)
-    for _ in range(2):
-        car.set_dir_servo_angle(-25)
-        sleep(.1)
-        # car.set_dir_servo_angle(0)
-        # sleep(.1)
-        car.set_dir_servo_angle(25)
-        sleep(.1)
-    car.set_dir_servo_angle(0)
+    return play_action(car, "wave hands")
 
 def resist(car):
-    car.reset()
-    car.set_cam_tilt_angle(10)
-    for _ in range(3):
-        car.set_dir_servo_angle(-15)
-        car.set_cam_pan_angle(15)
-        sleep(.1)
-        car.set_dir_servo_angle(15)
-        car.set_cam_pan_angle(-15)
-        sleep(.1)
-    car.stop()
-    car.set_dir_servo_angle(0)
-    car.set_cam_pan_angle(0)
+    return play_action(car, "resist")
 
 def act_cute(car):
-    car.reset()
-    car.set_cam_tilt_angle(-20)
-    for i in range(15):
-        car.forward(5)
-        sleep(0.02)
-        car.backward(5)
-        sleep(0.02)
-    car.set_cam_tilt_angle(0)
-    car.stop()
+    return play_action(car, "act cute")
 
 def rub_hands(car):
-    car.reset()
-    for i in range(5):
-        car.set_dir_servo_angle(-6)
-        sleep(.5)
-        car.set_dir_servo_angle(6)
-        sleep(.5)
-    car.reset()
+    return play_action(car, "rub hands")
 
 def think(car):
-    car.reset()
-
-    for i in range(11):
-        car.set_cam_pan_angle(i*3)
-        car.set_cam_tilt_angle(-i*2)
-        car.set_dir_servo_angle(i*2)
-        sleep(.05)
-    sleep(1)
-    car.set_cam_pan_angle(15)
-    car.set_cam_tilt_angle(-10)
-    car.set_dir_servo_angle(10)
-    sleep(.1)
-    car.reset()
+    return play_action(car, "think")
 
 def keep_think(car):
-    car.reset()
-    for i in range(11):
-        car.set_cam_pan_angle(i*3)
-        car.set_cam_tilt_angle(-i*2)
-        car.set_dir_servo_angle(i*2)
-        sleep(.05)
+    return play_action(car, "keep think")
 
 def shake_head(car):
-    car.stop()
-    car.set_cam_pan_angle(0)
-    car.set_cam_pan_angle(60)
-    sleep(.2)
-    car.set_cam_pan_angle(-50)
-    sleep(.1)
-    car.set_cam_pan_angle(40)
-    sleep(.1)
-    car.set_cam_pan_angle(-30)
-    sleep(.1)
-    car.set_cam_pan_angle(20)
-    sleep(.1)
-    car.set_cam_pan_angle(-10)
-    sleep(.1)
-    car.set_cam_pan_angle(10)
-    sleep(.1)
-    car.set_cam_pan_angle(-5)
-    sleep(.1)
-    car.set_cam_pan_angle(0)
+    return play_action(car, "shake head")
 
 def nod(car):
-    car.reset()
-    car.set_cam_tilt_angle(0)
-    car.set_cam_tilt_angle(5)
-    sleep(.1)
-    car.set_cam_tilt_angle(-30)
-    sleep(.1)
-    car.set_cam_tilt_angle(5)
-    sleep(.1)
-    car.set_cam_tilt_angle(-30)
-    sleep(.1)
-    car.set_cam_tilt_angle(0)
-
+    return play_action(car, "nod")
 
 def depressed(car):
-    car.reset()
-    car.set_cam_tilt_angle(0)
-    car.set_cam_tilt_angle(20)
-    sleep(.22)
-    car.set_cam_tilt_angle(-22)
-    sleep(.1)
-    car.set_cam_tilt_angle(10)
-    sleep(.1)
-    car.set_cam_tilt_angle(-22)
-    sleep(.1)
-    car.set_cam_tilt_angle(0)
-    sleep(.1)
-    car.set_cam_tilt_angle(-22)
-    sleep(.1)
-    car.set_cam_tilt_angle(-10)
-    sleep(.1)
-    car.set_cam_tilt_angle(-22)
-    sleep(.1)
-    car.set_cam_tilt_angle(-15)
-    sleep(.1)
-    car.set_cam_tilt_angle(-22)
-    sleep(.1)
-    car.set_cam_tilt_angle(-19)
-    sleep(.1)
-    car.set_cam_tilt_angle(-22)
-    sleep(.1)
-
-    sleep(1.5)
-    car.reset()
+    return play_action(car, "depressed")
 
 def twist_body(car):
-    car.reset()
-    for i in range(3):
-        car.set_motor_speed(1, 20)
-        car.set_motor_speed(2, 20)
-        car.set_cam_pan_angle(-20)
-        car.set_dir_servo_angle(-10)
-        sleep(.1)
-        car.set_motor_speed(1, 0)
-        car.set_motor_speed(2, 0)
-        car.set_cam_pan_angle(0)
-        car.set_dir_servo_angle(0)
-        sleep(.1)
-        car.set_motor_speed(1, -20)
-        car.set_motor_speed(2, -20)
-        car.set_cam_pan_angle(20)
-        car.set_dir_servo_angle(10)
-        sleep(.1)
-        car.set_motor_speed(1, 0)
-        car.set_motor_speed(2, 0)
-        car.set_cam_pan_angle(0)
-        car.set_dir_servo_angle(0)
-
-        sleep(.1)
-
+    return play_action(car, "twist body")
 
 def celebrate(car):
-    car.reset()
-    car.set_cam_tilt_angle(20)
-
-    car.set_dir_servo_angle(30)
-    car.set_cam_pan_angle(60)
-    sleep(.3)
-    car.set_dir_servo_angle(10)
-    car.set_cam_pan_angle(30)
-    sleep(.1)
-    car.set_dir_servo_angle(30)
-    car.set_cam_pan_angle(60)
-    sleep(.3)
-    car.set_dir_servo_angle(0)
-    car.set_cam_pan_angle(0)
-    sleep(.2)
-
-    car.set_dir_servo_angle(-30)
-    car.set_cam_pan_angle(-60)
-    sleep(.3)
-    car.set_dir_servo_angle(-10)
-    car.set_cam_pan_angle(-30)
-    sleep(.1)
-    car.set_dir_servo_angle(-30)
-    car.set_cam_pan_angle(-60)
-    sleep(.3)
-    car.set_dir_servo_angle(0)
-    car.set_cam_pan_angle(0)
-    sleep(.2)
+    return play_action(car, "celebrate")
+
+def play_sound_effect(music, name, volume=100):
+    '''
+    Play sound effect ../sounds/<name>.wav in the background
+
+    music can be a Music object, or a preloaded robot_hat.speaker.SoundBank,
+    which plays the cached PCM buffer without reading or decoding the file.
+    '''
+    if hasattr(music, 'trigger'):
+        music.trigger(name, volume / 100)
+    else:
+        music.sound_play_threading(f"../sounds/{name}.wav", volume)
 
 def honking(music):
-    music.sound_play_threading("../sounds/car-double-horn.wav", 100)
+    play_sound_effect(music, "car-double-horn", 100)
 
 def start_engine(music):
-    music.sound_play_threading("../sounds/car-start-engine.wav", 50)
+    play_sound_effect(music, "car-start-engine", 50)
 
 actions_dict = {
     "shake head":shake_head, 
@@ -228,6 +179,8 @@ actions_dict = {
     "depressed": depressed,
     "forward": forward,
     "backward": backward,
+    "turn left": turn_left,
+    "turn right": turn_right,
 }
 
 sounds_dict = {
@@ -243,76 +196,165 @@ class ActionStatus(StrEnum):
     ACTIONS_DONE = 'actions_done'
 
 class ActionFlow():
-    def __init__(self, car: Picarx) -> None:
+    '''
+    Run queued actions in one thread
+
+    The thread sleeps on a condition variable until there is something to do,
+    each queued action gets a Future, and cancel()/stop() interrupt the action
+    being played (see stop_actions) instead of waiting for it to finish.
+    '''
+    ACTION_INTERVAL = 0.5 # seconds between two actions
+    METRICS_SIZE = 100 # actions kept in latency_log
+
+    def __init__(self, car: Picarx, sound_bank=None, action_interval=ACTION_INTERVAL) -> None:
         self.car = car
-        self.music = Music()
+        # a preloaded SoundBank plays sound effects without decoding them again
+        self.music = Music() if sound_bank is None else sound_bank
+        self.action_interval = action_interval
         self.status = ActionStatus.STANDBY
         self.last_status = None
-        self.action_queue = queue.Queue()
+        self.action_queue = deque() # (action, future, queued time)
+        self.cond = threading.Condition()
+        self.busy = False
         self.running = False
         self.thread = None
+        # (action, queue wait, run time) of the last actions, seconds
+        self.latency_log = deque(maxlen=self.METRICS_SIZE)
 
-    def do_action(self, action: str) -> None:
+    def do_action(self, action: str):
+        ''' return: Playback of a timeline action, None for a sound '''
         if action in actions_dict:
-            actions_dict[action](self.car)
+            return actions_dict[action](self.car)
         elif action in sounds_dict:
             sounds_dict[action](self.music)
+        return None
 
-    def action_handler(self) -> None:
-        last_action_time = time.time()
-        action_interval = 5 # seconds
-    
-        try:
+    def _next(self):
+        ''' wait for the next thing to do, None to quit '''
+        with self.cond:
             while self.running:
-                # actions
-                # ------------------------------
-                if self.status == ActionStatus.STANDBY:
-                    self.last_status = ActionStatus.STANDBY
-                    if time.time() - last_action_time > action_interval:
-                        # TODO: standby actions
-                        last_action_time = time.time()
-                        action_interval = random.randint(2, 6)
-                elif self.status == ActionStatus.THINK:
-                    if self.last_status != ActionStatus.THINK:
-                        self.last_status = ActionStatus.THINK
-                        keep_think(self.car)
-                elif self.status == ActionStatus.ACTIONS:
-                    if self.last_status != ActionStatus.ACTIONS:
-                        self.last_status = ActionStatus.ACTIONS
-                    _action = self.action_queue.get()
-                    self.do_action(_action)
-                    time.sleep(0.5)
-                    if self.action_queue.empty():
-                        self.status = ActionStatus.STANDBY
-                        last_action_time = time.time()
+                if self.action_queue:
+                    self.busy = True
+                    return self.action_queue.popleft()
+                if self.status == ActionStatus.THINK and self.last_status != ActionStatus.THINK:
+                    self.last_status = ActionStatus.THINK
+                    self.busy = True
+                    return ('think', None, None)
+                if self.status != ActionStatus.THINK:
+                    self.last_status = self.status
+                self.cond.wait()
+        return None
 
-                time.sleep(0.01)
-        except Exception as e:
-            print(f"action handler error: {e}")
+    def action_handler(self) -> None:
+        while True:
+            item = self._next()
+            if item is None:
+                break
+            _action, future, queued_time = item
+            try:
+                if future is None:
+                    keep_think(self.car)
+                    continue
+                if not future.set_running_or_notify_cancel():
+                    continue
+                st = time.time()
+                try:
+                    playback = self.do_action(_action)
+                except Exception as e:
+                    print(f"action handler error: {e}")
+                    future.set_exception(e)
+                    continue
+                # interrupted by cancel()/stop_actions(), not a run to time
+                if playback is not None and playback.cancelled:
+                    future.set_exception(CancelledError())
+                    continue
+                run_time = time.time() - st
+                self.latency_log.append((_action, st - queued_time, run_time))
+                future.set_result(run_time)
+                # pause between actions, cancel() wakes it up
+                with self.cond:
+                    if self.action_queue and self.running:
+                        self.cond.wait(self.action_interval)
+            finally:
+                with self.cond:
+                    self.busy = False
+                    if not self.action_queue and self.status == ActionStatus.ACTIONS:
+                        self.status = ActionStatus.STANDBY
+                    self.cond.notify_all()
 
     def add_action(self, *actions):
-        for action in actions:
-            if action not in actions_dict and action not in sounds_dict:
-                print(f"action {action} not found")
-                continue
-            self.action_queue.put(action)
-        self.status = ActionStatus.ACTIONS
-    
-    def set_status(self, status):
-        self.status = status
+        '''
+        Queue actions
+
+        return: a Future per queued action, its result is the run time in seconds,
+            CancelledError if the action was dropped or interrupted
+        '''
+        futures = []
+        with self.cond:
+            for action in actions:
+                if action not in actions_dict and action not in sounds_dict:
+                    print(f"action {action} not found")
+                    continue
+                future = Future()
+                self.action_queue.append((action, future, time.time()))
+                futures.append(future)
+            # unknown names only, keep the current status
+            if futures:
+                self.status = ActionStatus.ACTIONS
+                self.cond.notify_all()
+        return futures
 
-    def wait_actions_done(self):
-        while self.status != ActionStatus.STANDBY:
-            time.sleep(0.01)
+    def set_status(self, status):
+        with self.cond:
+            self.status = status
+            self.cond.notify_all()
+
+    def wait_actions_done(self, timeout=None):
+        '''
+        Block until the queue is empty and the current action is done
+
+        return: True if done, False on timeout
+        '''
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.action_queue and not self.busy, timeout)
+
+    def cancel(self):
+        ''' drop the queued actions and interrupt the one being played '''
+        with self.cond:
+            while self.action_queue:
+                _, future, _ = self.action_queue.popleft()
+                future.cancel()
+            if self.status == ActionStatus.ACTIONS:
+                self.status = ActionStatus.STANDBY
+            self.cond.notify_all()
+        stop_actions(self.car)
+
+    def metrics(self):
+        '''
+        Latency summary of the last actions
+
+        return: {action: {'count', 'avg_wait', 'max_wait', 'avg_run'}}, seconds
+        '''
+        result = {}
+        for _action, wait, run in list(self.latency_log):
+            m = result.setdefault(_action, {'count': 0, 'avg_wait': 0, 'max_wait': 0, 'avg_run': 0})
+            m['count'] += 1
+            m['avg_wait'] += (wait - m['avg_wait']) / m['count']
+            m['avg_run'] += (run - m['avg_run']) / m['count']
+            m['max_wait'] = max(m['max_wait'], wait)
+        return result
 
     def start(self):
         self.running = True
         self.status = ActionStatus.STANDBY
-        self.action_queue = queue.Queue()
+        self.action_queue = deque()
         self.thread = threading.Thread(name="action_handler", target=self.action_handler)
         self.thread.start()
 
     def stop(self):
-        self.running = False
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.cancel()
         if self.thread != None:
             self.thread.join()
@@ -0,0 +1,237 @@
+import queue
+import re
+import threading
+import time
+
+# end of sentence: punctuation (also CJK) followed by whitespace or end of text
+_SENTENCE_END = re.compile(r'([.!?;。！？；]+["\')\]]*)(\s+|$)')
+# abbreviations like "e.g." or "Mr." should not end a sentence
+_NO_BREAK = re.compile(r'\b(?:e\.g|i\.e|etc|mr|mrs|ms|dr|st|vs)\.$', re.IGNORECASE)
+_THINK_BLOCK = re.compile(r'<\s*(think|thinking)[^>]*>.*?<\s*/\s*\1\s*>', re.DOTALL | re.IGNORECASE)
+_THINK_OPEN = re.compile(r'<\s*(think|thinking)[^>]*>', re.IGNORECASE)
+
+
+class SentenceSplitter(object):
+    '''
+    Split streamed LLM tokens into sentences
+
+    feed() tokens as they arrive and get back the sentences completed so far,
+    flush() at the end of the reply for the rest. <think>...</think> blocks
+    are dropped, nothing after an unclosed <think> is emitted.
+    '''
+
+    def __init__(self, min_chars=8, strip_thinking=True):
+        '''
+        :param min_chars: shorter sentences are joined with the next one
+        :param strip_thinking: drop <think>/<thinking> blocks
+        '''
+        self.min_chars = min_chars
+        self.strip_thinking = strip_thinking
+        self._buf = ''
+
+    def feed(self, token):
+        '''
+        :param token: next piece of text
+        :return: list of completed sentences
+        :rtype: list
+        '''
+        self._buf += token
+        return self._split(final=False)
+
+    def flush(self):
+        '''
+        :return: list of the remaining sentences
+        :rtype: list
+        '''
+        sentences = self._split(final=True)
+        self._buf = ''
+        return sentences
+
+    def _split(self, final):
+        text = self._buf
+        if self.strip_thinking:
+            text = _THINK_BLOCK.sub('', text)
+            m = _THINK_OPEN.search(text)
+            hidden = ''
+            if m is not None:
+                # still thinking, keep the open block in the buffer
+                text, hidden = text[:m.start()], text[m.start():]
+        else:
+            hidden = ''
+
+        sentences = []
+        start = 0
+        for m in _SENTENCE_END.finditer(text):
+            end = m.end(1)
+            # ends on the terminator, the closing whitespace hasn't arrived yet, wait for the next token
+            if end == len(text) and not final:
+                break
+            if _NO_BREAK.search(text[start:end]):
+                continue
+            sentence = text[start:end].strip()
+            if len(sentence) < self.min_chars:
+                continue
+            sentences.append(sentence)
+            start = m.end()
+        rest = text[start:]
+        if final:
+            rest = rest.strip()
+            if rest:
+                sentences.append(rest)
+            rest = ''
+        self._buf = rest + hidden
+        return sentences
+
+
+class SpeechPipeline(object):
+    '''
+    Speak streamed text sentence by sentence
+
+    Sentences are synthesized in one worker thread while the previous one is
+    played in another, so the first sentence is heard after about one
+    sentence of generation + synthesis instead of after the whole reply.
+
+    Usage:
+        tts = TTSCache(Piper())
+        speech = SpeechPipeline(tts.get, tts.play_file)
+        speech.speak_stream(llm.prompt(text, stream=True))
+        speech.wait()
+    '''
+
+    def __init__(self, synthesize, play, splitter=None, max_ahead=2):
+        '''
+        :param synthesize: callable(text) -> audio (e.g. wav path), None if failed
+        :param play: callable(audio), blocks until played
+        :param splitter: SentenceSplitter, default SentenceSplitter()
+        :param max_ahead: max synthesized sentences waiting to be played
+        '''
+        self.synthesize = synthesize
+        self.play = play
+        self.splitter = splitter or SentenceSplitter()
+        self._sentences = queue.Queue()
+        self._audio = queue.Queue(maxsize=max_ahead)
+        self._pending = 0
+        self._generation = 0
+        self._idle = threading.Condition()
+        self.first_audio_latency = None
+        self._start_time = None
+        self.running = True
+        self._threads = [
+            threading.Thread(name="speech_synth", target=self._synth_loop, daemon=True),
+            threading.Thread(name="speech_play", target=self._play_loop, daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+
+    def _done_one(self):
+        with self._idle:
+            self._pending -= 1
+            if self._pending <= 0:
+                self._pending = 0
+                self._idle.notify_all()
+
+    def _synth_loop(self):
+        while self.running:
+            item = self._sentences.get()
+            if item is None:
+                break
+            generation, text = item
+            if generation != self._generation:
+                self._done_one()
+                continue
+            try:
+                audio = self.synthesize(text)
+            except Exception as e:
+                print(f"speech synthesize error: {e}")
+                audio = None
+            if audio is None or generation != self._generation:
+                self._done_one()
+                continue
+            self._audio.put((generation, audio))
+        self._audio.put(None)
+
+    def _play_loop(self):
+        while self.running:
+            item = self._audio.get()
+            if item is None:
+                break
+            generation, audio = item
+            if generation == self._generation:
+                if self.first_audio_latency is None and self._start_time is not None:
+                    self.first_audio_latency = time.time() - self._start_time
+                try:
+                    self.play(audio)
+                except Exception as e:
+                    print(f"speech play error: {e}")
+            self._done_one()
+
+    def _put(self, sentence):
+        with self._idle:
+            self._pending += 1
+        self._sentences.put((self._generation, sentence))
+
+    def _begin(self):
+        if self._start_time is None:
+            self._start_time = time.time()
+            self.first_audio_latency = None
+
+    def say(self, text):
+        '''
+        Queue a whole text, split into sentences
+
+        :param text: text to speak
+        '''
+        self._begin()
+        for sentence in self.splitter.feed(text) + self.splitter.flush():
+            self._put(sentence)
+
+    def speak_stream(self, tokens, echo=False):
+        '''
+        Queue streamed tokens, each sentence is spoken as soon as it's complete
+
+        :param tokens: iterable of text pieces, e.g. llm.prompt(text, stream=True)
+        :param echo: print tokens as they arrive
+        :return: the whole text received
+        :rtype: str
+        '''
+        self._begin()
+        text = ''
+        for token in tokens:
+            if not token:
+                continue
+            if echo:
+                print(token, end='', flush=True)
+            text += token
+            for sentence in self.splitter.feed(token):
+                self._put(sentence)
+        for sentence in self.splitter.flush():
+            self._put(sentence)
+        if echo:
+            print('')
+        return text
+
+    def wait(self, timeout=None):
+        '''
+        Block until everything queued has been played
+
+        :param timeout: seconds, None for no timeout
+        :return: True if done, False on timeout
+        :rtype: bool
+        '''
+        with self._idle:
+            done = self._idle.wait_for(lambda: self._pending == 0, timeout)
+        self._start_time = None
+        return done
+
+    def cancel(self):
+        ''' Drop everything not played yet, the sentence being played finishes '''
+        self._generation += 1
+        self.splitter.flush()
+
+    def close(self):
+        ''' Stop the worker threads '''
+        self.cancel()
+        self.running = False
+        self._sentences.put(None)
+        for t in self._threads:
+            t.join(timeout=1)
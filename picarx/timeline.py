@@ -0,0 +1,219 @@
+import threading
+import time
+
+# channels, in the order they are written within a frame: steering before
+# the motors, forward()/backward() scale the wheels by the steering angle
+CHANNELS = ('dir', 'pan', 'tilt', 'speed', 'motor1', 'motor2')
+CH_DIR, CH_PAN, CH_TILT, CH_SPEED, CH_MOTOR1, CH_MOTOR2 = range(len(CHANNELS))
+
+RESET = {'speed': 0, 'dir': 0, 'tilt': 0, 'pan': 0}
+
+
+def steps(*items):
+    '''
+    Keyframes from (values, hold) steps, the way the actions used to be written:
+    set values, sleep hold seconds, set the next values...
+
+    :param items: (values, hold) tuples, values is {channel: value}
+    :return: keyframes, [(t, values), ...]
+    :rtype: list
+    '''
+    keyframes = []
+    t = 0
+    for values, hold in items:
+        keyframes.append((t, values))
+        t += hold
+    # a last keyframe without values keeps the final hold in the duration
+    keyframes.append((t, {}))
+    return keyframes
+
+
+class Timeline(object):
+    '''
+    A compiled action: frames of (t, ((channel, value), ...)) sorted by time
+
+    Keyframes at the same time are merged into one frame and writes that
+    don't change a channel are dropped, so playback only writes what moves.
+    'speed' is written again when 'dir' changes while driving, forward() and
+    backward() take the wheel ratios from the steering angle of the call.
+    '''
+
+    def __init__(self, keyframes, name=None):
+        '''
+        :param keyframes: [(t, {channel: value}), ...], channels are
+            'dir', 'pan', 'tilt' (servo angles), 'speed' (forward > 0, backward < 0, stop 0),
+            'motor1', 'motor2' (raw motor speeds)
+        :param name: timeline name
+        '''
+        self.name = name
+        merged = {}
+        for t, values in keyframes:
+            frame = merged.setdefault(round(t, 4), {})
+            for channel, value in values.items():
+                if channel not in CHANNELS:
+                    raise ValueError(f"unknown channel '{channel}', channels: {CHANNELS}")
+                frame[CHANNELS.index(channel)] = value
+
+        self.frames = []
+        last = {}
+        for t in sorted(merged):
+            changed = {ch: v for ch, v in merged[t].items() if last.get(ch) != v}
+            last.update(merged[t])
+            if CH_DIR in changed and last.get(CH_SPEED):
+                changed[CH_SPEED] = last[CH_SPEED]
+            writes = tuple(sorted(changed.items()))
+            if writes:
+                self.frames.append((t, writes))
+        self.duration = max(merged) if merged else 0
+        self.times = tuple(t for t, _ in self.frames)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __repr__(self):
+        return f"Timeline({self.name!r}, {len(self.frames)} frames, {self.duration:.2f} s)"
+
+
+def compile_steps(*items, name=None):
+    ''' compile (values, hold) steps into a Timeline, see steps() '''
+    return Timeline(steps(*items), name=name)
+
+
+class Playback(object):
+    ''' handle of a timeline being played '''
+
+    def __init__(self, timeline, speed):
+        self.timeline = timeline
+        self.speed = speed
+        self.cancelled = False
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        '''
+        Block until played or cancelled
+
+        :return: True if played to the end
+        :rtype: bool
+        '''
+        self.done.wait(timeout)
+        return self.done.is_set() and not self.cancelled
+
+
+class TimelinePlayer(object):
+    '''
+    Play timelines on a car from one shared thread
+
+    A new play() preempts the timeline being played. cancel() interrupts it
+    between two frames and stops the motors at once, from any thread.
+    '''
+
+    def __init__(self, car):
+        self.car = car
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._current = None
+        self._thread = None
+        self._writers = (
+            car.set_dir_servo_angle,
+            car.set_cam_pan_angle,
+            car.set_cam_tilt_angle,
+            self._set_speed,
+            lambda v: car.set_motor_speed(1, v),
+            lambda v: car.set_motor_speed(2, v),
+        )
+
+    def _set_speed(self, speed):
+        if speed > 0:
+            self.car.forward(speed)
+        elif speed < 0:
+            self.car.backward(-speed)
+        else:
+            self.car.stop()
+
+    def play(self, timeline, speed=1.0, wait=False):
+        '''
+        Play a timeline, preempting the current one
+
+        :param timeline: Timeline
+        :param speed: time scale, 2 plays twice as fast
+        :param wait: block until done
+        :return: Playback
+        '''
+        if speed <= 0:
+            raise ValueError("speed must be > 0")
+        playback = Playback(timeline, speed)
+        with self._cond:
+            if self._current is not None:
+                self._current.cancelled = True
+                self._current.done.set()
+            self._current = playback
+            if self._thread is None:
+                self._thread = threading.Thread(name="timeline_player", target=self._loop, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+        if wait:
+            playback.wait()
+        return playback
+
+    def cancel(self, stop=True):
+        '''
+        Interrupt the current timeline
+
+        :param stop: stop the motors
+        '''
+        with self._cond:
+            playback = self._current
+            self._current = None
+            if playback is not None:
+                playback.cancelled = True
+                playback.done.set()
+            self._cond.notify_all()
+        if stop:
+            with self._write_lock:
+                self.car.stop()
+
+    def is_playing(self):
+        return self._current is not None
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while self._current is None:
+                    self._cond.wait()
+                playback = self._current
+            start = time.monotonic()
+            frames = playback.timeline.frames
+            end_t = playback.timeline.duration
+            for t, writes in frames + [(end_t, ())]:
+                due = start + t / playback.speed
+                with self._cond:
+                    while not playback.cancelled:
+                        remaining = due - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                if playback.cancelled:
+                    break
+                with self._write_lock:
+                    # checked again under the lock, cancel() may have stopped the car meanwhile
+                    if playback.cancelled:
+                        break
+                    for ch, value in writes:
+                        self._writers[ch](value)
+            with self._cond:
+                if self._current is playback:
+                    self._current = None
+            playback.done.set()
+
+
+_players = {}
+_players_lock = threading.Lock()
+
+def player_for(car):
+    ''' the shared TimelinePlayer of a car '''
+    with _players_lock:
+        player = _players.get(car)
+        if player is None:
+            player = TimelinePlayer(car)
+            _players[car] = player
+        return player
@@ -1 +1,2 @@
-from robot_hat.tts import *
\ No newline at end of file
+from robot_hat.tts import *
+from .tts_cache import TTSCache
@@ -0,0 +1,389 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'picarx', 'tts')
+
+
+class TTSCache(object):
+    '''
+    Content addressed cache in front of a TTS engine (Piper, Pico2Wave, Espeak,
+    OpenAI_TTS or any callable that writes a wav file)
+
+    Synthesized wav files are stored on disk under the sha1 of
+    (engine, voice, model, lang, volume, text), evicted least recently used
+    once the directory grows over max_bytes. The most recently spoken phrases
+    are also kept decoded in memory when a robot_hat.speaker.Speaker is given,
+    so they start playing without touching the disk.
+
+    Usage:
+        tts = TTSCache(Pico2Wave())
+        tts.set_lang("en-US")
+        tts.prewarm(["Look for red!", "Look for blue!"], background=True)
+        tts.say("Look for red!")
+    '''
+    TEXTS_SIZE = 256 # phrases remembered to synthesize an evicted file again
+
+    def __init__(self, engine=None, cache_dir=DEFAULT_CACHE_DIR, max_bytes=50*1024*1024,
+                 hot_entries=16, speaker=None, volume_db=0, synthesize=None,
+                 engine_name=None, voice=None, model=None, lang=None):
+        '''
+        :param engine: TTS engine with a tts(text, file) method, can be None if synthesize is given
+        :param cache_dir: directory of the on disk store
+        :param max_bytes: max size of the on disk store in bytes
+        :param hot_entries: number of phrases kept decoded in memory (needs speaker)
+        :param speaker: robot_hat.speaker.Speaker to play through, None to play with Music
+        :param volume_db: volume gain in dB applied with sox before caching, 0 to skip
+        :param synthesize: callable(text, file) -> bool, overrides engine.tts
+        :param engine_name: name used in the cache key, default is the engine class name
+        :param voice: voice in the cache key, default the engine's voice attribute
+        :param model: model in the cache key, default the engine's model attribute
+        :param lang: language in the cache key, default the engine's lang attribute
+        '''
+        if synthesize is None:
+            if engine is None or not hasattr(engine, 'tts'):
+                raise ValueError("engine must have a tts(text, file) method, or pass synthesize")
+            synthesize = engine.tts
+        self.engine = engine
+        self._synthesize = synthesize
+        self.engine_name = engine_name or type(engine).__name__
+        self.voice = voice
+        self.model = model
+        self.lang = lang
+        self.volume_db = volume_db
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hot_entries = hot_entries
+        self.speaker = speaker
+        self._bank = None
+        if speaker is not None and hot_entries > 0:
+            from robot_hat.speaker import SoundBank
+            self._bank = SoundBank(speaker)
+        self._music = None
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._hot_locks = {}
+        self._pins = {}             # key -> plays using the file, not evicted
+        self._texts = OrderedDict() # key -> phrase of the last keys handed out, to re-synthesize
+        self._hot = OrderedDict()   # key -> None, order of use
+        self._files = OrderedDict() # key -> size, least recently used first
+        self._total_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    # ------------ engine settings, part of the cache key ------------
+    def set_voice(self, voice):
+        self.voice = voice
+        if self.engine is not None and hasattr(self.engine, 'set_voice'):
+            self.engine.set_voice(voice)
+
+    def set_model(self, model):
+        self.model = model
+        if self.engine is not None and hasattr(self.engine, 'set_model'):
+            self.engine.set_model(model)
+
+    def set_lang(self, lang):
+        self.lang = lang
+        if self.engine is not None and hasattr(self.engine, 'set_lang'):
+            self.engine.set_lang(lang)
+
+    def set_volume_db(self, volume_db):
+        self.volume_db = volume_db
+
+    def __getattr__(self, name):
+        # anything else goes to the engine
+        engine = self.__dict__.get('engine')
+        if engine is None:
+            raise AttributeError(name)
+        return getattr(engine, name)
+
+    # ------------ store ------------
+    def _setting(self, name):
+        ''' voice, model or lang: the one set here, else what the engine has '''
+        value = self.__dict__.get(name)
+        if value is None and self.engine is not None:
+            for attr in (name, f"_{name}"):
+                value = getattr(self.engine, attr, None)
+                if value is not None and not callable(value):
+                    return value
+            return None
+        return value
+
+    def key(self, text):
+        ''' cache key of a phrase with current engine settings '''
+        parts = [self.engine_name, self._setting('voice'), self._setting('model'),
+                 self._setting('lang'), self.volume_db, text]
+        raw = '\x1f'.join('' if p is None else str(p) for p in parts)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.wav")
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            # skip temp files of unfinished synthesis
+            if not name.endswith('.wav') or name.startswith('.'):
+                continue
+            st = os.stat(os.path.join(self.cache_dir, name))
+            entries.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self._files[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _evict(self):
+        # least recently used first, files being played are skipped
+        for key in list(self._files):
+            if self._total_bytes <= self.max_bytes or len(self._files) <= 1:
+                break
+            if self._pins.get(key):
+                continue
+            size = self._files.pop(key)
+            self._total_bytes -= size
+            self._drop_hot(key)
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def _touch(self, key):
+        self._files.move_to_end(key)
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _drop_hot(self, key):
+        if key in self._hot:
+            del self._hot[key]
+            if self._bank is not None:
+                self._bank.sounds.pop(key, None)
+
+    def _make_hot(self, key, path):
+        if self._bank is None:
+            return
+        with self._lock:
+            if key in self._hot:
+                self._hot.move_to_end(key)
+                return
+            # one decode per phrase, outside the cache lock so get() isn't held up
+            hot_lock = self._hot_locks.setdefault(key, threading.Lock())
+        with hot_lock:
+            try:
+                with self._lock:
+                    if key in self._hot:
+                        self._hot.move_to_end(key)
+                        return
+                self._bank.load(key, path)
+                with self._lock:
+                    self._hot[key] = None
+                    while len(self._hot) > self.hot_entries:
+                        old, _ = self._hot.popitem(last=False)
+                        self._bank.sounds.pop(old, None)
+            finally:
+                with self._lock:
+                    self._hot_locks.pop(key, None)
+
+    def _render(self, text, key):
+        path = self._path(key)
+        prefix = os.path.join(self.cache_dir, f".{key}.{threading.get_ident()}")
+        raw = f"{prefix}.raw.wav"
+        vol = f"{prefix}.vol.wav"
+        try:
+            status = self._synthesize(text, raw)
+            if status is False or not os.path.isfile(raw):
+                return None
+            if self.volume_db:
+                import sox
+                transform = sox.Transformer()
+                transform.vol(self.volume_db)
+                transform.build(raw, vol)
+                os.replace(vol, path)
+            else:
+                os.replace(raw, path)
+        finally:
+            for tmp in (raw, vol):
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        return path
+
+    def get(self, text):
+        '''
+        Get the wav file of a phrase, synthesize it on a miss
+
+        The file can be evicted by a later get(), use play() to play it safely.
+
+        :param text: phrase
+        :return: wav file path, None if synthesis failed
+        :rtype: str/None
+        '''
+        return self._get(text, pin=False)
+
+    def _pin(self, key):
+        self._pins[key] = self._pins.get(key, 0) + 1
+
+    def _unpin(self, key):
+        with self._lock:
+            count = self._pins.pop(key, 0) - 1
+            if count > 0:
+                self._pins[key] = count
+            self._evict()
+
+    def _get(self, text, pin):
+        ''' get(), pin=True also keeps the file from eviction until _unpin(key) '''
+        key = self.key(text)
+        with self._lock:
+            self._texts[key] = text
+            self._texts.move_to_end(key)
+            while len(self._texts) > self.TEXTS_SIZE:
+                self._texts.popitem(last=False)
+            if key in self._files:
+                self.hits += 1
+                self._touch(key)
+                if pin:
+                    self._pin(key)
+                return self._path(key)
+            # one synthesis per phrase even if several threads ask for it
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            try:
+                with self._lock:
+                    if key in self._files:
+                        self.hits += 1
+                        self._touch(key)
+                        if pin:
+                            self._pin(key)
+                        return self._path(key)
+                    self.misses += 1
+                path = self._render(text, key)
+                with self._lock:
+                    if path is None:
+                        return None
+                    size = os.path.getsize(path)
+                    self._files[key] = size
+                    self._total_bytes += size
+                    if pin:
+                        self._pin(key)
+                    self._evict()
+            finally:
+                # also when the synthesis raised, so the next get() doesn't find a stale lock
+                with self._lock:
+                    self._key_locks.pop(key, None)
+        return path
+
+    def play(self, text, wait=True):
+        '''
+        Play a phrase from the cache
+
+        :param text: phrase
+        :param wait: block until playback is done
+        :return: True if played
+        :rtype: bool
+        '''
+        path = self.get(text)
+        if path is None:
+            return False
+        return self.play_file(path, wait)
+
+    def play_file(self, path, wait=True):
+        '''
+        Play a wav file returned by get()
+
+        The file is kept from eviction until this returns: the whole playback
+        when waiting, the load into the sound bank otherwise. Without a sound
+        bank, wait=False still reads the file after this returns. A file
+        evicted since get() is synthesized again.
+
+        :param path: wav file path
+        :param wait: block until playback is done
+        :return: True if played
+        :rtype: bool
+        '''
+        key = os.path.splitext(os.path.basename(path))[0]
+        with self._lock:
+            cached = key in self._files
+            if cached:
+                self._pin(key)
+            text = self._texts.get(key)
+        if not cached:
+            if text is None:
+                # not from this cache
+                self._play_file(path, wait)
+                return True
+            path = self._get(text, pin=True)
+            if path is None:
+                return False
+            # the engine settings may have changed since
+            key = os.path.splitext(os.path.basename(path))[0]
+        try:
+            self._play_file(path, wait)
+        finally:
+            self._unpin(key)
+        return True
+
+    def _play_file(self, path, wait):
+        if self.speaker is not None:
+            if self._bank is not None:
+                key = os.path.splitext(os.path.basename(path))[0]
+                self._make_hot(key, path)
+                task_id = self._bank.trigger(key)
+            else:
+                task_id = self.speaker.play(path)
+            if wait:
+                self._wait_speaker(task_id)
+        else:
+            if self._music is None:
+                from robot_hat import Music
+                self._music = Music()
+            if wait:
+                self._music.sound_play(path)
+            else:
+                self._music.sound_play_threading(path)
+
+    def say(self, text):
+        ''' Speak a phrase, same as play(text, wait=True) '''
+        return self.play(text)
+
+    def _wait_speaker(self, task_id):
+        import time
+        while task_id in self.speaker.list_tasks():
+            time.sleep(0.02)
+
+    def prewarm(self, phrases, background=False):
+        '''
+        Synthesize phrases ahead of time
+
+        :param phrases: list of phrases
+        :param background: run in a daemon thread and return it
+        :return: thread if background else None
+        '''
+        def _run():
+            for text in phrases:
+                self.get(text)
+        if background:
+            t = threading.Thread(name="tts_cache_prewarm", target=_run, daemon=True)
+            t.start()
+            return t
+        _run()
+
+    def clear(self):
+        ''' Remove every cached file '''
+        with self._lock:
+            for key in list(self._files):
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+                self._drop_hot(key)
+            self._files.clear()
+            self._total_bytes = 0
+
+    def size(self):
+        ''' Total bytes on disk '''
+        return self._total_bytes
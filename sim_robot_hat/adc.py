@@ -6,6 +6,8 @@ class ADC(I2C):
     """
     Analog to digital converter
     """
+    __slots__ = ('chn',)
+
     def __init__(self, chn, address=None, *args, **kwargs):
         """
         Analog to digital converter
@@ -13,6 +15,11 @@ class ADC(I2C):
         :param chn: channel number (0-7/A0-A7)
         :type chn: int/str
         """
+        if address is not None:
+            super().__init__(address, *args, **kwargs)
+        else:
+            super().__init__([0x14, 0x15, 0x16], *args, **kwargs)
+
         if isinstance(chn, str):
             # If chn is a string, assume it's a pin name, remove A and convert to int
             if chn.startswith("A"):
@@ -47,5 +54,6 @@ class ADC(I2C):
         value = self.read()
         # Convert to voltage
         voltage = value * 3.3 / 4095
-        self._debug(f"Read voltage: {voltage}")
+        if self._debug_on:
+            self._debug(f"Read voltage: {voltage}")
         return voltage
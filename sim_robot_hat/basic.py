@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 #!/usr/bin/env python3
 import logging
-import time
+import threading
 
 
 class _Basic_class(object):
@@ -9,7 +9,13 @@ class _Basic_class(object):
     Basic Class for all classes
 
     with debug function
+
+    Loggers are shared per class: every instance of the same class writes
+    through one logger with one handler, and the debug level is filtered
+    per instance, so creating many devices doesn't grow the logging registry.
     """
+    __slots__ = ('logger', '_debug_level', '_level', '_debug_on', '__weakref__')
+
     _class_name = '_Basic_class'
     DEBUG_LEVELS = {'debug': logging.DEBUG,
                     'info': logging.INFO,
@@ -20,6 +26,11 @@ class _Basic_class(object):
     """Debug level"""
     DEBUG_NAMES = ['critical', 'error', 'warning', 'info', 'debug']
     """Debug level names"""
+    LOG_FORMAT = "%(asctime)s	[%(levelname)s]	%(message)s"
+    """Log format of the shared handlers"""
+
+    _loggers = {}
+    _loggers_lock = threading.Lock()
 
     def __init__(self, debug_level='warning'):
         """
@@ -28,19 +39,52 @@ class _Basic_class(object):
         :param debug_level: debug level, 0(critical), 1(error), 2(warning), 3(info) or 4(debug)
         :type debug_level: str/int
         """
-        self.logger = logging.getLogger(f"self._class_name-{time.time()}")
-        self.ch = logging.StreamHandler()
-        form = "%(asctime)s	[%(levelname)s]	%(message)s"
-        self.formatter = logging.Formatter(form)
-        self.ch.setFormatter(self.formatter)
-        self.logger.addHandler(self.ch)
-        self._debug = self.logger.debug
-        self._info = self.logger.info
-        self._warning = self.logger.warning
-        self._error = self.logger.error
-        self._critical = self.logger.critical
+        self.logger = self._get_logger()
         self.debug_level = debug_level
 
+    @classmethod
+    def _get_logger(cls):
+        """
+        Get the logger shared by all instances of this class, create it on first use
+
+        :return: shared logger
+        :rtype: logging.Logger
+        """
+        name = f"robot_hat.{cls.__name__}"
+        logger = cls._loggers.get(name)
+        if logger is not None:
+            return logger
+        with cls._loggers_lock:
+            logger = cls._loggers.get(name)
+            if logger is None:
+                logger = logging.getLogger(name)
+                ch = logging.StreamHandler()
+                ch.setFormatter(logging.Formatter(cls.LOG_FORMAT))
+                logger.addHandler(ch)
+                # instances filter by their own level, let everything through here
+                logger.setLevel(logging.DEBUG)
+                _Basic_class._loggers[name] = logger
+        return logger
+
+    def _debug(self, msg, *args, **kwargs):
+        if self._debug_on:
+            self.logger.debug(msg, *args, **kwargs)
+
+    def _info(self, msg, *args, **kwargs):
+        if self._level <= logging.INFO:
+            self.logger.info(msg, *args, **kwargs)
+
+    def _warning(self, msg, *args, **kwargs):
+        if self._level <= logging.WARNING:
+            self.logger.warning(msg, *args, **kwargs)
+
+    def _error(self, msg, *args, **kwargs):
+        if self._level <= logging.ERROR:
+            self.logger.error(msg, *args, **kwargs)
+
+    def _critical(self, msg, *args, **kwargs):
+        self.logger.critical(msg, *args, **kwargs)
+
     @property
     def debug_level(self):
         """Debug level"""
@@ -56,6 +100,7 @@ class _Basic_class(object):
         else:
             raise ValueError(
                 f'Debug value must be 0(critical), 1(error), 2(warning), 3(info) or 4(debug), not "{debug}".')
-        self.logger.setLevel(self.DEBUG_LEVELS[self._debug_level])
-        self.ch.setLevel(self.DEBUG_LEVELS[self._debug_level])
+        self._level = self.DEBUG_LEVELS[self._debug_level]
+        # hot paths check this flag before formatting their messages
+        self._debug_on = self._level <= logging.DEBUG
         self._debug(f'Set logging level to [{self._debug_level}]')
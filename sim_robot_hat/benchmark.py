@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Micro benchmarks for the simulated robot hat
+
+Run with ``python -m sim_robot_hat.benchmark``
+"""
+import gc
+import sys
+import time
+import tracemalloc
+
+from .adc import ADC
+from .pin import Pin
+from .pwm import PWM
+from .servo import Servo
+
+
+class _DictPWM(object):
+    """Plain __dict__ backed object with the same attributes as a PWM, used as reference"""
+
+    def __init__(self, channel):
+        self.logger = None
+        self._debug_level = 'warning'
+        self._level = 30
+        self._debug_on = False
+        self._bus = 1
+        self.address = PWM.ADDR
+        self.channel = channel
+        self.timer_index = channel // 4
+        self._timer = None
+        self._pulse_width = 0
+        self._pulse_width_percent = 0
+        self._freq = 50
+
+
+def _alloc_per_object(factory, count):
+    gc.collect()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    objs = [factory(i) for i in range(count)]
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objs
+    return (end - start) / count
+
+
+def _attr_access_time(obj, loops):
+    st = time.perf_counter()
+    for i in range(loops):
+        obj._pulse_width = i
+        obj._pulse_width + obj.channel + obj.timer_index
+    return (time.perf_counter() - st) / loops * 1e9
+
+
+def bench_devices(count=2000, loops=200000):
+    """
+    Compare memory and attribute access of slotted devices against a dict backed object
+
+    :param count: number of objects to create for memory measurement
+    :type count: int
+    :param loops: attribute access loops
+    :type loops: int
+    :return: results, {name: value}
+    :rtype: dict
+    """
+    results = {
+        'pwm_bytes': _alloc_per_object(lambda i: PWM(i % 20), count),
+        'servo_bytes': _alloc_per_object(lambda i: Servo(i % 12), count),
+        'pin_bytes': _alloc_per_object(lambda i: Pin('D4'), count),
+        'adc_bytes': _alloc_per_object(lambda i: ADC(i % 8), count),
+        'dict_pwm_bytes': _alloc_per_object(lambda i: _DictPWM(i % 20), count),
+        'pwm_access_ns': _attr_access_time(PWM(0), loops),
+        'dict_pwm_access_ns': _attr_access_time(_DictPWM(0), loops),
+    }
+    return results
+
+
+def main():
+    results = bench_devices()
+    print(f"python {sys.version.split()[0]}")
+    print(f"PWM:    {results['pwm_bytes']:8.1f} B/object, {results['pwm_access_ns']:6.1f} ns/access")
+    print(f"dict:   {results['dict_pwm_bytes']:8.1f} B/object, {results['dict_pwm_access_ns']:6.1f} ns/access")
+    print(f"Servo:  {results['servo_bytes']:8.1f} B/object")
+    print(f"Pin:    {results['pin_bytes']:8.1f} B/object")
+    print(f"ADC:    {results['adc_bytes']:8.1f} B/object")
+
+
+if __name__ == '__main__':
+    main()
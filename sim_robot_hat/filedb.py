@@ -101,6 +101,16 @@ class fileDB(object):
 		#Modified set for off robot usage
 		pass
 
+	def set_many(self, values):
+		"""
+		Set several values with one write of the file
+
+		:param values: {name: value}
+		:type values: dict
+		"""
+		#Modified set for off robot usage
+		pass
+
 if __name__ == '__main__':
     db = fileDB('/opt/robot-hat/test2.config')
 
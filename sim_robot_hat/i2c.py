@@ -22,6 +22,8 @@ class I2C(_Basic_class):
     """
     I2C bus read/write functions
     """
+    __slots__ = ('_bus', 'address')
+
     RETRY = 5
 
     # i2c_lock = multiprocessing.Value('i', 0)
@@ -1,16 +1,167 @@
-
 from .pin import Pin
 import threading
 import time
 
+
+class TimerWheel:
+    """
+    Hashed timer wheel run by one thread
+
+    Callbacks are hashed into slots of tick seconds. The thread sleeps on a
+    condition until the next occupied slot is due, so an idle wheel costs
+    nothing, and schedule()/cancel() only take a lock and never block.
+    """
+
+    def __init__(self, tick: float=0.01, slots: int=256) -> None:
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.cond = threading.Condition()
+        self.start_time = time.monotonic()
+        self.current = 0 # last processed tick
+        self.count = 0
+        self.thread = None
+
+    def _now_tick(self) -> int:
+        return int((time.monotonic() - self.start_time) / self.tick)
+
+    def schedule(self, delay: float, callback) -> list:
+        """
+        Call callback() from the wheel thread after delay seconds
+
+        :return: timer handle for cancel()
+        """
+        with self.cond:
+            deadline = max(self._now_tick(), self.current) + max(1, round(delay / self.tick))
+            timer = [deadline, callback]
+            self.slots[deadline % len(self.slots)].append(timer)
+            self.count += 1
+            if self.thread is None:
+                self.thread = threading.Thread(name="timer_wheel", target=self._loop, daemon=True)
+                self.thread.start()
+            self.cond.notify()
+        return timer
+
+    def cancel(self, timer: list) -> None:
+        with self.cond:
+            slot = self.slots[timer[0] % len(self.slots)]
+            if timer in slot:
+                slot.remove(timer)
+                self.count -= 1
+
+    def _next_deadline(self):
+        if self.count == 0:
+            return None
+        return min(timer[0] for slot in self.slots for timer in slot)
+
+    def _loop(self) -> None:
+        while True:
+            due = []
+            with self.cond:
+                deadline = self._next_deadline()
+                if deadline is None:
+                    self.cond.wait()
+                    continue
+                remaining = (deadline * self.tick + self.start_time) - time.monotonic()
+                if remaining > 0:
+                    self.cond.wait(remaining)
+                    continue
+                now = self._now_tick()
+                n = len(self.slots)
+                # visit the slots passed since the last run, a whole turn at most
+                for t in range(max(self.current + 1, now - n + 1), now + 1):
+                    slot = self.slots[t % n]
+                    for timer in slot[:]:
+                        if timer[0] <= now:
+                            slot.remove(timer)
+                            due.append(timer)
+                self.count -= len(due)
+                self.current = now
+            for _, callback in sorted(due, key=lambda timer: timer[0]):
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"timer wheel error: {e}")
+
+_wheel = None
+_wheel_lock = threading.Lock()
+
+def timer_wheel() -> TimerWheel:
+    """The timer wheel shared by all LEDs"""
+    global _wheel
+    with _wheel_lock:
+        if _wheel is None:
+            _wheel = TimerWheel()
+        return _wheel
+
+
 class LED:
+    """
+    LED with patterns
+
+    A pattern is a list of (level, seconds) steps, level 0-1, played once or
+    looped by the shared timer wheel. Levels between 0 and 1 need a PWM, on a
+    plain pin they are rounded to on/off.
+    """
 
-    def __init__(self, pin: str="LED") -> None:
+    def __init__(self, pin: str="LED", pwm=None) -> None:
+        """
+        :param pin: pin name
+        :param pwm: optional robot_hat PWM driving the LED, for breathe()
+        """
         self.led = Pin(pin, mode=Pin.OUT)
-        self.blink_thread = None
-        self.blink_running = False
+        self.pwm = pwm
+        self.wheel = timer_wheel()
+        self.lock = threading.Lock()
+        self.timer = None
+        self.pattern = None
+        self.loop = False
+        self.step = 0
         self.value = 0
 
+    def _write(self, level: float) -> None:
+        if self.pwm is not None:
+            self.pwm.pulse_width_percent(level * 100)
+            self.value = 1 if level > 0 else 0
+        else:
+            self.value = 1 if level >= 0.5 else 0
+            self.led.value(self.value)
+
+    def _stop_pattern(self) -> None:
+        if self.timer is not None:
+            self.wheel.cancel(self.timer)
+            self.timer = None
+        self.pattern = None
+
+    def _next_step(self, pattern) -> None:
+        with self.lock:
+            if self.pattern is not pattern:
+                return # switched meanwhile
+            if self.step >= len(pattern):
+                if not self.loop:
+                    self.pattern = None
+                    self.timer = None
+                    return
+                self.step = 0
+            level, duration = pattern[self.step]
+            self.step += 1
+            self._write(level)
+            self.timer = self.wheel.schedule(duration, lambda: self._next_step(pattern))
+
+    def play(self, pattern: list, loop: bool=True) -> None:
+        """
+        Play a pattern, replacing the current one at once
+
+        :param pattern: [(level, seconds), ...]
+        :param loop: repeat until something else is played
+        """
+        pattern = tuple(pattern)
+        with self.lock:
+            self._stop_pattern()
+            self.pattern = pattern
+            self.loop = loop
+            self.step = 0
+        self._next_step(pattern)
+
     def on(self) -> None:
         self.blink_stop()
         self.led.on()
@@ -28,32 +179,54 @@ class LED:
         self.led.value(self.value)
 
     def blink(self, times: int=1, delay: float=0.1, pause: float=0) -> None:
-        self.blink_stop()
-        self.blink_thread = threading.Thread(name="LED Blink Thread", target=self.blink_loop, args=(times, delay, pause))
-        self.blink_thread.start()
+        """Blink times, delay seconds on and off, then pause seconds off, repeated"""
+        pattern = [(1, delay), (0, delay)] * times
+        if pause > 0:
+            pattern.append((0, pause))
+        self.play(pattern)
 
-    def blink_loop(self, times: int=1, delay: float=0.1, pause: float=0) -> None:
-        self.blink_running = True
-        self.led.off()
+    def double_blink(self, delay: float=0.1, pause: float=0.8) -> None:
+        self.blink(times=2, delay=delay, pause=pause)
+
+    def breathe(self, period: float=2, steps: int=20) -> None:
+        """Fade in and out over period seconds, on/off blink without a PWM"""
+        half = [i / steps for i in range(steps)]
+        levels = half + [1 - level for level in half]
+        self.play([(level, period / len(levels)) for level in levels])
+
+    MORSE = {
+        'a': '.-', 'b': '-...', 'c': '-.-.', 'd': '-..', 'e': '.', 'f': '..-.', 'g': '--.',
+        'h': '....', 'i': '..', 'j': '.---', 'k': '-.-', 'l': '.-..', 'm': '--', 'n': '-.',
+        'o': '---', 'p': '.--.', 'q': '--.-', 'r': '.-.', 's': '...', 't': '-', 'u': '..-',
+        'v': '...-', 'w': '.--', 'x': '-..-', 'y': '-.--', 'z': '--..',
+        '0': '-----', '1': '.----', '2': '..---', '3': '...--', '4': '....-',
+        '5': '.....', '6': '-....', '7': '--...', '8': '---..', '9': '----.',
+    }
+
+    def morse(self, text: str, unit: float=0.1, loop: bool=False) -> None:
+        """Spell text in morse code, dot is one unit on, dash three"""
+        pattern = []
+        for word in text.lower().split():
+            for letter in word:
+                code = self.MORSE.get(letter)
+                if code is None:
+                    continue
+                for mark in code:
+                    pattern.append((1, unit if mark == '.' else unit * 3))
+                    pattern.append((0, unit))
+                pattern[-1] = (0, unit * 3) # gap between letters
+            if pattern:
+                pattern[-1] = (0, unit * 7) # gap between words
+        if pattern:
+            self.play(pattern, loop=loop)
 
-        while self.blink_running:
-            count = 0
-            delay_start = time.time()
-            while count < times:
-                if time.time() - delay_start > delay:
-                    delay_start = time.time()
-                    self.toggle(skip_stop=True)
-                    count += 0.5
-                time.sleep(0.01)
-            pause_start = time.time()
-            while time.time() - pause_start < pause and self.blink_running:
-                time.sleep(0.01)
-            time.sleep(0.01)
+    @property
+    def blink_running(self) -> bool:
+        return self.pattern is not None
 
     def blink_stop(self) -> None:
-        if self.blink_running:
-            self.blink_running = False
-            self.blink_thread.join()
+        with self.lock:
+            self._stop_pattern()
 
     def close(self) -> None:
         self.blink_stop()
@@ -6,6 +6,8 @@ from .basic import _Basic_class
 
 class Pin(_Basic_class):
     """Pin manipulation class"""
+    __slots__ = ('_board_name', '_pin_num', '_value', 'gpio', '_mode', '_pull',
+                 '_bouncetime', '_user_dict')
 
     OUT = 0x01
     """Pin mode output"""
@@ -71,23 +73,25 @@ class Pin(_Basic_class):
         :type active_state: bool or None
         """
         super().__init__(*args, **kwargs)
+        self._user_dict = None
 
         # parse pin
+        _dict = self.dict()
         if isinstance(pin, str):
-            if pin not in self.dict().keys():
+            if pin not in _dict.keys():
                 raise ValueError(
-                    f'Pin should be in {self._dict.keys()}, not "{pin}"')
+                    f'Pin should be in {_dict.keys()}, not "{pin}"')
             self._board_name = pin
-            self._pin_num = self.dict()[pin]
+            self._pin_num = _dict[pin]
         elif isinstance(pin, int):
-            if pin not in self.dict().values():
+            if pin not in _dict.values():
                 raise ValueError(
-                    f'Pin should be in {self._dict.values()}, not "{pin}"')
-            self._board_name = {i for i in self._dict if self._dict[i] == pin}
+                    f'Pin should be in {_dict.values()}, not "{pin}"')
+            self._board_name = {i for i in _dict if _dict[i] == pin}
             self._pin_num = pin
         else:
             raise ValueError(
-                f'Pin should be in {self._dict.keys()}, not "{pin}"')
+                f'Pin should be in {_dict.keys()}, not "{pin}"')
         
 
         # setup
@@ -125,13 +129,15 @@ class Pin(_Basic_class):
         :rtype: dict
         """
         if _dict == None:
+            if self._user_dict is not None:
+                return self._user_dict
             return self._dict
         else:
             if not isinstance(_dict, dict):
                 raise ValueError(
                     f'Argument should be a pin dictionary like {{"my pin": ezblock.Pin.cpu.GPIO17}}, not {_dict}'
                 )
-            self._dict = _dict
+            self._user_dict = _dict
 
     def __call__(self, value):
         """
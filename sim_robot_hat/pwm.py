@@ -1,12 +1,62 @@
 #!/usr/bin/env python3
 import math
+import threading
 from .i2c import I2C
 
-timer = [{"arr": 1} for _ in range(7)]
+
+class PWMTimer(object):
+    """
+    Timer shared by the PWM channels on it
+
+    Holds the period(arr) and prescaler of one MCU timer. Updates go through
+    the lock so a period/prescaler change is seen as a whole by every channel,
+    while the cached percent to pulse width factor can be read lock free.
+    """
+    __slots__ = ('index', 'arr', 'prescaler', 'pulse_per_percent', 'lock')
+
+    def __init__(self, index):
+        """
+        Initialize timer
+
+        :param index: timer index(0-6)
+        :type index: int
+        """
+        self.index = index
+        self.arr = 1
+        self.prescaler = 1
+        self.pulse_per_percent = 0.01
+        self.lock = threading.RLock()
+
+    def set_arr(self, arr):
+        """
+        Set period, also updates the percent to pulse width factor
+
+        :param arr: period(0-65535)
+        :type arr: int
+        """
+        with self.lock:
+            self.arr = arr
+            self.pulse_per_percent = arr / 100.0
+
+    def set_prescaler(self, prescaler):
+        """
+        Set prescaler
+
+        :param prescaler: prescaler(0-65535)
+        :type prescaler: int
+        """
+        with self.lock:
+            self.prescaler = prescaler
+
+
+timers = tuple(PWMTimer(i) for i in range(7))
+"""Timers of the MCU, channels on the same timer share one PWMTimer"""
 
 
 class PWM(I2C):
     """Pulse width modulation (PWM)"""
+    __slots__ = ('channel', 'timer_index', '_timer', '_pulse_width',
+                 '_pulse_width_percent', '_freq')
 
     REG_CHN = 0x20
     """Channel register prefix"""
@@ -56,6 +106,7 @@ class PWM(I2C):
             self.timer_index = 5
         elif channel == 19:
             self.timer_index = 6
+        self._timer = timers[self.timer_index]
 
         self._pulse_width = 0
         self._freq = 50
@@ -101,9 +152,12 @@ class PWM(I2C):
         i = result_acy.index(min(result_acy))
         psc = result_ap[i][0]
         arr = result_ap[i][1]
-        self._debug(f"prescaler: {psc}, period: {arr}")
-        self.prescaler(psc)
-        self.period(arr)
+        if self._debug_on:
+            self._debug(f"prescaler: {psc}, period: {arr}")
+        # prescaler and period of a timer are updated together
+        with self._timer.lock:
+            self.prescaler(psc)
+            self.period(arr)
 
     def prescaler(self, prescaler=None):
         """
@@ -114,17 +168,21 @@ class PWM(I2C):
         :return: prescaler
         :rtype: int
         """
+        timer = self._timer
         if prescaler == None:
-            return self._prescaler
+            return timer.prescaler
 
-        self._prescaler = round(prescaler)
-        self._freq = self.CLOCK/self._prescaler/timer[self.timer_index]["arr"]
+        prescaler = round(prescaler)
         if self.timer_index < 4:
             reg = self.REG_PSC + self.timer_index
         else:
             reg = self.REG_PSC2 + self.timer_index - 4
-        self._debug(f"Set prescaler to: {self._prescaler}")
-        self._i2c_write(reg, self._prescaler-1)
+        with timer.lock:
+            timer.set_prescaler(prescaler)
+            self._freq = self.CLOCK/prescaler/timer.arr
+            if self._debug_on:
+                self._debug(f"Set prescaler to: {prescaler}")
+            self._i2c_write(reg, prescaler-1)
 
     def period(self, arr=None):
         """
@@ -135,20 +193,21 @@ class PWM(I2C):
         :return: period
         :rtype: int
         """
-        global timer
+        timer = self._timer
         if arr == None:
-            return timer[self.timer_index]["arr"]
-
-        timer[self.timer_index]["arr"] = round(arr)
-        self._freq = self.CLOCK/self._prescaler/timer[self.timer_index]["arr"]
+            return timer.arr
 
+        arr = round(arr)
         if self.timer_index < 4:
             reg = self.REG_ARR + self.timer_index
         else:
             reg = self.REG_ARR2 + self.timer_index - 4
-
-        self._debug(f"Set arr to: {timer[self.timer_index]['arr']}")
-        self._i2c_write(reg, timer[self.timer_index]["arr"])
+        with timer.lock:
+            timer.set_arr(arr)
+            self._freq = self.CLOCK/timer.prescaler/arr
+            if self._debug_on:
+                self._debug(f"Set arr to: {arr}")
+            self._i2c_write(reg, arr)
 
     def pulse_width(self, pulse_width=None):
         """
@@ -175,14 +234,11 @@ class PWM(I2C):
         :return: pulse width percentage
         :rtype: float
         """
-        global timer
         if pulse_width_percent == None:
             return self._pulse_width_percent
 
         self._pulse_width_percent = pulse_width_percent
-        temp = self._pulse_width_percent / 100.0
-        pulse_width = temp * timer[self.timer_index]["arr"]
-        self.pulse_width(pulse_width)
+        self.pulse_width(pulse_width_percent * self._timer.pulse_per_percent)
 
 
 def test():
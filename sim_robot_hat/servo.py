@@ -5,6 +5,7 @@ from .utils import mapping
 
 class Servo(PWM):
     """Servo motor class"""
+    __slots__ = ()
     MAX_PW = 2500
     MIN_PW = 500
     FREQ = 50
@@ -36,9 +37,10 @@ class Servo(PWM):
             angle = -90
         if angle > 90:
             angle = 90
-        self._debug(f"Set angle to: {angle}")
         pulse_width_time = mapping(angle, -90, 90, self.MIN_PW, self.MAX_PW)
-        self._debug(f"Pulse width: {pulse_width_time}")
+        if self._debug_on:
+            self._debug(f"Set angle to: {angle}")
+            self._debug(f"Pulse width: {pulse_width_time}")
         self.pulse_width_time(pulse_width_time)
 
     def pulse_width_time(self, pulse_width_time):
@@ -54,7 +56,8 @@ class Servo(PWM):
             pulse_width_time = self.MIN_PW
 
         pwr = pulse_width_time / 20000
-        self._debug(f"pulse width rate: {pwr}")
         value = int(pwr * self.PERIOD)
-        self._debug(f"pulse width value: {value}")
+        if self._debug_on:
+            self._debug(f"pulse width rate: {pwr}")
+            self._debug(f"pulse width value: {value}")
         self.pulse_width(value)
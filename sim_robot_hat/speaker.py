@@ -2,25 +2,342 @@ from .utils import enable_speaker, disable_speaker
 import os
 import pyaudio
 import soundfile as sf
-import librosa
 import numpy as np
 import threading
 import time
+from collections import deque
 from uuid import uuid4  # 用于生成唯一播放ID
 
+
+class BlockResampler:
+    """
+    分块线性插值重采样器
+
+    每次处理一块数据，保留上一块的最后一帧和小数位置，块与块之间连续无缝。
+    """
+
+    def __init__(self, src_rate, dst_rate, channels):
+        self.step = src_rate / dst_rate
+        # 下一个输出帧相对于缓存数据起点的位置（缓存第0帧是上一块的最后一帧）
+        self.pos = 1.0
+        self.last = np.zeros((1, channels), dtype=np.float32)
+
+    def process(self, block):
+        """重采样一块数据 (帧数, 声道数)，返回 float32 数据"""
+        data = np.concatenate((self.last, block))
+        end = len(data) - 1
+        if end <= self.pos:
+            n_out = 0
+        else:
+            n_out = int(np.ceil((end - self.pos) / self.step))
+        idx = self.pos + np.arange(n_out) * self.step
+        i0 = idx.astype(np.intp)
+        frac = (idx - i0)[:, None].astype(np.float32)
+        out = data[i0] * (1 - frac) + data[i0 + 1] * frac
+        self.pos += n_out * self.step - end
+        self.last = data[-1:]
+        return out.astype(np.float32, copy=False)
+
+
+class AudioStream:
+    """
+    流式音频解码器
+
+    按块读取和解码音频文件，需要时按块重采样，内存占用只有一块数据，
+    与文件长度无关。
+    """
+
+    def __init__(self, file_path, handler, block_size=1024, samplerate=None):
+        """
+        :param file_path: 音频文件路径
+        :param handler: 'soundfile' 或 'librosa'（mp3等格式用 audioread 流式解码）
+        :param block_size: 每块帧数
+        :param samplerate: 输出采样率，None 表示保持原采样率
+        """
+        self.block_size = block_size
+        self.handler = handler
+        if handler == 'soundfile':
+            self._file = sf.SoundFile(file_path)
+            self.channels = self._file.channels
+            src_rate = self._file.samplerate
+            src_frames = self._file.frames
+        else:  # librosa 支持的压缩格式，用其底层的 audioread 流式解码
+            import audioread
+            self._file = audioread.audio_open(file_path)
+            self.channels = self._file.channels
+            src_rate = self._file.samplerate
+            src_frames = int(self._file.duration * src_rate)
+
+        self.samplerate = samplerate or src_rate
+        if self.samplerate != src_rate:
+            self._resampler = BlockResampler(src_rate, self.samplerate, self.channels)
+        else:
+            self._resampler = None
+        self.total_frames = int(src_frames * self.samplerate / src_rate)
+
+    def _raw_blocks(self):
+        if self.handler == 'soundfile':
+            for block in self._file.blocks(blocksize=self.block_size,
+                                           dtype='float32', always_2d=True):
+                yield block
+        else:
+            # audioread 输出 16 位整数交错数据
+            # read_data 的参数是字节数: 帧数 * 声道数 * 2 字节
+            for buf in self._file.read_data(self.block_size * self._file.channels * 2):
+                block = np.frombuffer(buf, dtype='<i2').astype(np.float32) / 32768.0
+                yield block.reshape(-1, self.channels)
+
+    def blocks(self):
+        """逐块生成 float32 数据 (帧数, 声道数)"""
+        for block in self._raw_blocks():
+            if self._resampler is not None:
+                block = self._resampler.process(block)
+                if len(block) == 0:
+                    continue
+            yield block
+
+    def close(self):
+        """关闭文件"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def fit_channels(block, channels):
+    """把 (帧数, 声道数) 数据转换为指定声道数"""
+    src = block.shape[1]
+    if src == channels:
+        return block
+    if src == 1:
+        return np.repeat(block, channels, axis=1)
+    if channels == 1:
+        return block.mean(axis=1, keepdims=True)
+    return block[:, :channels]
+
+
+class Voice:
+    """
+    混音器中的一路声音
+
+    记录增益、淡入淡出、暂停状态和播放位置，由混音回调按块读取。
+    子类实现 read()/fill()。
+    """
+
+    def __init__(self, task_id, samplerate, total_frames, volume=1.0, fade_in=0):
+        self.task_id = task_id
+        self.samplerate = samplerate
+        self.total_frames = total_frames
+        self.position = 0
+        self.volume = volume
+        self.gain = 0.0
+        self.target = volume
+        self.step = 0.0
+        self.on_target = None  # 增益到达目标后执行: 'pause' 或 'stop'
+        self.paused = False
+        self.finished = False
+        self.ramp(volume, fade_in)
+
+    def ramp(self, target, fade=0, on_target=None):
+        """在 fade 秒内把增益线性变化到 target"""
+        self.target = target
+        self.on_target = on_target
+        frames = fade * self.samplerate
+        if frames < 1 or self.gain == target:
+            self.gain = target
+            self.step = 0.0
+            self._reach_target()
+        else:
+            self.step = (target - self.gain) / frames
+
+    def _reach_target(self):
+        if self.on_target == 'pause':
+            self.paused = True
+        elif self.on_target == 'stop':
+            self.finished = True
+        self.on_target = None
+
+    def gains(self, n):
+        """返回接下来 n 帧的增益（标量或 (n, 1) 数组）"""
+        if self.gain == self.target:
+            return self.gain
+        ramp = self.gain + self.step * np.arange(1, n + 1, dtype=np.float32)
+        if self.step > 0:
+            ramp = np.minimum(ramp, self.target)
+        else:
+            ramp = np.maximum(ramp, self.target)
+        self.gain = float(ramp[-1])
+        if self.gain == self.target:
+            self._reach_target()
+        return ramp[:, None]
+
+    def read(self, n):
+        """读取最多 n 帧，数据不足返回更短的数据"""
+        raise NotImplementedError
+
+    def fill(self):
+        """在后台线程补充缓冲，返回是否还需要继续补充"""
+        return False
+
+    def close(self):
+        pass
+
+
+class StreamVoice(Voice):
+    """从 AudioStream 流式解码的声音，由后台解码线程填充有限的缓冲"""
+
+    def __init__(self, task_id, source, channels, max_buffers=4, **kwargs):
+        super().__init__(task_id, source.samplerate, source.total_frames, **kwargs)
+        self.source = source
+        self.channels = channels
+        self.max_buffers = max_buffers
+        self.buffers = deque()
+        self.offset = 0  # 第一个缓冲块里已读的帧数
+        self.eof = False
+        self._blocks = source.blocks()
+
+    def fill(self):
+        while not self.eof and len(self.buffers) < self.max_buffers:
+            try:
+                block = next(self._blocks)
+            except StopIteration:
+                self.eof = True
+                break
+            self.buffers.append(fit_channels(block, self.channels))
+        return not self.eof
+
+    def read(self, n):
+        parts = []
+        got = 0
+        while got < n and self.buffers:
+            block = self.buffers[0]
+            take = min(n - got, len(block) - self.offset)
+            parts.append(block[self.offset:self.offset + take])
+            got += take
+            self.offset += take
+            if self.offset >= len(block):
+                self.buffers.popleft()
+                self.offset = 0
+        if self.eof and not self.buffers:
+            self.finished = True
+        self.position += got
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            return None
+        return np.concatenate(parts)
+
+    def close(self):
+        self.source.close()
+
+
+class BufferVoice(Voice):
+    """从预先解码好的只读 PCM 缓冲播放的声音，不需要解码线程"""
+
+    def __init__(self, task_id, data, samplerate, **kwargs):
+        super().__init__(task_id, samplerate, len(data), **kwargs)
+        self.data = data
+
+    def read(self, n):
+        start = self.position
+        chunk = self.data[start:start + n]
+        self.position = start + len(chunk)
+        if self.position >= len(self.data):
+            self.finished = True
+        return chunk
+
+
+class SoundBank:
+    """
+    预加载音效库
+
+    启动时把音效文件一次性解码并重采样成喇叭的输出格式，保存为共享的只读
+    PCM 缓冲。触发音效时不读盘也不解码，只是往混音器里加一路声音，可以在
+    任意线程调用，延迟不超过一个输出块（block_size=256 时约 6 ms）。
+    """
+
+    def __init__(self, speaker, sounds_dir=None, exts=('wav',)):
+        """
+        :param speaker: Speaker 对象
+        :param sounds_dir: 音效目录，不为 None 时加载其中的所有音效
+        :param exts: 加载目录时的文件扩展名
+        """
+        self.speaker = speaker
+        self.sounds = {}
+        if sounds_dir is not None:
+            self.load_dir(sounds_dir, exts)
+
+    def load(self, name, file_path):
+        """
+        解码并缓存一个音效
+        :param name: 音效名称
+        :param file_path: 音频文件路径
+        """
+        handler = self.speaker._get_handler(file_path)
+        source = self.speaker._open_stream(file_path, handler)
+        try:
+            blocks = [fit_channels(block, self.speaker.channels) for block in source.blocks()]
+        finally:
+            source.close()
+        if blocks:
+            data = np.ascontiguousarray(np.concatenate(blocks), dtype=np.float32)
+        else:
+            data = np.zeros((0, self.speaker.channels), dtype=np.float32)
+        data.flags.writeable = False
+        self.sounds[name] = data
+
+    def load_dir(self, sounds_dir, exts=('wav',)):
+        """加载目录下的音效，名称为不带扩展名的文件名"""
+        for file_name in sorted(os.listdir(sounds_dir)):
+            name, ext = os.path.splitext(file_name)
+            if ext.lower().lstrip('.') in exts:
+                self.load(name, os.path.join(sounds_dir, file_name))
+
+    def names(self):
+        """已加载的音效名称"""
+        return list(self.sounds.keys())
+
+    def trigger(self, name, volume=1.0):
+        """
+        播放一个已加载的音效
+        :param name: 音效名称
+        :param volume: 音量增益（0-1）
+        :return: 播放任务ID
+        """
+        if name not in self.sounds:
+            raise ValueError(f"音效未加载：{name}")
+        return self.speaker.play_buffer(self.sounds[name], volume=volume)
+
+
 class Speaker:
-    def __init__(self):
+    """
+    喇叭播放
+
+    只打开一个常驻的音频输出流，由回调函数把所有正在播放的声音混音后输出。
+    压缩格式的解码在一个共享的后台线程中进行，线程数量不随播放任务增加。
+    """
+    BLOCK_SIZE = 1024  # 每次解码/播放的帧数
+    SAMPLERATE = 44100
+    CHANNELS = 2
+    FADE_TIME = 0.02  # 暂停/恢复/停止的默认淡入淡出时间（秒）
+
+    def __init__(self, samplerate=SAMPLERATE, channels=CHANNELS, block_size=BLOCK_SIZE):
+        """
+        :param samplerate: 输出采样率，所有声音都会重采样到这个采样率
+        :param channels: 输出声道数
+        :param block_size: 每次解码/播放的帧数
+        """
+        self.samplerate = samplerate
+        self.channels = channels
+        self.block_size = block_size
+
         # 初始化喇叭状态
         self.speaker_enabled = False
         self.enable_speaker()  # 启动时开启喇叭
-        
-        # 初始化音频系统
-        self.pa = pyaudio.PyAudio()
-        
-        # 播放任务管理（ID -> 播放信息）
-        self.play_tasks = {}  # 格式: {id: {stream, thread, is_playing, position, total_frames, samplerate}}
+
+        # 播放任务管理（ID -> Voice）
+        self.play_tasks = {}
         self.task_lock = threading.Lock()  # 线程安全锁
-        
+
         # 支持的格式
         self.supported_formats = {
             'wav': {'handler': 'soundfile'},
@@ -32,15 +349,50 @@ class Speaker:
             'wma': {'handler': 'librosa'}
         }
 
+        self._finished = deque()  # 已结束、等待解码线程关闭的声音
+        self._fill_event = threading.Event()
+
+        # 初始化音频系统，打开常驻输出流
+        self.pa = pyaudio.PyAudio()
+        self.stream = self.pa.open(
+            format=pyaudio.paFloat32,
+            channels=self.channels,
+            rate=self.samplerate,
+            output=True,
+            frames_per_buffer=self.block_size,
+            stream_callback=self._callback,
+            start=False
+        )
+
+        # 后台解码线程，由混音回调唤醒
+        self._running = True
+        self._fill_thread = threading.Thread(
+            name="speaker_decoder",
+            target=self._fill_loop,
+            daemon=True
+        )
+        self._fill_thread.start()
+        self.stream.start_stream()
+
     def __del__(self):
-        # 销毁时关闭喇叭和音频资源
-        self.disable_speaker()
-        self.pa.terminate()
-        
-        # 停止所有播放任务
+        self.close()
+
+    def close(self):
+        """停止所有播放，关闭输出流和喇叭"""
+        if not getattr(self, '_running', False):
+            return
+        self._running = False
+        self._fill_event.set()
+        self._fill_thread.join(timeout=1.0)
         with self.task_lock:
-            for task_id in list(self.play_tasks.keys()):
-                self.stop(task_id)
+            voices = list(self.play_tasks.values())
+            self.play_tasks.clear()
+        for voice in voices:
+            voice.close()
+        self.stream.stop_stream()
+        self.stream.close()
+        self.pa.terminate()
+        self.disable_speaker()
 
     def enable_speaker(self):
         """开启喇叭"""
@@ -61,167 +413,149 @@ class Speaker:
             raise ValueError(f"不支持的格式：{ext}，支持格式：{list(self.supported_formats.keys())}")
         return self.supported_formats[ext]['handler']
 
-    def _read_audio(self, file_path, handler):
-        """读取音频数据"""
-        if handler == 'soundfile':
-            data, samplerate = sf.read(file_path)
-        else:  # librosa
-            data, samplerate = librosa.load(file_path, sr=None, mono=False)
-            if data.ndim > 1:
-                data = data.T  # 转置为(帧数, 声道数)
-        return data.astype(np.float32), samplerate
-
-    def _play_background(self, task_id, data, samplerate, channels):
-        """后台播放线程函数"""
-        try:
-            # 打开音频流
-            stream = self.pa.open(
-                format=pyaudio.paFloat32,
-                channels=channels,
-                rate=samplerate,
-                output=True
-            )
-
-            # 更新任务信息
+    def _open_stream(self, file_path, handler):
+        """打开流式解码器（不会一次性读入整个文件）"""
+        return AudioStream(file_path, handler,
+                           block_size=self.block_size,
+                           samplerate=self.samplerate)
+
+    def _mix(self, frame_count):
+        """把所有正在播放的声音混音成 (frame_count, channels) 数据"""
+        out = np.zeros((frame_count, self.channels), dtype=np.float32)
+        finished = []
+        with self.task_lock:
+            voices = list(self.play_tasks.values())
+        for voice in voices:
+            if voice.finished:
+                finished.append(voice)
+                continue
+            if voice.paused:
+                continue
+            chunk = voice.read(frame_count)
+            if chunk is not None and len(chunk) > 0:
+                out[:len(chunk)] += chunk * voice.gains(len(chunk))
+            if voice.finished:
+                finished.append(voice)
+        if finished:
             with self.task_lock:
-                self.play_tasks[task_id].update({
-                    'stream': stream,
-                    'is_playing': True,
-                    'position': 0,
-                    'total_frames': len(data),
-                    'samplerate': samplerate
-                })
-
-            chunk_size = 1024
-            task = self.play_tasks[task_id]
-
-            # 播放循环
-            while task['position'] < len(data) and task['is_playing']:
-                # 检查暂停状态
-                while not task['is_playing']:
-                    time.sleep(0.1)
-                    if task.get('stopped', False):
-                        break
-
-                if task.get('stopped', False):
-                    break
-
-                # 计算当前块
-                end = min(task['position'] + chunk_size, len(data))
-                chunk = data[task['position']:end]
-                
-                # 处理单声道
-                if channels == 1 and len(chunk.shape) == 1:
-                    chunk = np.expand_dims(chunk, axis=1)
-
-                # 播放
-                stream.write(chunk.tobytes())
-                
-                # 更新位置
-                with self.task_lock:
-                    task['position'] = end
-
-        except Exception as e:
-            print(f"播放错误 (ID: {task_id}): {str(e)}")
-        finally:
-            # 清理资源
+                for voice in finished:
+                    self.play_tasks.pop(voice.task_id, None)
+        np.clip(out, -1.0, 1.0, out=out)
+        return out, finished
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        """音频输出回调"""
+        out, finished = self._mix(frame_count)
+        self._finished.extend(finished)
+        self._fill_event.set()
+        return (out.tobytes(), pyaudio.paContinue)
+
+    def _fill_loop(self):
+        """后台解码线程：补充每路声音的缓冲，关闭结束的声音"""
+        while self._running:
+            self._fill_event.wait()
+            self._fill_event.clear()
+            while self._finished:
+                self._finished.popleft().close()
             with self.task_lock:
-                if task_id in self.play_tasks:
-                    stream = self.play_tasks[task_id].get('stream')
-                    if stream:
-                        stream.stop_stream()
-                        stream.close()
-                    del self.play_tasks[task_id]
-
-    def play(self, file_path):
+                voices = list(self.play_tasks.values())
+            for voice in voices:
+                if not voice.paused:
+                    voice.fill()
+
+    def _add_voice(self, voice):
+        with self.task_lock:
+            self.play_tasks[voice.task_id] = voice
+
+    def play(self, file_path, volume=1.0, fade_in=0):
         """
         后台播放音频并返回唯一ID
+        :param volume: 音量增益（0-1）
+        :param fade_in: 淡入时间（秒）
         :return: 播放任务ID（字符串）
         """
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"文件不存在：{file_path}")
 
-        # 读取音频数据
+        # 打开解码器，只读取文件头
         handler = self._get_handler(file_path)
-        data, samplerate = self._read_audio(file_path, handler)
-        channels = data.shape[1] if len(data.shape) > 1 else 1
+        source = self._open_stream(file_path, handler)
 
-        # 生成唯一ID
+        # 生成唯一ID，先预解码一块，保证第一个回调就能出声
         task_id = str(uuid4())
+        voice = StreamVoice(task_id, source, self.channels,
+                            volume=volume, fade_in=fade_in)
+        voice.fill()
+        self._add_voice(voice)
+        return task_id
 
-        # 初始化任务信息
-        with self.task_lock:
-            self.play_tasks[task_id] = {
-                'is_playing': False,
-                'position': 0,
-                'thread': None,
-                'stopped': False
-            }
-
-        # 创建并启动播放线程
-        thread = threading.Thread(
-            name=f"play_background_{task_id}",
-            target=self._play_background,
-            args=(task_id, data, samplerate, channels),
-            daemon=True
-        )
-        thread.start()
-
-        # 记录线程信息
-        with self.task_lock:
-            self.play_tasks[task_id]['thread'] = thread
-
+    def play_buffer(self, data, volume=1.0, fade_in=0):
+        """
+        播放已解码好的 PCM 数据（输出采样率、输出声道数的 float32 数组）
+        :return: 播放任务ID（字符串）
+        """
+        task_id = str(uuid4())
+        self._add_voice(BufferVoice(task_id, data, self.samplerate,
+                                    volume=volume, fade_in=fade_in))
         return task_id
 
+    def _get_voice(self, task_id):
+        voice = self.play_tasks.get(task_id)
+        if voice is None:
+            raise ValueError(f"无效的播放ID：{task_id}")
+        return voice
+
     def get_progress(self, task_id):
         """
         获取播放进度
         :return: 字典包含 position(当前帧数), total(总帧数), progress(0-1), time(秒)
         """
         with self.task_lock:
-            if task_id not in self.play_tasks:
-                raise ValueError(f"无效的播放ID：{task_id}")
-            
-            task = self.play_tasks[task_id]
-            total = task['total_frames']
-            position = task['position']
-            samplerate = task['samplerate']
-            
+            voice = self._get_voice(task_id)
+            total = voice.total_frames
+            position = voice.position
+            samplerate = voice.samplerate
+
             return {
                 'position': position,
                 'total': total,
                 'progress': position / total if total > 0 else 0,
                 'time': position / samplerate if samplerate > 0 else 0,
                 'total_time': total / samplerate if samplerate > 0 else 0,
-                'is_playing': task['is_playing']
+                'is_playing': not voice.paused
             }
 
-    def pause(self, task_id):
-        """暂停播放"""
+    def set_volume(self, task_id, volume, fade=FADE_TIME):
+        """设置某个播放任务的音量增益（0-1）"""
         with self.task_lock:
-            if task_id not in self.play_tasks:
-                raise ValueError(f"无效的播放ID：{task_id}")
-            self.play_tasks[task_id]['is_playing'] = False
+            voice = self._get_voice(task_id)
+            voice.volume = volume
+            if not voice.paused:
+                voice.ramp(volume, fade)
 
-    def resume(self, task_id):
-        """恢复播放"""
+    def pause(self, task_id, fade=FADE_TIME):
+        """淡出后暂停播放"""
         with self.task_lock:
-            if task_id not in self.play_tasks:
-                raise ValueError(f"无效的播放ID：{task_id}")
-            self.play_tasks[task_id]['is_playing'] = True
+            self._get_voice(task_id).ramp(0.0, fade, on_target='pause')
 
-    def stop(self, task_id):
-        """停止播放并清理资源"""
+    def resume(self, task_id, fade=FADE_TIME):
+        """恢复播放并淡入"""
         with self.task_lock:
-            if task_id not in self.play_tasks:
-                return False  # 已停止或不存在
-            
-            task = self.play_tasks[task_id]
-            task['is_playing'] = False
-            task['stopped'] = True
+            voice = self._get_voice(task_id)
+            voice.paused = False
+            voice.ramp(voice.volume, fade)
+        self._fill_event.set()
 
-        # 等待线程结束
-        task['thread'].join(timeout=1.0)
+    def stop(self, task_id, fade=FADE_TIME):
+        """淡出后停止播放，资源由解码线程释放"""
+        with self.task_lock:
+            voice = self.play_tasks.get(task_id)
+            if voice is None:
+                return False  # 已停止或不存在
+            if voice.paused:
+                voice.finished = True
+            else:
+                voice.ramp(0.0, fade, on_target='stop')
         return True
 
     def list_tasks(self):
@@ -235,10 +569,10 @@ if __name__ == "__main__":
     speaker = Speaker()
     try:
         # 启动后台播放
-        task1 = speaker.play("test.mp3")
+        task1 = speaker.play("../musics/slow-trail-Ahjay_Stelino.mp3", volume=0.6, fade_in=1.0)
         print(f"启动播放任务 1: {task1}")
-        
-        task2 = speaker.play("music.wav")
+
+        task2 = speaker.play("../sounds/car-double-horn.wav")
         print(f"启动播放任务 2: {task2}")
 
         # 展示控制功能
@@ -248,7 +582,6 @@ if __name__ == "__main__":
 
         time.sleep(1)
         print("任务1进度:", speaker.get_progress(task1))
-        print("任务2进度:", speaker.get_progress(task2))
 
         time.sleep(2)
         print("恢复任务1")
@@ -257,7 +590,8 @@ if __name__ == "__main__":
         time.sleep(3)
         print("停止所有任务")
         for task_id in speaker.list_tasks():
-            speaker.stop(task_id)
+            speaker.stop(task_id, fade=0.5)
+        time.sleep(0.6)
 
     finally:
-        del speaker  # 触发析构函数，清理资源
+        speaker.close()